@@ -1,4 +1,15 @@
-from collections import defaultdict
+import sys
+import time
+import hashlib
+import itertools
+import numpy as np
+from collections import Counter, defaultdict
+from joblib import Parallel, delayed
+from sklearn.metrics import f1_score, precision_score, recall_score
+from sklearn.linear_model import LogisticRegression
+from sklearn.model_selection import StratifiedKFold
+from sklearn.feature_extraction.text import CountVectorizer, \
+    TfidfTransformer
 from indra.sources import signor
 from indra.statements import RegulateActivity, RegulateAmount
 from indra.tools import assemble_corpus as ac
@@ -15,35 +26,105 @@ def get_signor_stmts():
         ac.filter_by_type(sp.statements, RegulateAmount)
 
 
-def get_signor_xor_texts(act_stmts, amt_stmts):
+class PairIndex(object):
+    """Index of subject-object pairs by the type of regulation between them.
+
+    Each grounding is interned to an integer ID and each (subject, object)
+    pair is keyed by a single integer combining the two IDs. For each pair
+    the index keeps a bit mask of the regulation types it was seen with and
+    the evidence texts of its statements, deduplicated by content hash.
+    """
+    ACT = 1
+    AMT = 2
+
+    def __init__(self):
+        self.grounding_ids = {}
+        self.pair_types = defaultdict(int)
+        self.pair_texts = defaultdict(dict)
+
+    def get_key(self, stmt, add=False):
+        """Return the integer key of a statement's subject-object pair.
+
+        None is returned if the statement is missing its subject or object,
+        or if `add` is False and either grounding hasn't been seen.
+        """
+        ids = []
+        for agent in (stmt.subj, stmt.obj):
+            if agent is None:
+                return None
+            grounding = agent.get_grounding()
+            grounding_id = self.grounding_ids.get(grounding)
+            if grounding_id is None:
+                if not add:
+                    return None
+                grounding_id = self.grounding_ids[grounding] = \
+                    len(self.grounding_ids)
+            ids.append(grounding_id)
+        return (ids[0] << 32) | ids[1]
+
+    def add_statements(self, stmts, reg_type):
+        """Add statements of a regulation type, skipping those missing their
+        subject or object."""
+        for stmt in stmts:
+            key = self.get_key(stmt, add=True)
+            if key is None:
+                continue
+            self.pair_types[key] |= reg_type
+            add_ev_texts(stmt, self.pair_texts[key])
+
+    def get_exclusive_keys(self, reg_type):
+        """Return the keys of pairs seen only with a given regulation type."""
+        return {key for key, types in self.pair_types.items()
+                if types == reg_type}
+
+    def get_texts(self, keys):
+        """Return the unique evidence texts of a set of pairs."""
+        texts = {}
+        for key in keys:
+            texts.update(self.pair_texts[key])
+        return list(texts.values())
+
+
+def get_signor_index(act_stmts, amt_stmts):
+    """Return a PairIndex of SIGNOR activity and amount regulations."""
+    index = PairIndex()
+    index.add_statements(act_stmts, PairIndex.ACT)
+    index.add_statements(amt_stmts, PairIndex.AMT)
+    return index
+
+
+def get_signor_xor_texts(act_stmts, amt_stmts, index=None):
     """Return evidence text for activity/amount only (exclusive) regulations."""
+    if index is None:
+        index = get_signor_index(act_stmts, amt_stmts)
+    overlapping = [key for key, types in index.pair_types.items()
+                   if types == (PairIndex.ACT | PairIndex.AMT)]
+    print('%s keys are overlapping' % len(overlapping))
+    return index.get_texts(index.get_exclusive_keys(PairIndex.ACT)), \
+        index.get_texts(index.get_exclusive_keys(PairIndex.AMT))
+
+
+def get_reading_xor_texts(index, stmts):
+    """Return evidence texts of statements matching exclusive SIGNOR pairs.
 
-    # We build up a set of A-B keys to find exclusively activity vs amount
-    # regulation statements
-    act_dict = defaultdict(list)
-    for stmt in act_stmts:
-        key = (stmt.subj.get_grounding(),
-               stmt.obj.get_grounding())
-        act_dict[key].append(stmt)
-    amt_dict = defaultdict(list)
-    for stmt in amt_stmts:
-        key = (stmt.subj.get_grounding(),
-               stmt.obj.get_grounding())
-        amt_dict[key].append(stmt)
-    disallowed_keys = set(act_dict.keys()) & set(amt_dict.keys())
-    print('%s keys are overlapping' % len(disallowed_keys))
-    act_dict = {k: v for k, v in act_dict.items() if k not in disallowed_keys}
-    amt_dict = {k: v for k, v in amt_dict.items() if k not in disallowed_keys}
-
-    act_txts = []
-    for stmts in act_dict.values():
-        act_txts += get_ev_texts(stmts)
-    amt_txts = []
-    for stmts in amt_dict.values():
-        amt_txts += get_ev_texts(stmts)
-    # We make the lists unique because there's quite a bit
-    # of duplication
-    return list(set(act_txts)), list(set(amt_txts))
+    Each statement's subject-object pair is looked up in the index of
+    SIGNOR pairs, and its evidence texts are collected as activity or
+    amount examples if the pair is exclusively an activity or an amount
+    regulation in SIGNOR.
+    """
+    act_keys = index.get_exclusive_keys(PairIndex.ACT)
+    amt_keys = index.get_exclusive_keys(PairIndex.AMT)
+    act_txts = {}
+    amt_txts = {}
+    for stmt in stmts:
+        if not hasattr(stmt, 'subj') or not hasattr(stmt, 'obj'):
+            continue
+        key = index.get_key(stmt)
+        if key in act_keys:
+            add_ev_texts(stmt, act_txts)
+        elif key in amt_keys:
+            add_ev_texts(stmt, amt_txts)
+    return list(act_txts.values()), list(amt_txts.values())
 
 
 def get_curation_texts():
@@ -78,18 +159,212 @@ def get_ev_texts(stmts):
     return txts
 
 
+def add_ev_texts(stmt, texts):
+    """Add a statement's evidence texts to a dict keyed by content hash."""
+    for ev in stmt.evidence:
+        if ev.text:
+            texts.setdefault(
+                hashlib.md5(ev.text.encode('utf-8')).digest(), ev.text)
+
+
+def get_fold_features(texts, y, train_idx, test_idx, ngram_range,
+                      stop_words=None):
+    """Return the document-term matrices of a cross-validation fold.
+
+    The vocabulary is learned on the training texts only, without a limit
+    on the number of features, using the stop words of the classifier. The
+    columns are also returned in the order in which TfidfVectorizer selects
+    them by training term frequency so that any max_features setting can be
+    applied by slicing.
+    """
+    # Counts are floats as in TfidfVectorizer, so that ties in term
+    # frequency are sorted the same way
+    vect = CountVectorizer(ngram_range=ngram_range, stop_words=stop_words,
+                           dtype=np.float64)
+    X_train = vect.fit_transform(texts[train_idx])
+    X_test = vect.transform(texts[test_idx])
+    term_freqs = np.asarray(X_train.sum(axis=0)).ravel()
+    # The order of CountVectorizer._limit_features, which breaks ties with
+    # numpy's default (unstable) sort rather than by vocabulary order
+    col_order = (-term_freqs).argsort()
+    return X_train, X_test, y[train_idx], y[test_idx], col_order
+
+
+def get_cv_splits(y, cv):
+    """Return the (train, test) indices of the cross-validation folds."""
+    return list(StratifiedKFold(n_splits=cv, shuffle=True,
+                                random_state=1729).split(np.zeros(len(y)), y))
+
+
+def score_grid_point(folds, C, max_features, pos_labels, random_state=None):
+    """Return the scores of each fold and the time taken for one parameter
+    setting.
+
+    The model of each fold is the one AdeftClassifier.train fits: a
+    TfidfVectorizer limited to max_features followed by an L1 penalized
+    LogisticRegression, here fitted on the fold's cached counts.
+    """
+    ts = time.time()
+    scores = defaultdict(list)
+    for X_train, X_test, y_train, y_test, col_order in folds:
+        # TfidfVectorizer keeps the selected columns in vocabulary order
+        cols = np.sort(col_order[:max_features])
+        tfidf = TfidfTransformer().fit(X_train[:, cols])
+        lr = LogisticRegression(C=C, solver='saga', penalty='l1',
+                                random_state=random_state)
+        lr.fit(tfidf.transform(X_train[:, cols]), y_train)
+        y_pred = lr.predict(tfidf.transform(X_test[:, cols]))
+        for name, score_fun in (('f1', f1_score), ('pr', precision_score),
+                                ('rc', recall_score)):
+            scores[name].append(score_fun(y_test, y_pred, labels=pos_labels,
+                                          average='micro'))
+            for label in sorted(set(y_train)):
+                scores['%s_%s' % (name, label)].append(
+                    score_fun(y_test, y_pred, labels=[label],
+                              average='micro'))
+    return scores, time.time() - ts
+
+
+def get_cv_stats(labels, scores):
+    """Return the statistics of a grid point's fold scores in the format of
+    AdeftClassifier.stats."""
+    mean_std = lambda name: {'mean': np.round(np.mean(scores[name]), 6),
+                             'std': np.round(np.std(scores[name]), 6)}
+    stats = {'label_distribution': dict(Counter(labels)),
+             'f1': mean_std('f1'), 'precision': mean_std('pr'),
+             'recall': mean_std('rc')}
+    for label in sorted(set(labels)):
+        stats[label] = {name: mean_std('%s_%s' % (name, label))
+                        for name in ('f1', 'pr', 'rc')}
+    return stats
+
+
+def cached_cv(texts, labels, param_grid, cv=5, n_jobs=-1, stop_words=None,
+              pos_labels=None, random_state=None):
+    """Cross-validate a grid of parameters, featurizing each fold only once.
+
+    The texts of each fold are tokenized once per ngram_range and the
+    resulting document-term matrices are reused for all values of
+    max_features and C. Featurization and grid points are run in parallel.
+    Each grid point is scored with the model AdeftClassifier.train fits, and
+    as in AdeftClassifier.cv, grid points are ranked by the micro-averaged
+    F1 score of the positive labels.
+
+    Parameters
+    ----------
+    texts : list[str]
+        The training texts.
+    labels : list[str]
+        The label of each text.
+    param_grid : dict
+        Lists of values for C, max_features and ngram_range.
+    cv : Optional[int]
+        The number of folds. Default: 5
+    n_jobs : Optional[int]
+        The number of parallel jobs, -1 for all cores. Default: -1
+    stop_words : Optional[list[str]]
+        The stop words of the classifier, e.g., its stop attribute.
+    pos_labels : Optional[list[str]]
+        The positive labels. Default: all labels
+    random_state : Optional[int]
+        The random state of the logistic regression.
+
+    Returns
+    -------
+    list[dict]
+        The parameters, mean and standard deviation of the F1 score, time
+        taken and AdeftClassifier style stats of each grid point, best
+        first.
+    """
+    texts = np.array(texts, dtype=object)
+    y = np.array(labels)
+    if pos_labels is None:
+        pos_labels = sorted(set(labels))
+    splits = get_cv_splits(y, cv)
+    folds_by_ngram = {}
+    with Parallel(n_jobs=n_jobs) as parallel:
+        for ngram_range in param_grid['ngram_range']:
+            ts = time.time()
+            folds_by_ngram[ngram_range] = parallel(
+                delayed(get_fold_features)(texts, y, train_idx, test_idx,
+                                           ngram_range, stop_words)
+                for train_idx, test_idx in splits)
+            print('Featurized %d folds with ngram_range=%s in %.1f sec' %
+                  (cv, ngram_range, time.time() - ts))
+        grid = [dict(zip(('C', 'max_features', 'ngram_range'), values))
+                for values in itertools.product(param_grid['C'],
+                                                param_grid['max_features'],
+                                                param_grid['ngram_range'])]
+        scores = parallel(
+            delayed(score_grid_point)(folds_by_ngram[params['ngram_range']],
+                                      params['C'], params['max_features'],
+                                      pos_labels, random_state)
+            for params in grid)
+    results = []
+    for params, (fold_scores, elapsed) in zip(grid, scores):
+        stats = get_cv_stats(labels, fold_scores)
+        results.append({'params': params, 'f1': stats['f1']['mean'],
+                        'f1_std': stats['f1']['std'], 'time': elapsed,
+                        'stats': stats})
+    results.sort(key=lambda x: x['f1'], reverse=True)
+    for res in results:
+        print('%s: F1 %.3f (+/- %.3f) in %.1f sec' %
+              (res['params'], res['f1'], res['f1_std'], res['time']))
+    return results
+
+
+def compare_with_adeft_train(cl, texts, labels, param_grid, cv=5,
+                             pos_labels=None):
+    """Check that the cached CV scores match those of AdeftClassifier.train.
+
+    Each grid point is scored on each fold once from the cached counts, as
+    in cached_cv, and once by training the classifier on the texts of the
+    fold, which fits Adeft's own pipeline from scratch.
+    """
+    texts = np.array(texts, dtype=object)
+    y = np.array(labels)
+    if pos_labels is None:
+        pos_labels = sorted(set(labels))
+    splits = get_cv_splits(y, cv)
+    num_checked = 0
+    for ngram_range in param_grid['ngram_range']:
+        folds = [get_fold_features(texts, y, train_idx, test_idx,
+                                   ngram_range, sorted(cl.stop))
+                 for train_idx, test_idx in splits]
+        for C, max_features in itertools.product(param_grid['C'],
+                                                 param_grid['max_features']):
+            scores, _ = score_grid_point(folds, C, max_features, pos_labels,
+                                         cl.random_state)
+            train_f1s = []
+            for train_idx, test_idx in splits:
+                cl.train(list(texts[train_idx]), list(y[train_idx]), C=C,
+                         ngram_range=ngram_range, max_features=max_features)
+                y_pred = cl.predict(list(texts[test_idx]))
+                train_f1s.append(f1_score(y[test_idx], y_pred,
+                                          labels=pos_labels,
+                                          average='micro'))
+            assert np.allclose(scores['f1'], train_f1s), \
+                (C, max_features, ngram_range, scores['f1'], train_f1s)
+            num_checked += 1
+    print('Cached CV scores match AdeftClassifier.train for %d grid points'
+          % num_checked)
+
+
 if __name__ == '__main__':
     # Approach 1: get training examples from curations
     # act_txts, amt_txts = get_curation_texts()
 
     # Approach 2: get training examples from Signor sentences
     signor_act, signor_amt = get_signor_stmts()
-    act_txts, amt_txts = get_signor_xor_texts(signor_act, signor_amt)
+    signor_index = get_signor_index(signor_act, signor_amt)
+    act_txts, amt_txts = get_signor_xor_texts(signor_act, signor_amt,
+                                              signor_index)
 
     # Approach 3: use Signor to find A->B pairs that are exclusively
     # activity or amount regulations, and then find corresponding evidence
     # sentences from reading for A->B Statements.
-    # TODO
+    # reading_stmts = ac.load_statements('reading_stmts.pkl')
+    # act_txts, amt_txts = get_reading_xor_texts(signor_index, reading_stmts)
 
     # Prepare training examples and labels
     texts = act_txts + amt_txts
@@ -98,7 +373,21 @@ if __name__ == '__main__':
     cl = AdeftClassifier(texts, labels)
     param_grid = {'C': [10.0], 'max_features': [100, 1000],
                   'ngram_range': [(1, 2)]}
-    # Do cross-validation
-    cl.cv(texts, labels, param_grid, cv=5)
+    if len(sys.argv) > 1 and sys.argv[1] == 'check':
+        # Compare with Adeft's own training on a small sample of the texts
+        sample = np.random.RandomState(1).choice(len(texts), 300,
+                                                 replace=False)
+        compare_with_adeft_train(cl, [texts[ix] for ix in sample],
+                                 [labels[ix] for ix in sample], param_grid,
+                                 pos_labels=sorted(set(labels)))
+        sys.exit()
+    # Do cross-validation with the classifier's own stop words
+    cv_results = cached_cv(texts, labels, param_grid, cv=5,
+                           stop_words=sorted(cl.stop),
+                           pos_labels=sorted(set(labels)),
+                           random_state=cl.random_state)
+    # Train the classifier with the best parameters on all the texts
+    cl.train(texts, labels, **cv_results[0]['params'])
+    cl.stats = cv_results[0]['stats']
     print(cl.stats)
     cl_model_info = cl.get_model_info()
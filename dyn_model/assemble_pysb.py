@@ -1,6 +1,7 @@
 import re
 import numpy
 import pickle
+import multiprocessing
 from pysb.integrate import Solver
 from indra.statements import *
 from indra.mechlinker import MechLinker
@@ -10,10 +11,26 @@ from indra.databases import context_client, cbio_client, hgnc_client, \
 from indra.assemblers.pysb import PysbAssembler
 from indra.assemblers.index_card import IndexCardAssembler
 from util import prefixed_pkl, pklload
-#from process_data import antibody_map, cell_lines, read_ccle_variants, \
-#                         drug_targets, drug_grounding, agent_from_gene_name
+# The data processing (including the variant parsers) is shared with
+# fallahi_eval, whose folder is put on the path by util
+from process_data import antibody_map, cell_lines, get_ccle_context, \
+                         drug_targets, drug_grounding, agent_from_gene_name
 
-def assemble_pysb(stmts, data_genes, contextualize=False):
+# Cell lines without CCLE data, whose models aren't contextualized
+cell_lines_no_data = ['COLO858', 'K2', 'MMACSF', 'MZ7MEL', 'WM1552C']
+
+# The statements, genes and CCLE context of the cell line models being
+# assembled. They are set before the worker processes are forked.
+_stmts = None
+_genes = None
+_context = None
+# Each worker holds the statements and assembles and pickles full models,
+# so the default number of workers is bounded rather than one per core
+default_num_procs = min(4, multiprocessing.cpu_count())
+
+
+def assemble_pysb(stmts, data_genes, contextualize=False,
+                  num_procs=default_num_procs):
     # Filter the INDRA Statements to be put into the model
     stmts = ac.filter_by_type(stmts, Complex, invert=True)
     stmts = ac.filter_direct(stmts)
@@ -72,22 +89,41 @@ def assemble_pysb(stmts, data_genes, contextualize=False):
     if not contextualize:
         return stmts
 
-    cell_lines_no_data = ['COLO858', 'K2', 'MMACSF', 'MZ7MEL', 'WM1552C']
-    for cell_line in cell_lines:
-        if cell_line not in cell_lines_no_data:
-            stmtsc = contextualize_stmts(stmts, cell_line, data_genes)
-        else:
-            stmtsc = stmts
-        pa = PysbAssembler()
-        pa.add_statements(stmtsc)
-        model = pa.make_model()
-        if cell_line not in cell_lines_no_data:
-            contextualize_model(model, cell_line, data_genes)
-        ac.dump_statements(stmtsc, prefixed_pkl('pysb_stmts_%s' % cell_line))
-        with open(prefixed_pkl('pysb_model_%s' % cell_line), 'wb') as f:
-            pickle.dump(model, f)
+    # Fetch the context of all cell lines at once, then contextualize and
+    # assemble the model of each cell line in a worker process
+    global _stmts, _genes, _context
+    _stmts = stmts
+    _genes = data_genes
+    _context = get_ccle_context(data_genes)
+    if num_procs == 1:
+        for cell_line in map(assemble_cell_line_model, cell_lines):
+            print('Assembled model for %s' % cell_line)
+    else:
+        # The pool is terminated if assembling any of the models fails
+        with multiprocessing.get_context('fork').Pool(num_procs) as pool:
+            for cell_line in pool.imap_unordered(assemble_cell_line_model,
+                                                 cell_lines):
+                print('Assembled model for %s' % cell_line)
     return stmts
 
+
+def assemble_cell_line_model(cell_line):
+    """Assemble and save the contextualized model of a cell line."""
+    if cell_line not in cell_lines_no_data:
+        stmtsc = contextualize_stmts(_stmts, cell_line, _genes, _context)
+    else:
+        stmtsc = _stmts
+    pa = PysbAssembler()
+    pa.add_statements(stmtsc)
+    model = pa.make_model()
+    if cell_line not in cell_lines_no_data:
+        contextualize_model(model, cell_line, _genes, _context)
+    ac.dump_statements(stmtsc, prefixed_pkl('pysb_stmts_%s' % cell_line))
+    with open(prefixed_pkl('pysb_model_%s' % cell_line), 'wb') as f:
+        pickle.dump(model, f)
+    return cell_line
+
+
 def strip_supports(stmts):
     for stmt in stmts:
         stmt.supports = []
@@ -119,30 +155,34 @@ def normalize_active_forms(stmts):
     return stmts
 
 
-def contextualize_stmts(stmts, cell_line, genes):
-    """Contextualize model at the level of INDRA Statements."""
+def contextualize_stmts(stmts, cell_line, genes, context=None):
+    """Contextualize model at the level of INDRA Statements.
+
+    The context is that returned by get_ccle_context for the genes, which
+    is fetched if not given.
+    """
+    if context is None:
+        context = get_ccle_context(genes)
     to_remove = []
     cell_line_ccle = cell_line + '_SKIN'
     # Remove genes with CNA = -2
     print('Contextualize by CNA')
-    cna = cbio_client.get_ccle_cna(genes, [cell_line_ccle])[cell_line_ccle]
-    for gene in genes:
-        if cna.get(gene) == -2:
-            to_remove.append(gene)
-            print('To remove CNA: %s' % gene)
+    cna = context['cna'][cell_line_ccle]
+    for gene in cna.index[cna == -2]:
+        to_remove.append(gene)
+        print('To remove CNA: %s' % gene)
     # Remove genes with transcripts in bottom 5%
     print('Contextualize by mRNA')
-    mrna = cbio_client.get_ccle_mrna(genes, [cell_line_ccle])[cell_line_ccle]
-    mrna_vals = [v for v in mrna.values() if v]
-    if mrna_vals:
+    mrna = context['mrna'][cell_line_ccle]
+    mrna_vals = mrna[mrna.notnull() & (mrna != 0)]
+    if len(mrna_vals):
         thresh = numpy.percentile(mrna_vals, 5.0)
-        for gene, val in mrna.items():
-            if val and val < thresh:
-                to_remove.append(gene)
-                print('To remove mRNA: %s' % gene)
+        for gene in mrna_vals.index[mrna_vals < thresh]:
+            to_remove.append(gene)
+            print('To remove mRNA: %s' % gene)
     # Remove genes with nonsense mutations
     print('Contextualize by nonsense mutations')
-    variants = read_ccle_variants(genes)
+    variants = context['variants']
     to_remove_nonsense = list(variants['nonsense'][cell_line_ccle].keys())
     if to_remove_nonsense:
         print('To remove nonsense: %s' % ', '.join(to_remove_nonsense))
@@ -170,18 +210,35 @@ def contextualize_stmts(stmts, cell_line, genes):
     return stmts
 
 
-def contextualize_model(model, cell_line, genes):
-    """Contextualize model at the level of a PySB model."""
-    # Here we just make a PysbAssembler to be able
-    # to apply set_context on the model being passed in
+def contextualize_model(model, cell_line, genes, context=None):
+    """Contextualize model at the level of a PySB model.
+
+    The context is that returned by get_ccle_context for the genes, which
+    is fetched if not given.
+    """
+    if context is None:
+        context = get_ccle_context(genes)
+    # Here we just make a PysbAssembler to be able to set the expression of
+    # the model being passed in. The protein amounts are those set_context
+    # would get, but taken from the context so that cBioPortal isn't queried
+    # again for each cell line. Monomers that aren't among the genes get the
+    # default amount.
     model.name = cell_line
     cell_line_ccle = cell_line + '_SKIN'
     pa = PysbAssembler()
     pa.model = model
-    pa.set_context(cell_line_ccle)
+    amounts = context['protein'][cell_line_ccle]
+    if amounts.notnull().any():
+        # Missing amounts are None for set_expression, nan means not
+        # expressed
+        pa.set_expression({gene: (None if numpy.isnan(amount) else amount)
+                           for gene, amount in amounts.items()})
+    else:
+        print('Could not get context for %s cell type.' % cell_line_ccle)
+        pa.add_default_initial_conditions()
 
     # Set initial conditions for missense mutations
-    variants = read_ccle_variants(genes)
+    variants = context['variants']
     mutations = variants['missense'][cell_line_ccle]
     for gene, mut_list in mutations.items():
         for fres, loc, tres in mut_list:
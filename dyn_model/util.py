@@ -1,8 +1,11 @@
 from indra.util import _require_python3
 import os
+import sys
 import json
-import time
-import pickle
+# The artifact store is shared with the fallahi_eval folder
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir, 'fallahi_eval'))
+from artifact_store import ArtifactStore
 
 # CREATE A JSON FILE WITH THIS INFORMATION, E.G., a file consisting of:
 # {"basename": "fallahi_eval", "basedir": "output"}
@@ -17,17 +20,13 @@ based = config['basedir']
 # This makes it easier to make standardized pickle file paths
 prefixed_pkl = lambda suffix: os.path.join(based, basen + '_' + suffix + '.pkl')
 
+# Artifacts are optionally compressed with "zstd" or "lz4", which can be
+# set as "compression" in the config (null for no compression)
+store = ArtifactStore(based, basen,
+                      compression=config.get('compression', 'default'))
+
 def pkldump(suffix, content):
-    fname = prefixed_pkl(suffix)
-    with open(fname, 'wb') as fh:
-        pickle.dump(content, fh)
+    store.dump(suffix, content)
 
 def pklload(suffix):
-    fname = prefixed_pkl(suffix)
-    print('Loading %s' % fname)
-    ts = time.time()
-    with open(fname, 'rb') as fh:
-        content = pickle.load(fh)
-    te = time.time()
-    print('Loaded %s in %.1f seconds' % (fname, te-ts))
-    return content
+    return store.load(suffix)
@@ -0,0 +1,198 @@
+"""
+A store for the (potentially large) pickled artifacts of the evaluation
+(e.g., per-cell-line PySB models and statements or scored paths).
+
+Artifacts are pickled with protocol 5, with large buffers (e.g., NumPy
+arrays) written out-of-band, and optionally compressed with zstd or lz4 if
+the zstandard or lz4 packages are available. An artifact is only written if
+the hash of its pickle differs from that of the stored artifact. A JSON
+manifest next to the artifacts records the hash, size, write time and last
+load time of each one, and is updated under a file lock so that processes
+storing or loading artifacts at the same time don't lose each other's
+entries. Plain pickle files written by other code can still be loaded.
+
+Pickles aren't canonical: the order in which the elements of a set of
+strings (or a dict filled while iterating over one) are pickled depends on
+the hash seed of strings. An unchanged artifact with such content is
+written again by a run with another hash seed, unless PYTHONHASHSEED is set
+to the same value in all runs.
+"""
+import os
+import json
+import time
+import fcntl
+import pickle
+import hashlib
+import tempfile
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+
+MAGIC = b'INDRAPKL1\n'
+
+
+def get_default_compression():
+    if zstandard is not None:
+        return 'zstd'
+    if lz4 is not None:
+        return 'lz4'
+    return None
+
+
+def compress(data, compression):
+    if compression == 'zstd':
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    elif compression == 'lz4':
+        return lz4.frame.compress(data)
+    return data
+
+
+def decompress(data, compression):
+    if compression == 'zstd':
+        return zstandard.ZstdDecompressor().decompress(data)
+    elif compression == 'lz4':
+        return lz4.frame.decompress(data)
+    return data
+
+
+class ArtifactStore(object):
+    """A folder of pickled artifacts named with a common prefix.
+
+    Parameters
+    ----------
+    basedir : str
+        The folder in which artifacts are stored.
+    basename : str
+        The prefix of all artifact file names.
+    compression : Optional[str]
+        zstd, lz4 or None. By default, zstd or lz4 if available.
+    """
+    def __init__(self, basedir, basename, compression='default'):
+        self.basedir = basedir
+        self.basename = basename
+        self.compression = get_default_compression() \
+            if compression == 'default' else compression
+        self.manifest_file = os.path.join(basedir,
+                                          basename + '_manifest.json')
+        self.manifest = self._read_manifest()
+
+    def get_path(self, suffix):
+        return os.path.join(self.basedir,
+                            self.basename + '_' + suffix + '.pkl')
+
+    def _read_manifest(self):
+        if os.path.exists(self.manifest_file):
+            with open(self.manifest_file, 'r') as fh:
+                return json.load(fh)
+        return {}
+
+    def _write_atomic(self, fname, write):
+        """Write a file through a uniquely named temporary file so that an
+        interrupted or concurrent write never leaves a partial file."""
+        fd, tmp_fname = tempfile.mkstemp(dir=os.path.dirname(fname) or '.',
+                                         prefix=os.path.basename(fname),
+                                         suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as fh:
+                write(fh)
+            os.replace(tmp_fname, fname)
+        except BaseException:
+            os.remove(tmp_fname)
+            raise
+
+    def _update_manifest(self, suffix, update):
+        """Update the entry of an artifact in the manifest on disk.
+
+        The manifest is re-read and written while holding a lock so that
+        the entries written by other processes are kept. The given function
+        is called with the current entry and returns the new one.
+        """
+        with open(self.manifest_file + '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                self.manifest = self._read_manifest()
+                self.manifest[suffix] = update(self.manifest.get(suffix, {}))
+                content = json.dumps(self.manifest, indent=1,
+                                     sort_keys=True).encode('utf-8')
+                self._write_atomic(self.manifest_file,
+                                   lambda fh: fh.write(content))
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def dump(self, suffix, content):
+        """Store an artifact unless one with an identical pickle is already
+        stored."""
+        fname = self.get_path(suffix)
+        ts = time.time()
+        buffers = []
+        data = pickle.dumps(content, protocol=5,
+                            buffer_callback=buffers.append)
+        segments = [data] + [buf.raw() for buf in buffers]
+        hasher = hashlib.blake2b()
+        for segment in segments:
+            hasher.update(segment)
+        content_hash = hasher.hexdigest()
+        # Other processes may have stored the artifact since we started
+        self.manifest = self._read_manifest()
+        entry = self.manifest.get(suffix, {})
+        # The size check catches files overwritten outside of the store
+        if entry.get('hash') == content_hash and os.path.exists(fname) and \
+                entry.get('size') == os.path.getsize(fname):
+            print('%s is unchanged, not writing' % fname)
+            return
+        segments = [compress(segment, self.compression)
+                    for segment in segments]
+        header = {'compression': self.compression,
+                  'lengths': [len(segment) for segment in segments]}
+
+        def write(fh):
+            fh.write(MAGIC)
+            fh.write(json.dumps(header).encode('utf-8') + b'\n')
+            for segment in segments:
+                fh.write(segment)
+        self._write_atomic(fname, write)
+        # The load time of the previous artifact doesn't apply to this one
+        entry = {'hash': content_hash,
+                 'size': os.path.getsize(fname),
+                 'compression': self.compression,
+                 'written': time.strftime('%Y-%m-%d %H:%M:%S'),
+                 'write_time': time.time() - ts}
+        self._update_manifest(suffix, lambda old_entry: entry)
+
+    def load(self, suffix):
+        """Load an artifact, recording the load time in the manifest."""
+        fname = self.get_path(suffix)
+        print('Loading %s' % fname)
+        ts = time.time()
+        with open(fname, 'rb') as fh:
+            if fh.read(len(MAGIC)) != MAGIC:
+                # A plain pickle file
+                fh.seek(0)
+                content = pickle.load(fh)
+            else:
+                header = json.loads(fh.readline().decode('utf-8'))
+                segments = [decompress(fh.read(length),
+                                       header['compression'])
+                            for length in header['lengths']]
+                # Out-of-band buffers have to be writable, e.g., for arrays
+                content = pickle.loads(segments[0], buffers=[
+                    bytearray(segment) for segment in segments[1:]])
+        te = time.time()
+        print('Loaded %s in %.1f seconds' % (fname, te-ts))
+
+        def update(entry):
+            entry = dict(entry, load_time=te - ts,
+                         loaded=time.strftime('%Y-%m-%d %H:%M:%S'))
+            # Plain pickle files have no entry yet
+            entry.setdefault('size', os.path.getsize(fname))
+            return entry
+        self._update_manifest(suffix, update)
+        return content
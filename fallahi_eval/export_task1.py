@@ -10,9 +10,13 @@ for pkl_name in ('task1_scored_paths', 'task1_scored_paths_inverse'):
     scored_path_dict, models = pklload(pkl_name)
     for cell_line in ['C32', 'LOXIMVI', 'MMACSF', 'MZ7MEL', 'RVH421']:
         model = models[cell_line]
-        report_paths(scored_path_dict[cell_line], model, stmts, cell_line)
+        # The statements of the model's rules are looked up in this index
+        # for all the drugs
+        index = gp.RuleIndex(model, stmts)
+        report_paths(scored_path_dict[cell_line], model, stmts, cell_line,
+                     index)
 
         for drug_name, scored_paths in scored_path_dict[cell_line].items():
             print("Grouping paths for %s, %s" % (cell_line, drug_name))
-            gp.print_top_group_scores(scored_paths, model, stmts)
+            gp.print_top_group_scores(scored_paths, model, stmts, index)
 
@@ -0,0 +1,174 @@
+"""Remove the Modifications and RegulateActivities with inconsequential
+effects from the Statements of a model. This is shared by the model assembly
+in fallahi_eval and dyn_model.
+
+Running this file checks that filter_inconsequential keeps the same
+Statements as the loop over ac.filter_inconsequential_mods and
+ac.filter_inconsequential_acts that it replaces, on random Statements.
+"""
+import copy
+import time
+import random
+import collections
+from indra.statements import *
+import indra.tools.assemble_corpus as ac
+
+
+def filter_inconsequential(stmts, mod_whitelist=None, act_whitelist=None):
+    """Remove Modifications and RegulateActivities with inconsequential
+    effects until none are left.
+
+    This gives the same Statements as alternating
+    ac.filter_inconsequential_mods and ac.filter_inconsequential_acts until
+    the number of Statements stops changing, but instead of rescanning all
+    the Statements in each round, it counts how many times each agent state
+    (modification or activity) is used, and after removing a Statement only
+    re-examines the Statements producing the states it was the last user of.
+
+    Parameters
+    ----------
+    stmts : list[indra.statements.Statement]
+        The Statements to filter.
+    mod_whitelist : Optional[dict]
+        Modification sites to keep by gene name, as for
+        ac.filter_inconsequential_mods.
+    act_whitelist : Optional[dict]
+        Activity types to keep by gene name, as for
+        ac.filter_inconsequential_acts.
+
+    Returns
+    -------
+    list[indra.statements.Statement]
+        The filtered Statements in their original order.
+    """
+    ts = time.time()
+    whitelist = set()
+    for state_type, wl in (('mod', mod_whitelist), ('act', act_whitelist)):
+        for gene_name, states in (wl or {}).items():
+            whitelist |= {(gene_name, state_type, state) for state in states}
+    # The number of uses of each agent state, the states used by each
+    # Statement, and the Statements producing each state
+    num_uses = collections.Counter()
+    uses = []
+    producers = collections.defaultdict(list)
+    for ix, stmt in enumerate(stmts):
+        stmt_uses = []
+        for agent in stmt.agent_list():
+            if agent is None:
+                continue
+            for mc in agent.mods:
+                stmt_uses.append((agent.name, 'mod',
+                                  (mc.mod_type, mc.residue, mc.position)))
+            if agent.activity:
+                stmt_uses.append((agent.name, 'act',
+                                  agent.activity.activity_type))
+        uses.append(stmt_uses)
+        num_uses.update(stmt_uses)
+        if isinstance(stmt, Modification):
+            mod_type = modclass_to_modtype[stmt.__class__]
+            if isinstance(stmt, RemoveModification):
+                mod_type = modtype_to_inverse[mod_type]
+            producers[(stmt.sub.name, 'mod',
+                       (mod_type, stmt.residue, stmt.position))].append(ix)
+        elif isinstance(stmt, RegulateActivity):
+            producers[(stmt.obj.name, 'act', stmt.obj_activity)].append(ix)
+
+    def is_used(state):
+        return num_uses[state] > 0 or state in whitelist
+
+    # Each round removes the Statements producing unused states, the first
+    # round looking at all states and later ones only at states whose last
+    # use was removed in the previous round
+    removed = set()
+    worklist = [state for state in producers if not is_used(state)]
+    num_rounds = 0
+    while worklist:
+        num_rounds += 1
+        next_worklist = []
+        for state in worklist:
+            for ix in producers[state]:
+                if ix in removed:
+                    continue
+                removed.add(ix)
+                for used_state in uses[ix]:
+                    num_uses[used_state] -= 1
+                    if not is_used(used_state):
+                        next_worklist.append(used_state)
+        worklist = next_worklist
+    print('Removed %d inconsequential Statements in %d rounds in %.2f sec' %
+          (len(removed), num_rounds, time.time() - ts))
+    return [stmt for ix, stmt in enumerate(stmts) if ix not in removed]
+
+
+def filter_inconsequential_loop(stmts, mod_whitelist=None,
+                                act_whitelist=None):
+    """Return the Statements left by alternating
+    ac.filter_inconsequential_mods and ac.filter_inconsequential_acts until
+    the number of Statements stops changing.
+
+    These functions add the states in use to the whitelist they are given,
+    so each call gets a copy of the whitelist, as the model assembly used
+    to get a new one from get_mod_whitelist for each call.
+    """
+    num_stmts = len(stmts)
+    while True:
+        stmts = ac.filter_inconsequential_mods(stmts,
+                                               copy.deepcopy(mod_whitelist))
+        stmts = ac.filter_inconsequential_acts(stmts,
+                                               copy.deepcopy(act_whitelist))
+        if num_stmts <= len(stmts):
+            break
+        num_stmts = len(stmts)
+    return stmts
+
+
+def get_random_stmts(num_stmts, num_genes, rng):
+    """Return random Modifications, Activations and Complexes between agents
+    that have modifications and activities some of the time."""
+    genes = ['G%d' % ix for ix in range(num_genes)]
+    sites = [('S', '1'), ('T', '2'), ('Y', '3')]
+    act_types = ['kinase', 'activity']
+
+    def get_agent():
+        mods = [ModCondition('phosphorylation', *rng.choice(sites))] \
+            if rng.random() < 0.2 else []
+        activity = ActivityCondition(rng.choice(act_types), True) \
+            if rng.random() < 0.15 else None
+        return Agent(rng.choice(genes), mods=mods, activity=activity)
+
+    stmts = []
+    for _ in range(num_stmts):
+        x = rng.random()
+        if x < 0.4:
+            mod_class = rng.choice([Phosphorylation, Dephosphorylation])
+            stmts.append(mod_class(get_agent(), get_agent(),
+                                   *rng.choice(sites)))
+        elif x < 0.8:
+            stmts.append(Activation(get_agent(), get_agent(),
+                                    rng.choice(act_types)))
+        else:
+            stmts.append(Complex([get_agent(), get_agent()]))
+    return stmts
+
+
+def compare_with_assemble_corpus(num_corpora=30, num_stmts=400,
+                                 num_genes=60):
+    """Check that filter_inconsequential keeps the same Statements as
+    filter_inconsequential_loop on random sets of Statements."""
+    mod_whitelist = {'G1': [('phosphorylation', 'S', '1')],
+                     'G2': [('phosphorylation', 'T', '2')]}
+    act_whitelist = {'G3': ['kinase']}
+    for seed in range(num_corpora):
+        stmts = get_random_stmts(num_stmts, num_genes, random.Random(seed))
+        ref_stmts = filter_inconsequential_loop(stmts, mod_whitelist,
+                                                act_whitelist)
+        new_stmts = filter_inconsequential(stmts, mod_whitelist,
+                                           act_whitelist)
+        assert [id(s) for s in new_stmts] == [id(s) for s in ref_stmts], \
+            seed
+    print('filter_inconsequential matches the assemble_corpus loop on %d '
+          'sets of Statements' % num_corpora)
+
+
+if __name__ == '__main__':
+    compare_with_assemble_corpus()
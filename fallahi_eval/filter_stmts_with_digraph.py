@@ -1,4 +1,5 @@
 import sys
+import time
 import random
 import pickle
 import numpy as np
@@ -50,22 +51,173 @@ def draw(g, filename):
     ag.draw(filename, prog='dot')
 
 
+def get_neighbors(g, signed=False):
+    """Return the successors and predecessors of each node of a graph.
+
+    Neighbors are keyed by (node, sign) for signed graphs and by node
+    otherwise, so that multiple edges between two nodes are merged.
+    Successors map to the edge weight, that of the last edge if merged.
+    """
+    successors = {u: {} for u in g}
+    predecessors = {u: set() for u in g}
+    for u, v, data in g.edges(data=True):
+        successors[u][(v, data['sign']) if signed else v] = \
+            float(data.get('weight', 1.0))
+        predecessors[v].add((u, data['sign']) if signed else u)
+    return successors, predecessors
+
+
+def get_level_sets(neighbors, start, max_depth, signed=False):
+    """Return the nodes reachable from a start node at each depth, like
+    the forward or backward reachable sets of get_reachable_sets."""
+    level = {0: set([start])}
+    visited = set([start])
+    for i in range(1, max_depth+1):
+        if signed:
+            reachable_set = set((v, (pol + sign) % 2)
+                                for u, pol in level[i-1]
+                                for v, sign in neighbors[u])
+        else:
+            reachable_set = set(v for u in level[i-1] for v in neighbors[u])
+        if not reachable_set:
+            break
+        level[i] = reachable_set
+        visited |= reachable_set
+    return level, visited
+
+
+def get_paths_graphs(g, source, target, max_depth=6, signed=False,
+                     target_polarity=None, neighbors=None):
+    """Return the paths graphs of all lengths up to a maximum depth and
+    their combination.
+
+    The neighbors of each node and the forward and backward level sets of
+    the graph are computed once, and the paths graph of each length is
+    derived from them by only following the edges out of the nodes of each
+    level, rather than by calling paths_graph for each length. The paths
+    graph of each length is the same as that of paths_graph with reachable
+    sets computed to that length (see compare_with_paths_graph).
+
+    Parameters
+    ----------
+    g : networkx.DiGraph
+        The graph to find paths in, with edge signs in the 'sign' field
+        (0 positive, 1 negative) if signed.
+    source : str
+        The source node.
+    target : str
+        The target node.
+    max_depth : Optional[int]
+        The maximum path length. Default: 6
+    signed : Optional[bool]
+        Whether the graph is signed. Default: False
+    target_polarity : Optional[int]
+        The polarity of paths at the target, 0 positive and 1 negative,
+        used if signed. None is taken to be positive. Default: None
+    neighbors : Optional[tuple]
+        The successors and predecessors of each node as returned by
+        get_neighbors, to reuse across source/target pairs. Default:
+        computed from the graph
+
+    Returns
+    -------
+    pgs : dict
+        The paths graph of each length, with nodes tagged by their level.
+    combined_pg : networkx.DiGraph
+        The union of the paths graphs of all lengths, as given by
+        combine_path_graphs.
+    """
+    if neighbors is None:
+        neighbors = get_neighbors(g, signed)
+    successors, predecessors = neighbors
+    if signed:
+        if target_polarity is None:
+            target_polarity = 0
+        source_node = (source, 0)
+        target_node = (target, target_polarity)
+    else:
+        source_node = source
+        target_node = target
+    pgs = {length: nx.DiGraph() for length in range(1, max_depth+1)}
+    combined_pg = nx.DiGraph()
+
+    # As in get_reachable_sets, there are no paths unless the target is
+    # reachable from the source and the source from the target, in signed
+    # graphs with the polarity of the paths
+    f_level, f_visited = get_level_sets(
+        successors, (source, 0) if signed else source, max_depth, signed)
+    b_level, b_visited = get_level_sets(
+        predecessors, (target, 0) if signed else target, max_depth, signed)
+    if signed:
+        reachable = (target, target_polarity) in f_visited and \
+            (source, target_polarity) in b_visited
+    else:
+        reachable = target in f_visited and source in b_visited
+    if not reachable:
+        return pgs, combined_pg
+    # With a negative target polarity, nodes match the backward level sets
+    # with their polarity flipped
+    if signed and target_polarity == 1:
+        b_level = {i: set((u, (w + 1) % 2) for u, w in nodes)
+                   for i, nodes in b_level.items()}
+
+    for length in range(1, max_depth+1):
+        this_pg = pgs[length]
+        if length not in f_level or length not in b_level:
+            continue
+        # The nodes at each level are those reachable from the source and
+        # the target at the matching depths
+        levels = [set([source_node])] + \
+            [f_level[i] & b_level[length - i] for i in range(1, length)] + \
+            [set([target_node])]
+        for i in range(length):
+            for u in levels[i]:
+                u_name, u_pol = u if signed else (u, None)
+                for key, weight in successors[u_name].items():
+                    if signed:
+                        v_name, sign = key
+                        v = (v_name, (u_pol + sign) % 2)
+                    else:
+                        v = key
+                    if v in levels[i+1]:
+                        this_pg.add_edge((i, u), (i+1, v), weight=weight)
+        combined_pg.add_edges_from(this_pg.edges(data=True))
+    return pgs, combined_pg
+
+
 def filter_stmts(g, source, target, max_depth=6, signed=False,
-                 target_polarity=None):
-    f_level, b_level = pg.get_reachable_sets(g, source, target,
-                                             max_depth=max_depth,
-                                             signed=signed)
+                 target_polarity=None, draw_prefix=None):
+    """Return the nodes on paths between a source and a target by length.
+
+    The paths graphs of each length are generated with get_paths_graphs,
+    which gives the same paths graphs as paths_graph for signed and
+    unsigned graphs (see compare_with_paths_graph), except that
+    - paths of length max_depth are found, while the reachable sets that
+      get_reachable_sets computes with max_depth stop one level short,
+    - a target_polarity of None is taken to be positive,
+    - negative paths are found when there is no positive path from the
+      source to the target, while get_reachable_sets requires one.
+    """
+    ts = time.time()
+    pgs, combined_pg = get_paths_graphs(g, source, target,
+                                        max_depth=max_depth, signed=signed,
+                                        target_polarity=target_polarity)
+    print("Generated paths graphs up to length %d in %.2f sec, %d nodes "
+          "and %d edges combined" % (max_depth, time.time() - ts,
+                                     len(combined_pg),
+                                     combined_pg.number_of_edges()))
+    # Drawing is optional since rendering with Graphviz is slow
+    if draw_prefix and combined_pg and len(combined_pg) < 100:
+        draw(combined_pg, '%s_combined.pdf' % draw_prefix)
     stmt_uuids = set()
     stmt_nodes = set()
     stmt_uuid_nums = []
     stmt_node_nums = []
     # Iterate over various path lengths
     for length in range(1, max_depth+1):
-        #print("Generating paths_graph for length %d" % length)
-        this_pg = pg.paths_graph(g, source, target, length, f_level, b_level,
-                                 signed=signed, target_polarity=target_polarity)
-        if this_pg and len(this_pg) < 100:
-            draw(this_pg, 'pybel_pg_%d.pdf' % length)
+        this_pg = pgs[length]
+        if draw_prefix and this_pg and len(this_pg) < 100:
+            draw(this_pg, '%s_%d.pdf' % (draw_prefix, length))
 
         # Get nodes for this length PG
         nodes_this_length = set([n[1] for n in this_pg])
@@ -100,12 +252,8 @@ def filter_stmts_all_paths(g, source, target):
 
 
 def filter_stmts_sampling(g, source, target, max_depth):
-    f_level, b_level = pg.get_reachable_sets(g, source, target,
-                                             max_depth=max_depth, signed=False)
-    for length in range(1, max_depth+1):
-        #print("Generating paths_graph for length %d" % length)
-        this_pg = pg.paths_graph(g, source, target, length, f_level, b_level,
-                                 signed=False)
+    pgs, combined_pg = get_paths_graphs(g, source, target,
+                                        max_depth=max_depth, signed=False)
 
 
 def plot_results(g, stmt_uuids, stmt_nodes, stmt_node_nums, stmt_uuid_nums):
@@ -124,7 +272,48 @@ def plot_results(g, stmt_uuids, stmt_nodes, stmt_node_nums, stmt_uuid_nums):
     pf.format_axis(ax)
 
 
+def compare_with_paths_graph(num_graphs=20, num_nodes=12, num_edges=30,
+                             max_depth=5):
+    """Check that get_paths_graphs gives the same paths graphs as
+    paths_graph on small random signed and unsigned graphs."""
+    for seed in range(num_graphs):
+        rng = random.Random(seed)
+        g = nx.DiGraph()
+        while g.number_of_edges() < num_edges:
+            u, v = rng.sample(range(num_nodes), 2)
+            g.add_edge(u, v, sign=rng.randint(0, 1))
+        source, target = 0, num_nodes - 1
+        for signed, target_polarity in ((False, None), (True, 0), (True, 1)):
+            pgs, combined_pg = get_paths_graphs(
+                g, source, target, max_depth=max_depth, signed=signed,
+                target_polarity=target_polarity)
+            # The reachable sets of get_reachable_sets stop one level short
+            # of max_depth
+            f_level, b_level = pg.get_reachable_sets(
+                g, source, target, max_depth=max_depth+1, signed=signed)
+            # get_reachable_sets requires a positive path for either
+            # target polarity
+            if f_level is None and target_polarity == 1:
+                continue
+            ref_pgs = {}
+            for length in range(1, max_depth+1):
+                ref_pgs[length] = pg.paths_graph(
+                    g, source, target, length, f_level, b_level,
+                    signed=signed, target_polarity=target_polarity or 0)
+                assert set(pgs[length].edges()) == \
+                    set(ref_pgs[length].edges()), \
+                    (seed, signed, target_polarity, length)
+            assert set(combined_pg.edges()) == \
+                set(pg.combine_path_graphs(ref_pgs).edges()), \
+                (seed, signed, target_polarity)
+    print('Paths graphs of %d graphs match paths_graph' % num_graphs)
+
+
 if __name__ == '__main__':
+    # Compare with paths_graph instead of filtering a statement file
+    if sys.argv[1] == 'check':
+        compare_with_paths_graph()
+        sys.exit()
     source = sys.argv[2]
     target = sys.argv[3]
     if len(sys.argv) > 4:
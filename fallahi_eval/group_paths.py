@@ -1,21 +1,79 @@
 import pickle
 from indra.databases import hgnc_client
-from indra.explanation.reporting import stmt_from_rule
 from indra.databases.context_client import get_protein_expression
-from util import prefixed_pkl
-from process_data import cell_lines
 
 
-def group_scored_paths(scored_paths, model, stmts):
+class RuleIndex(object):
+    """Index of the statements and genes of a model's rules.
+
+    The index is built once per model with a single pass over the model's
+    annotations, so that looking up the statement a rule was assembled from
+    doesn't require scanning all the statements (as stmt_from_rule does)
+    for every rule of every path.
+
+    Parameters
+    ----------
+    model : pysb.Model
+        A model assembled from INDRA Statements.
+    stmts : list[indra.statements.Statement]
+        The statements the model was assembled from.
+    """
+    def __init__(self, model, stmts):
+        self.rule_names = {rule.name for rule in model.rules}
+        stmts_by_uuid = {stmt.uuid: stmt for stmt in stmts}
+        # The statement of each rule, or None if the statement of the rule
+        # isn't among the statements
+        self.stmts = {}
+        for ann in model.annotations:
+            # As in stmt_from_rule, only the first annotation of a rule
+            # counts
+            if ann.predicate == 'from_indra_statement' and \
+                    ann.subject not in self.stmts:
+                self.stmts[ann.subject] = stmts_by_uuid.get(ann.object)
+        # The (subject gene, object gene) names of each rule's statement
+        self.genes = {}
+        gene_names = {}
+        for rule_name, stmt in self.stmts.items():
+            if stmt is None:
+                continue
+            genes = []
+            for agent in stmt.agent_list()[:2]:
+                gene_id = agent.db_refs.get('HGNC') \
+                    if agent is not None else None
+                if gene_id not in gene_names:
+                    gene_names[gene_id] = hgnc_client.get_hgnc_name(gene_id)
+                genes.append(gene_names[gene_id])
+            self.genes[rule_name] = tuple(genes)
+
+    def get_stmt(self, rule_name):
+        """Return the statement a rule was assembled from."""
+        return self.stmts.get(rule_name)
+
+    def get_gene(self, rule_name, agent_ix):
+        """Return the name of the subject (0) or object (1) gene of a rule."""
+        return self.genes[rule_name][agent_ix]
+
+    def get_path_stmts(self, path):
+        """Return the statements of the rules on a path, like
+        stmts_from_pysb_path."""
+        path_stmts = []
+        for rule_name, sign in path:
+            if rule_name in self.rule_names:
+                stmt = self.get_stmt(rule_name)
+                assert stmt is not None
+                path_stmts.append(stmt)
+        return path_stmts
+
+
+def group_scored_paths(scored_paths, model, stmts, index=None):
+    if index is None:
+        index = RuleIndex(model, stmts)
+
     def gene_from_rule(rule_name, agent_ix):
-        rule_stmt = stmt_from_rule(rule_name, model, stmts)
-        if not rule_stmt:
+        if not index.get_stmt(rule_name):
             print("Could not get stmt for rule %s" % rule_name)
             return None
-        agent = rule_stmt.agent_list()[agent_ix]
-        gene_id = agent.db_refs.get('HGNC')
-        gene_name = hgnc_client.get_hgnc_name(gene_id)
-        return gene_name
+        return index.get_gene(rule_name, agent_ix)
 
     path_details = {}
     groups = set()
@@ -104,8 +162,9 @@ def top_scores(path_details):
     return ts_tuples
 
 
-def print_top_group_scores(scored_paths, model, stmts):
-    groups, path_details = group_scored_paths(scored_paths, model, stmts)
+def print_top_group_scores(scored_paths, model, stmts, index=None):
+    groups, path_details = group_scored_paths(scored_paths, model, stmts,
+                                              index)
     ts = top_scores(path_details)
     last_sign = 1
     for path, score in ts:
@@ -123,6 +182,10 @@ def print_top_group_scores(scored_paths, model, stmts):
 
 
 if __name__ == '__main__':
+    # These are only imported here so that RuleIndex can also be used from
+    # other folders, e.g., phase3_eval, which has its own process_data
+    from util import prefixed_pkl
+    from process_data import cell_lines
     # Run run_task1.py before running this one
     with open(prefixed_pkl('pysb_stmts'), 'rb') as f:
         stmts = pickle.load(f)
@@ -131,9 +194,11 @@ if __name__ == '__main__':
 
     all_groups = set()
     all_path_details = {}
+    index = RuleIndex(model, stmts)
     for cell_line, drug_dict in scored_paths.items():
         for drug, paths in drug_dict.items():
-            groups, path_details = group_scored_paths(paths, model, stmts)
+            groups, path_details = group_scored_paths(paths, model, stmts,
+                                                      index)
             for pg, path_list in path_details.items():
                 if pg in all_path_details:
                     all_path_details[pg] |= path_list
@@ -0,0 +1,166 @@
+"""
+Check and score the explanations of many conditions in parallel.
+
+The statements of all (cell line, drug) conditions are checked against the
+model of their cell line in a pool of worker processes, one job per
+statement, after which the paths found for all drugs of the cell line are
+scored against the data of each drug at once with a PathScorer. The model
+checker of a cell line, including its pruned influence map, is made once
+and the workers are forked after that so that they share it instead of each
+building their own.
+"""
+import os
+import sys
+import time
+import itertools
+import multiprocessing
+from collections import defaultdict
+import numpy
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir))
+from im_cache import get_model_checker
+from path_scoring import PathScorer
+
+
+# The state of the cell line being checked. It is set before the worker
+# processes are forked, and jobs refer to statements by index since Agents
+# unpickled in a worker wouldn't be the ones the model checker knows.
+_mc = None
+_stmts_by_drug = None
+
+
+def get_global_mc(model, stmts_to_check, agents_to_observe):
+    """Return a model checker with a pruned influence map for all
+    statements checked at the 1.0 dose.
+
+    The pruned influence map is cached on disk by the content of the model
+    and the statements so it is only generated once.
+    """
+    all_stmts_condition = []
+    for cell_line in stmts_to_check.keys():
+        for drug in stmts_to_check[cell_line].keys():
+            stmts_condition, _ = stmts_to_check[cell_line][drug][1.0]
+            all_stmts_condition += stmts_condition
+    return get_model_checker(model, all_stmts_condition, agents_to_observe)
+
+
+def check_statement(job):
+    drug, stmt_idx, max_paths, max_path_length = job
+    ts = time.time()
+    pr = _mc.check_statement(_stmts_by_drug[drug][stmt_idx], max_paths,
+                             max_path_length)
+    return job, list(pr.paths), time.time() - ts
+
+
+def get_scored_paths(stmts_to_check, get_mc, get_agent_values, dose=1.0,
+                     max_paths=1000, max_path_length=8, num_procs=None):
+    """Return the scored paths explaining each cell line and drug condition.
+
+    Parameters
+    ----------
+    stmts_to_check : dict
+        The statements to check and the measured values, by cell line, drug
+        and dose.
+    get_mc : function
+        Returns the model checker, with pruned influence map, of a given
+        cell line.
+    get_agent_values : function
+        Returns the measured values of a condition keyed by INDRA Agents.
+    dose : Optional[float]
+        The dose of the conditions to check. Default: 1.0
+    max_paths : Optional[int]
+        The maximum number of paths per statement. Default: 1000
+    max_path_length : Optional[int]
+        The maximum length of paths. Default: 8
+    num_procs : Optional[int]
+        The number of worker processes, by default the number of cores. If
+        1, all jobs run in this process.
+
+    Returns
+    -------
+    scored_paths : dict
+        The scored paths by cell line and drug.
+    models : dict
+        The model of each cell line.
+    timings : list[dict]
+        The wall time of each checking and scoring job.
+    """
+    global _mc, _stmts_by_drug
+    scored_paths = {}
+    models = {}
+    timings = []
+    for cell_line in stmts_to_check.keys():
+        print('Cell line: %s\n=============' % cell_line)
+        _mc = get_mc(cell_line)
+        _stmts_by_drug = {drug: conditions[dose][0] for drug, conditions
+                          in stmts_to_check[cell_line].items()}
+        check_jobs = [(drug, stmt_idx, max_paths, max_path_length)
+                      for drug, stmts in _stmts_by_drug.items()
+                      for stmt_idx in range(len(stmts))]
+        if num_procs == 1:
+            pool = None
+            imap = map
+        else:
+            pool = multiprocessing.get_context('fork').Pool(num_procs)
+            imap = pool.imap
+        # Results come back in job order so that the paths of each drug are
+        # in the same order as when checking one statement at a time
+        paths = defaultdict(list)
+        for (drug, stmt_idx, _, _), stmt_paths, elapsed in \
+                imap(check_statement, check_jobs):
+            print('Checked %s %s statement %d in %.1f sec' %
+                  (cell_line, drug, stmt_idx, elapsed))
+            paths[drug] += stmt_paths
+            timings.append({'cell_line': cell_line, 'drug': drug,
+                            'stmt_idx': stmt_idx, 'job': 'check',
+                            'time': elapsed})
+        if pool is not None:
+            pool.close()
+            pool.join()
+        # Score the paths of all drugs against the values measured for each
+        # drug in a single call. Run score paths with
+        # - the values of observed agents in the current condition
+        # - loss of function mode since these are inhibitory drugs
+        # - sigma corresponding to the log2 normalized measurements
+        ts = time.time()
+        drugs = list(_stmts_by_drug.keys())
+        scorer = PathScorer(_mc, [path for drug in drugs
+                                  for path in paths[drug]])
+        values = scorer.get_obs_values(
+            [get_agent_values(stmts_to_check[cell_line][drug][dose][1])
+             for drug in drugs])
+        scores = scorer.score(values, loss_of_function=True, sigma=0.5)
+        scored_paths[cell_line] = {}
+        offset = 0
+        for drug_ix, drug in enumerate(drugs):
+            # Each drug's paths are only ranked by their score for the drug
+            path_ixs = numpy.arange(offset, offset + len(paths[drug]))
+            offset += len(paths[drug])
+            scored_paths[cell_line][drug] = \
+                scorer.rank(scores[:, drug_ix], path_ixs)
+        elapsed = time.time() - ts
+        print('Scored %d %s paths in %.1f sec' %
+              (len(scorer.paths), cell_line, elapsed))
+        timings.append({'cell_line': cell_line, 'drug': 'all',
+                        'stmt_idx': None, 'job': 'score', 'time': elapsed})
+        models[cell_line] = _mc.model
+    print_timings(timings)
+    return scored_paths, models, timings
+
+
+def print_timings(timings, top=10):
+    """Print the total time of each condition and the slowest jobs."""
+    key = lambda t: (t['cell_line'], t['drug'])
+    totals = [(cell_line_drug, sum(t['time'] for t in cond_timings))
+              for cell_line_drug, cond_timings in
+              itertools.groupby(sorted(timings, key=key), key=key)]
+    print('Time by condition\n=================')
+    for (cell_line, drug), total in sorted(totals, key=lambda x: x[1],
+                                           reverse=True):
+        print('%s %s: %.1f sec' % (cell_line, drug, total))
+    print('Slowest jobs\n============')
+    for t in sorted(timings, key=lambda t: t['time'], reverse=True)[:top]:
+        job = t['job'] if t['stmt_idx'] is None else \
+            '%s statement %d' % (t['job'], t['stmt_idx'])
+        print('%s %s %s: %.1f sec' % (t['cell_line'], t['drug'], job,
+                                      t['time']))
@@ -1,94 +1,173 @@
 from indra.util import _require_python3
 import os
 import re
+import sys
 import copy
 import json
 import numpy
 import pickle
+import hashlib
 import pandas
+import datetime
 import itertools
 import collections
 from copy import deepcopy
 import indra
 from indra.statements import *
 from indra.literature import pubmed_client
-from indra.databases import hgnc_client, uniprot_client, cbio_client
+from indra.databases import hgnc_client, uniprot_client, cbio_client, \
+                            context_client
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir))
+from gene_pmid_cache import get_pmids_for_genes
 
 rppa_file = 'data/TableS1-Split.xlsx'
-rppa_pkl = 'data/TableS1-Split.pkl'
+rppa_cache_dir = 'data/rppa_cache'
+# Increase this when the way the RPPA data is read or cached changes
+rppa_cache_version = 1
+# The CCLE context of the cell lines is cached here, and a cache recorded
+# earlier can be used as a fixture for offline runs with CCLE_OFFLINE set
+# (see the README). The folder is relative to this file rather than to the
+# working directory since scripts in dyn_model use the same cache.
+ccle_cache_dir = os.environ.get(
+    'CCLE_CACHE', os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               'data', 'ccle_cache'))
+ccle_offline = bool(os.environ.get('CCLE_OFFLINE'))
+# The cache is fetched again once it is older than this, unless offline
+ccle_cache_max_age_days = 30
+ccle_cache_version = 3
 expression_file = 'data/Expression_Filtered.csv'
 mutation_file = 'data/WES_variants_filtered.csv'
 mutation_effect_file = 'data/mutation_effects.tsv'
 
 
-def read_rppa_data(fname=rppa_pkl):
-    """Return RPPA data as a dict of median/std DataFrames."""
-    # If the filename passed is a pickle, just load it and return
-    if fname.endswith('pkl'):
-        print('Loading data from %s' % fname)
-        with open(fname, 'rb') as fh:
-            data = pickle.load(fh)
-            return data
+def get_file_hash(fname):
+    """Return the SHA-256 hash of a file's content."""
+    hasher = hashlib.sha256()
+    with open(fname, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(1 << 20), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
 
-    # Otherwise just read the excel file
+
+def read_rppa_excel(fname=rppa_file):
+    """Return RPPA data from the Excel workbook, opening it only once."""
     data = {}
-    for cell_line in cell_lines:
-        print('Reading data for %s' % cell_line)
-        data[cell_line] = {}
-        # Read both the median and the std sheet for each cell line
-        for data_type, postfix in (('median', ''), ('std', '-std')):
-            # Handle unpredictable number of extra rows before the actual
-            # header row.
-            i = 0
-            while True:
-                df = pandas.read_excel(fname, sheetname=(cell_line + postfix),
-                                       skiprows=i, header=0)
-                if df.columns[0] == 'Drug':
-                    break
-                i += 1
-            data[cell_line][data_type] = df
+    with pandas.ExcelFile(fname) as xls:
+        for cell_line in cell_lines:
+            print('Reading data for %s' % cell_line)
+            data[cell_line] = {}
+            # Read both the median and the std sheet for each cell line
+            for data_type, postfix in (('median', ''), ('std', '-std')):
+                sheet = xls.parse(cell_line + postfix, header=None)
+                # Handle unpredictable number of extra rows before the
+                # actual header row.
+                header_rows = numpy.where(sheet.iloc[:, 0] == 'Drug')[0]
+                if not len(header_rows):
+                    raise ValueError('No header row found in sheet %s' %
+                                     (cell_line + postfix))
+                header_row = header_rows[0]
+                df = sheet.iloc[header_row + 1:].reset_index(drop=True)
+                df.columns = list(sheet.iloc[header_row])
+                data[cell_line][data_type] = df.infer_objects()
+    return data
+
+
+def read_rppa_data(fname=rppa_file, cache_dir=rppa_cache_dir):
+    """Return RPPA data as a dict of median/std DataFrames.
+
+    The DataFrames are cached as one Parquet file per cell line and
+    statistic in cache_dir. The cache is rebuilt from the Excel workbook if
+    the hash of the workbook or the cache format version changes.
+    """
+    manifest_file = os.path.join(cache_dir, 'manifest.json')
+    source_hash = get_file_hash(fname)
+    manifest = {}
+    if os.path.exists(manifest_file):
+        with open(manifest_file, 'r') as fh:
+            manifest = json.load(fh)
+    cache_fname = lambda cell_line, data_type: \
+        os.path.join(cache_dir, '%s_%s.parquet' % (cell_line, data_type))
+    if manifest.get('version') == rppa_cache_version and \
+            manifest.get('source_hash') == source_hash:
+        print('Loading data from %s' % cache_dir)
+        return {cell_line: {data_type: pandas.read_parquet(
+                    cache_fname(cell_line, data_type))
+                            for data_type in ('median', 'std')}
+                for cell_line in manifest['cell_lines']}
+
+    data = read_rppa_excel(fname)
+    os.makedirs(cache_dir, exist_ok=True)
+    for cell_line, dfs in data.items():
+        for data_type, df in dfs.items():
+            df.to_parquet(cache_fname(cell_line, data_type), index=False)
+    # The manifest is written last so that a partial cache isn't used
+    with open(manifest_file, 'w') as fh:
+        json.dump({'version': rppa_cache_version,
+                   'source': os.path.basename(fname),
+                   'source_hash': source_hash,
+                   'cell_lines': list(data.keys())}, fh, indent=1)
     return data
 
 
+def parse_substitutions(changes, prefix=''):
+    """Return the parts of amino acid substitutions such as G12V.
+
+    Parameters
+    ----------
+    changes : pandas.Series
+        Amino acid changes, e.g., G12V, or p.G12V with prefix='p.'.
+    prefix : Optional[str]
+        A prefix expected before each substitution.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The aa_from, position and aa_to of each change as strings, with
+        NaNs for changes that aren't substitutions.
+    """
+    return changes.astype(str).str.extract(
+        '^%s(?P<aa_from>[A-Z])(?P<position>\\d+)(?P<aa_to>[A-Z])' %
+        re.escape(prefix))
+
+
+def group_substitutions(df, keys):
+    """Return lists of (aa_from, position, aa_to) tuples grouped by keys.
+
+    Groups and the substitutions within them are in order of appearance.
+    This is equivalent to a groupby on the key columns but avoids making a
+    DataFrame for each of the (typically many, small) groups.
+    """
+    groups = {}
+    for key, sub in zip(zip(*[df[key] for key in keys]),
+                        zip(df.aa_from, df.position, df.aa_to)):
+        groups.setdefault(key, []).append(sub)
+    return groups
+
+
 def read_variants(gene_names):
     """Return genetic variants reported by Sanger (provided locally)"""
-    def read_aa_change(aa_change):
-        match = re.match('p.([A-Z])(\d+)([A-Z])', aa_change)
-        if not match:
-            return None
-        groups = match.groups()
-        if len(groups) != 3:
-            return None
-        return groups
-
-    def read_for_cell_line(cell_line):
-        miss = {}
-        nons = []
-        df_filt = df[df.SAMPLE == cell_line]
-        for _, row in df_filt.iterrows():
-            # Check for valid/usable gene name
-            if row['Gene'] not in gene_names:
-                continue
-            if row['Classification'] == 'missense':
-                aa_change = read_aa_change(row['AA'])
-                if not aa_change:
-                    continue
-                if row['Gene'] not in miss:
-                    miss[row['Gene']] = [aa_change]
-                else:
-                    miss[row['Gene']].append(aa_change)
-            elif row['Classification'] == 'nonsense':
-                nons.append(row['Gene'])
-        return miss, nons
-
-    variants = {'missense': {}, 'nonsense': {}}
-    df = pandas.read_csv(mutation_file)
     cell_line_map = {'SK-MEL-28': 'SKMEL28', 'WM-115': 'WM115',
             'MZ7-mel': 'MZ7MEL', 'MMAC-SF': 'MMACSF', 'RVH-421': 'RVH421',
             'C32': 'C32', 'LOXIMVI': 'LOXIMVI'}
-    for cell_line_df, cell_line in cell_line_map.items():
-        variants['missense'][cell_line], variants['nonsense'][cell_line] = \
-            read_for_cell_line(cell_line_df)
+    df = pandas.read_csv(mutation_file,
+                         usecols=['SAMPLE', 'Gene', 'AA', 'Classification'])
+    # Check for valid/usable cell line and gene names
+    df = df[df.SAMPLE.isin(list(cell_line_map.keys())) &
+            df.Gene.isin(list(gene_names))]
+    df = df.assign(cell_line=df.SAMPLE.map(cell_line_map))
+
+    variants = {'missense': {cl: {} for cl in cell_line_map.values()},
+                'nonsense': {cl: [] for cl in cell_line_map.values()}}
+    miss = df[df.Classification == 'missense']
+    miss = pandas.concat([miss, parse_substitutions(miss.AA, 'p.')],
+                         axis=1).dropna(subset=['aa_from'])
+    for (cell_line, gene), muts in \
+            group_substitutions(miss, ['cell_line', 'Gene']).items():
+        variants['missense'][cell_line][gene] = muts
+    nons = df[df.Classification == 'nonsense']
+    for cell_line, genes in nons.groupby('cell_line', sort=False).Gene:
+        variants['nonsense'][cell_line] = list(genes)
     return variants
 
 
@@ -97,28 +176,21 @@ def read_ccle_variants(gene_names):
     cell_lines_db = [cl + '_SKIN' for cl in cell_lines]
     nons = cbio_client.get_ccle_mutations(gene_names, cell_lines_db, 'nonsense')
     miss = cbio_client.get_ccle_mutations(gene_names, cell_lines_db, 'missense')
-    tmp = copy.deepcopy(nons)
-    for cell_line, content in tmp.items():
-        for gene, muts in content.items():
-            if not muts:
-                nons[cell_line].pop(gene, None)
-    tmp = copy.deepcopy(miss)
-    for cell_line, content in tmp.items():
-        for gene, muts in content.items():
-            if not muts:
-                miss[cell_line].pop(gene, None)
-                continue
-            # Check for usable AA substitution
-            grouped_muts = []
-            for mut in muts:
-                match = re.match('([A-Z])(\d+)([A-Z])', mut)
-                if not match:
-                    continue
-                groups = match.groups()
-                if len(groups) != 3:
-                    continue
-                grouped_muts.append(groups)
-            miss[cell_line][gene] = grouped_muts
+    # Only keep genes with mutations
+    nons = {cell_line: {gene: muts for gene, muts in content.items() if muts}
+            for cell_line, content in nons.items()}
+    rows = [(cell_line, gene, mut) for cell_line, content in miss.items()
+            for gene, muts in content.items() for mut in muts]
+    miss = {cell_line: {gene: [] for gene, muts in content.items() if muts}
+            for cell_line, content in miss.items()}
+    # Check for usable AA substitutions
+    if rows:
+        df = pandas.DataFrame(rows, columns=['cell_line', 'gene', 'mut'])
+        df = pandas.concat([df, parse_substitutions(df.mut)],
+                           axis=1).dropna(subset=['aa_from'])
+        for (cell_line, gene), muts in \
+                group_substitutions(df, ['cell_line', 'gene']).items():
+            miss[cell_line][gene] = muts
 
     variants = {}
     variants['missense'] = miss
@@ -126,34 +198,141 @@ def read_ccle_variants(gene_names):
     return variants
 
 
+def _select_variants(variants, genes):
+    """Return the variants of the given genes from cached variants."""
+    gene_set = set(genes)
+    selected = {}
+    for var_type, by_cell_line in variants.items():
+        selected[var_type] = {}
+        for cell_line, by_gene in by_cell_line.items():
+            selected[var_type][cell_line] = {}
+            for gene, muts in by_gene.items():
+                if gene not in gene_set:
+                    continue
+                # JSON turns the (residue, position, residue) tuples of
+                # missense mutations into lists
+                if var_type == 'missense':
+                    muts = [tuple(mut) for mut in muts]
+                selected[var_type][cell_line][gene] = muts
+    return selected
+
+
+def get_ccle_context(genes, cache_dir=ccle_cache_dir, offline=ccle_offline,
+                     refresh=False, max_age_days=ccle_cache_max_age_days):
+    """Return the CCLE context of the given genes in all cell lines.
+
+    The copy number alterations, mRNA amounts and protein amounts (as
+    estimated by context_client.get_protein_expression, which is what
+    PysbAssembler.set_context uses) of all cell lines are fetched from
+    cBioPortal in one request each, along with the variants of
+    read_ccle_variants, and cached in cache_dir as gene by cell line
+    matrices. The cache is used if it covers the genes and, unless offline,
+    was fetched less than max_age_days ago.
+
+    Parameters
+    ----------
+    genes : list[str]
+        The names of the genes.
+    cache_dir : Optional[str]
+        The folder of the cache. Default: ccle_cache_dir
+    offline : Optional[bool]
+        If True, only the cache (e.g., a recorded fixture) is used and
+        cBioPortal isn't contacted, however old the cache is. Default:
+        ccle_offline
+    refresh : Optional[bool]
+        If True, the context is fetched again even if it is cached.
+        Default: False
+    max_age_days : Optional[float]
+        The age in days after which the cache is fetched again. Default:
+        ccle_cache_max_age_days
+
+    Returns
+    -------
+    dict
+        The 'cna', 'mrna' and 'protein' DataFrames indexed by gene with a
+        column per CCLE cell line, and the 'variants' as returned by
+        read_ccle_variants.
+    """
+    manifest_file = os.path.join(cache_dir, 'manifest.json')
+    cell_lines_db = [cl + '_SKIN' for cl in cell_lines]
+    manifest = {}
+    if os.path.exists(manifest_file):
+        with open(manifest_file, 'r') as fh:
+            manifest = json.load(fh)
+    covered = manifest.get('version') == ccle_cache_version and \
+        set(genes) <= set(manifest['genes']) and \
+        set(cell_lines_db) <= set(manifest['cell_lines'])
+    if covered:
+        fetched = datetime.datetime.strptime(manifest['fetched'],
+                                             '%Y-%m-%d %H:%M:%S')
+        age_days = (datetime.datetime.now() - fetched).total_seconds() / 86400
+    if offline and refresh:
+        raise ValueError('The CCLE context can\'t be refreshed offline.')
+    if covered and not refresh and (offline or age_days < max_age_days):
+        print('Loading CCLE context fetched on %s from %s' %
+              (manifest['fetched'], cache_dir))
+        # Only the requested genes are kept since, e.g., the mRNA threshold
+        # of contextualization depends on them
+        context = {data_type: pandas.read_parquet(
+                       os.path.join(cache_dir, '%s.parquet' % data_type)
+                       ).reindex(index=genes, columns=cell_lines_db)
+                   for data_type in ('cna', 'mrna', 'protein')}
+        with open(os.path.join(cache_dir, 'variants.json'), 'r') as fh:
+            context['variants'] = _select_variants(json.load(fh), genes)
+        return context
+    if offline:
+        raise ValueError('The CCLE context cache in %s does not cover the '
+                         'genes and cell lines needed.' % cache_dir)
+
+    print('Fetching CCLE context of %d genes in %d cell lines' %
+          (len(genes), len(cell_lines_db)))
+    context = {
+        'cna': pandas.DataFrame(
+            cbio_client.get_ccle_cna(genes, cell_lines_db),
+            index=genes, columns=cell_lines_db, dtype=float),
+        'mrna': pandas.DataFrame(
+            cbio_client.get_ccle_mrna(genes, cell_lines_db),
+            index=genes, columns=cell_lines_db, dtype=float),
+        'protein': pandas.DataFrame(
+            context_client.get_protein_expression(genes, cell_lines_db),
+            index=genes, columns=cell_lines_db, dtype=float),
+        'variants': read_ccle_variants(genes)}
+    os.makedirs(cache_dir, exist_ok=True)
+    for data_type in ('cna', 'mrna', 'protein'):
+        context[data_type].to_parquet(
+            os.path.join(cache_dir, '%s.parquet' % data_type))
+    with open(os.path.join(cache_dir, 'variants.json'), 'w') as fh:
+        json.dump(context['variants'], fh, indent=1)
+    # The manifest is written last so that a partial cache isn't used
+    with open(manifest_file, 'w') as fh:
+        json.dump({'version': ccle_cache_version, 'genes': list(genes),
+                   'cell_lines': cell_lines_db,
+                   'fetched': datetime.datetime.now().strftime(
+                       '%Y-%m-%d %H:%M:%S')}, fh, indent=1)
+    return context
+
+
 def read_mutation_effects():
     """Read mutation effects from PathwayCommons as ActiveForms."""
     df = pandas.read_csv(mutation_effect_file, sep='\t')
+    # Check for usable AA substitutions
+    df = pandas.concat([df, parse_substitutions(df.Substitution)], axis=1)
+    # Check if the reported effect is positive or negative
+    decreasing = df.Effect.str.contains('decreasing', na=False)
+    increasing = df.Effect.str.contains('increasing', na=False)
+    df = df.assign(is_active=increasing & ~decreasing)
+    df = df[df.aa_from.notnull() & (decreasing | increasing)]
     stmts = []
-    for _, row in df.iterrows():
-        # Check for usable AA substitution
-        match = re.match('([A-Z])(\d+)([A-Z])', row['Substitution'])
-        if not match:
-            continue
-        groups = match.groups()
-        if len(groups) != 3:
-            continue
-        aa_from, position, aa_to = groups
+    for gene, aa_from, position, aa_to, is_active in \
+            zip(df.Gene, df.aa_from, df.position, df.aa_to, df.is_active):
         # Make a grounded agent for the ActiveForm
-        agent = agent_from_gene_name(row['Gene'])
+        agent = agent_from_gene_name(gene)
         if not agent.db_refs:
             continue
-        # Check if the reported effect is positive or negative
-        if 'decreasing' in row['Effect']:
-            is_active = False
-        elif 'increasing' in row['Effect']:
-            is_active = True
-        else:
-            continue
         # Make an ActiveForm Statement
         mc = MutCondition(position, aa_from, aa_to)
         agent.mutations = [mc]
-        af = ActiveForm(agent, 'activity', is_active)
+        af = ActiveForm(agent, 'activity', bool(is_active))
         stmts.append(af)
     return stmts
 
@@ -215,10 +394,9 @@ def get_gene_names(data):
 
 def get_gene_pmids(gene_names):
     """Return PMIDs for all genes of interest."""
-    genes_pmid_list = []
-    for gene in gene_names:
-        genes_pmid_list += pubmed_client.get_ids_for_gene(gene)
-    genes_pmid_list = list(set(genes_pmid_list))
+    pmids_by_gene = get_pmids_for_genes(gene_names)
+    genes_pmid_list = list(set([pmid for pmids in pmids_by_gene.values()
+                                for pmid in pmids]))
     print('Found %d PMIDs for genes' % len(genes_pmid_list))
     return genes_pmid_list
 
@@ -432,6 +610,19 @@ drug_targets = {'AZ628': ['BRAF'],
                 'Vemurafenib': ['BRAF'],
                 'PLX4720': ['BRAF']}
 
+# In vitro IC50s (in uM) of each drug against its (mutant) target kinase:
+# AZ628 against BRAF V600E (Montagut et al., Cancer Res 2008, 68:4853),
+# selumetinib (AZD6244) against MEK1 (Yeh et al., Mol Cancer Ther 2007,
+# 6:2233), vemurafenib (PLX4032) against BRAF V600E (Bollag et al., Nature
+# 2010, 467:596) and PLX4720 against BRAF V600E (Tsai et al., PNAS 2008,
+# 105:3041). For SB590885, the Ki against BRAF (King et al., Cancer Res 2006,
+# 66:11100) is used since no IC50 is reported.
+drug_ic50s = {'AZ628': 0.034,
+              'Selumetinib': 0.014,
+              'SB590885': 0.00016,
+              'Vemurafenib': 0.031,
+              'PLX4720': 0.013}
+
 drug_grounding = {
         'AZ628': {'CHEBI': '1'},
         'Selumetinib': {'CHEBI': '2'},
@@ -508,3 +699,18 @@ antibody_map = {
     'p27 Kip1':
         {'CDKN1B': []}
     }
+
+
+if __name__ == '__main__':
+    # Record the CCLE context of the genes of the models in this folder and
+    # of the genes listed one per line in any given files, e.g.,
+    # python process_data.py record_ccle ../dyn_model/gene_list_fabian.txt
+    if len(sys.argv) > 1 and sys.argv[1] == 'record_ccle':
+        genes = set(get_gene_names(read_rppa_data()))
+        for fname in sys.argv[2:]:
+            with open(fname, 'rt') as fh:
+                genes |= {line.strip() for line in fh if line.strip()}
+        genes = sorted(genes)
+        get_ccle_context(genes, refresh=True)
+        print('Recorded the CCLE context of %d genes in %s' %
+              (len(genes), ccle_cache_dir))
@@ -1,9 +1,8 @@
-import itertools
 from indra.assemblers.english import EnglishAssembler
-from indra.explanation.reporting import stmts_from_pysb_path
-from indra.explanation.model_checker import PysbModelChecker
 from util import pklload, pkldump
 from process_data import *
+from parallel_check import get_global_mc, get_scored_paths
+from group_paths import RuleIndex
 
 
 def get_task_5(data, inverse=False):
@@ -43,8 +42,10 @@ def get_task_5(data, inverse=False):
 
 ##################
 # Refactor these in reusable chunks into explanations/reporting
-def export_paths(scored_paths, model, stmts):
+def export_paths(scored_paths, model, stmts, index=None):
     """Export paths for pathway map in JSON-like format."""
+    if index is None:
+        index = RuleIndex(model, stmts)
     conc = 1.0
     time = 10
     paths = {}
@@ -54,14 +55,16 @@ def export_paths(scored_paths, model, stmts):
             path, score = scpaths[0]
             label = '%s_%s_%s_%s' % (drug, time, conc, cell_line)
             paths[label] = {'meta': [], 'path': []}
-            path_stmts = stmts_from_pysb_path(path, model, stmts)
+            path_stmts = index.get_path_stmts(path)
             uuids = [stmt.uuid for stmt in path_stmts]
             paths[label]['path'] = uuids
     return paths
 
 
-def report_paths(scored_paths, model, stmts, cell_line):
+def report_paths(scored_paths, model, stmts, cell_line, index=None):
     """Report paths for a specific cell line."""
+    if index is None:
+        index = RuleIndex(model, stmts)
     citations = {}
     citation_count = 1
     ab_name = 'Total c-Jun'
@@ -77,7 +80,7 @@ def report_paths(scored_paths, model, stmts, cell_line):
             title += ' in %s cells?' % cell_line
             print(title)
             print('=' * len(title))
-            path_stmts = stmts_from_pysb_path(path, model, stmts)
+            path_stmts = index.get_path_stmts(path)
             sentences = []
             for i, stmt in enumerate(path_stmts):
                 if i == 0:
@@ -122,20 +125,6 @@ def get_agent_values(antibody_agents, values):
     return agent_values
 
 
-def get_global_mc(model, stmts_to_check, agents_to_observe):
-    all_stmts_condition = []
-    for cell_line in stmts_to_check.keys():
-        for drug in stmts_to_check[cell_line].keys():
-            stmts_condition, _ = stmts_to_check[cell_line][drug][1.0]
-            all_stmts_condition += stmts_condition
-    mc = PysbModelChecker(model, all_stmts_condition, agents_to_observe)
-    mc.prune_influence_map()
-    return mc
-
-
-def flatten(x): return list(itertools.chain.from_iterable(x))
-
-
 if __name__ == '__main__':
     INVERSE = False
     if INVERSE:
@@ -150,44 +139,20 @@ if __name__ == '__main__':
     # Get all the data for Task 5
     stmts_to_check = get_task_5(data, INVERSE)
     dose = 1.0
-    scored_paths = {}
-    models = {}
-    global_mc = None
-    # Run model checking per cell line
-    for cell_line in stmts_to_check.keys():
-        print('Cell line: %s\n=============' % cell_line)
-        model = pklload('pysb_model_%s' % cell_line)
-        scored_paths[cell_line] = {}
+
+    def get_mc(cell_line):
         # Make a Model Checker with the
         # - model contextualized to the cell line
         # - the statements for the given condition
         # - agents for which observables need to be made
-        global_mc = get_global_mc(model, stmts_to_check, agents_to_observe)
-        for drug in stmts_to_check[cell_line].keys():
-            print('Drug: %s\n=============' % drug)
-            # Get all the statements and values for the condition
-            stmts_condition, values_condition = \
-                stmts_to_check[cell_line][drug][dose]
-            path_results = []
-            for stmt in stmts_condition:
-                pr = global_mc.check_statement(stmt, 1000, 8)
-                path_results.append(pr)
-            # Get a dict of measured values by INDRA Agents for this condition
-            agent_values = get_agent_values(antibody_agents, values_condition)
-            # Get a single list of paths for this condition
-            # The length of this will be the max path number times the number
-            # of Statements being checked
-            paths = flatten([pr.paths for pr in path_results])
-            # Run score paths with
-            # - the list of paths the model checker produced
-            # - the values of observed agents in the current condition
-            # - loss of function mode since these are inhibitory drugs
-            # - sigma corresponding to the log2 normalized measurements
-            scored_paths_condition = global_mc.score_paths(paths, agent_values,
-                                                    loss_of_function=True,
-                                                    sigma=0.5)
-            scored_paths[cell_line][drug] = scored_paths_condition
-        models[cell_line] = global_mc.model
+        model = pklload('pysb_model_%s' % cell_line)
+        return get_global_mc(model, stmts_to_check, agents_to_observe)
+
+    # Run model checking and path scoring for each cell line, drug and
+    # statement in parallel
+    scored_paths, models, _ = get_scored_paths(
+        stmts_to_check, get_mc,
+        lambda values: get_agent_values(antibody_agents, values), dose=dose)
 
     # Dump results in standard folder
     fname = 'task5_scored_paths'
@@ -1,36 +1,110 @@
-import copy
+import os
 import numpy
+import pandas
+import multiprocessing
 from pysb.bng import generate_equations
 from pysb.simulator import ScipyOdeSimulator
 from pysb import Observable, ReactionPattern, ComplexPattern
 
-from util import pkldump, pklload
+from util import pklload, based, basen
 from process_data import *
 
 # ### User defined parameters
 time_lim_hrs = 10
 time_steps = 100
+# How drugs act on their targets: 'dose' simulates every drug at every dose,
+# reducing the initial amounts of the targets of each drug by the fraction
+# inhibited at each dose, given the drug's IC50 in drug_ic50s. 'knockout'
+# instead sets the initial amounts of the knocked out monomers to zero, as
+# the original RAF inhibition simulation did.
+inhibition = 'dose'
+# The monomers of each condition in the knockout mode
+knockout_targets = {'RAF': ['ARAF', 'BRAF', 'RAF1']}
+# The number of processes the simulations of each model are spread across
+num_processors = multiprocessing.cpu_count()
 # ##########################
 
 
-def run_simulation_condition(sim, inhib_monomers):
-    if inhib_monomers:
-        print('Setting inhibition condition for %s' %
-              ', '.join(inhib_monomers))
-    old_params = {p.name: p.value for p in sim.model.parameters}
-    sim_params = copy.copy(old_params)
-    for monomer_name in inhib_monomers:
-        init_name = monomer_name + '_0'
-        sim_params[init_name] = 0
-
-    print('Running simulation')
-    res = sim.run(param_values=sim_params)
-
-    print('Reverting change to model initial conditions')
-    for monomer_name in inhib_monomers:
-        init_name = monomer_name + '_0'
-        model.parameters[init_name].value = old_params[init_name]
-    return res
+def get_conditions(inhibition=inhibition):
+    """Return the (drug, dose) conditions to simulate, including a control
+    without drug.
+
+    In the knockout mode, there is one condition per entry of
+    knockout_targets, without a dose.
+    """
+    conditions = [('none', 0.0)]
+    if inhibition == 'knockout':
+        for drug in knockout_targets.keys():
+            conditions.append((drug, numpy.nan))
+    else:
+        for drug in drug_names.keys():
+            for dose in drug_doses:
+                conditions.append((drug, dose))
+    return conditions
+
+
+def get_condition_params(model, conditions, inhibition=inhibition):
+    """Return the parameter values of the model in each condition.
+
+    In the knockout mode, the initial amounts of the monomers knocked out in
+    a condition are set to zero. In the dose mode, the initial amounts of the
+    targets of a drug are reduced by the fraction of the targets inhibited
+    at the given dose, 1 / (1 + dose / IC50), with the drug's own IC50.
+
+    Returns
+    -------
+    numpy.ndarray
+        A matrix with one row of parameter values per condition.
+    """
+    if inhibition not in ('knockout', 'dose'):
+        raise ValueError('Unknown inhibition mode: %s' % inhibition)
+    param_names = [p.name for p in model.parameters]
+    param_values = numpy.tile([p.value for p in model.parameters],
+                              (len(conditions), 1))
+    for ix, (drug, dose) in enumerate(conditions):
+        if inhibition == 'knockout':
+            targets = knockout_targets.get(drug, [])
+            remaining = 0.0
+        else:
+            targets = drug_targets.get(drug, [])
+            remaining = 1.0 / (1.0 + dose / drug_ic50s[drug]) \
+                if targets else 1.0
+        for target in targets:
+            init_name = target + '_0'
+            if init_name not in param_names:
+                continue
+            param_values[ix, param_names.index(init_name)] *= remaining
+    return param_values
+
+
+def simulate_conditions(model, cell_line, ts, conditions,
+                        num_processors=1, inhibition=inhibition):
+    """Return the observables of a model simulated in a set of conditions.
+
+    The model is compiled once and all the conditions are simulated as one
+    batch of parameter values, spread across processes.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The observable trajectories indexed by cell line, drug, dose and
+        time.
+    """
+    print('Instantiating simulator')
+    sim = ScipyOdeSimulator(model, ts, verbose=True)
+    print('Running %d simulations on %d processes' %
+          (len(conditions), num_processors))
+    res = sim.run(param_values=get_condition_params(model, conditions,
+                                                    inhibition),
+                  num_processors=num_processors)
+    df = res.dataframe[[obs.name for obs in model.observables]]
+    sim_ix = df.index.get_level_values('simulation')
+    drugs, doses = zip(*conditions)
+    df.index = pandas.MultiIndex.from_arrays(
+        [[cell_line] * len(df), numpy.array(drugs)[sim_ix],
+         numpy.array(doses)[sim_ix], df.index.get_level_values('time')],
+        names=['cell_line', 'drug', 'dose', 'time'])
+    return df
 
 
 def set_model_observables(model):
@@ -49,7 +123,9 @@ def set_model_observables(model):
 if __name__ == '__main__':
     time_lim_seconds = time_lim_hrs * 3600
     ts = numpy.linspace(0, time_lim_seconds, time_steps + 1)
+    conditions = get_conditions(inhibition)
 
+    results = []
     for cell_line  in ('C32', 'LOXIMVI', 'MMACSF', 'MZ7MEL', 'RVH421'):
         print('Loading model for %s' % cell_line)
         model = pklload('pysb_model_%s' % cell_line)
@@ -59,10 +135,10 @@ if __name__ == '__main__':
         print('Generating model equations')
         generate_equations(model)
 
-        print('Instantiating simulator')
-        sim = ScipyOdeSimulator(model, ts, use_theano=True, verbose=True)
-
-        res_drug = run_simulation_condition(sim, ['ARAF', 'BRAF', 'RAF1'])
-        res_nodrug = run_simulation_condition(sim, [])
-        break
+        results.append(simulate_conditions(model, cell_line, ts, conditions,
+                                           num_processors, inhibition))
 
+    # Save the trajectories of all conditions in a single columnar file
+    fname = os.path.join(based, basen + '_task1_simulations.parquet')
+    print('Saving simulation results in %s' % fname)
+    pandas.concat(results).to_parquet(fname)
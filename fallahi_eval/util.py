@@ -1,8 +1,7 @@
 from indra.util import _require_python3
 import os
 import json
-import time
-import pickle
+from artifact_store import ArtifactStore
 
 # CREATE A JSON FILE WITH THIS INFORMATION, E.G., a file consisting of:
 # {"basename": "fallahi_eval", "basedir": "output"}
@@ -17,17 +16,13 @@ based = config['basedir']
 # This makes it easier to make standardized pickle file paths
 prefixed_pkl = lambda suffix: os.path.join(based, basen + '_' + suffix + '.pkl')
 
+# Artifacts are optionally compressed with "zstd" or "lz4", which can be
+# set as "compression" in the config (null for no compression)
+store = ArtifactStore(based, basen,
+                      compression=config.get('compression', 'default'))
+
 def pkldump(suffix, content):
-    fname = prefixed_pkl(suffix)
-    with open(fname, 'wb') as fh:
-        pickle.dump(content, fh)
+    store.dump(suffix, content)
 
 def pklload(suffix):
-    fname = prefixed_pkl(suffix)
-    print('Loading %s' % fname)
-    ts = time.time()
-    with open(fname, 'rb') as fh:
-        content = pickle.load(fh)
-    te = time.time()
-    print('Loaded %s in %.1f seconds' % (fname, te-ts))
-    return content
+    return store.load(suffix)
@@ -0,0 +1,159 @@
+"""
+A persistent on-disk cache of gene to PMID lookups shared by the literature
+gathering scripts in this repository (e.g., hgnc_all, ras_220_genes, kdm1a,
+fallahi_eval and ndex_networks).
+
+Results are stored in an SQLite file keyed by the gene symbol (or search
+term) and the type of query, so that genes occurring in several gene lists
+are only looked up once. Entries older than a given time-to-live are
+considered stale and are looked up again.
+
+The location of the cache defaults to ~/.indra_apps/gene_pmids.sqlite and
+can be changed with the GENE_PMID_CACHE environment variable. Scripts in
+subfolders import this module after adding the repository root to sys.path.
+"""
+from __future__ import absolute_import, print_function, unicode_literals
+import os
+import json
+import time
+import sqlite3
+
+
+default_cache_path = os.environ.get(
+    'GENE_PMID_CACHE',
+    os.path.join(os.path.expanduser('~'), '.indra_apps', 'gene_pmids.sqlite'))
+
+# Entries are looked up again after 30 days by default
+default_ttl = 30 * 24 * 3600
+
+
+def _get_ids_for_gene(gene):
+    from indra.literature import pubmed_client
+    return pubmed_client.get_ids_for_gene(gene)
+
+
+def _get_ids_for_term(term):
+    from indra.literature import pubmed_client
+    return pubmed_client.get_ids(term, retmax=100000)
+
+
+# Functions used to look up entries missing from the cache by query type
+query_functions = {
+    'gene': _get_ids_for_gene,
+    'search': _get_ids_for_term,
+}
+
+
+class GenePmidCache(object):
+    """An SQLite-backed cache of PMIDs keyed by gene and query type.
+
+    Parameters
+    ----------
+    path : Optional[str]
+        The path to the SQLite file. Default: default_cache_path
+    ttl : Optional[float]
+        The number of seconds after which an entry is stale. If None,
+        entries never expire. Default: 30 days
+    """
+    # SQLite limits the number of variables in a single statement
+    chunk_size = 500
+
+    def __init__(self, path=None, ttl=default_ttl):
+        self.path = path if path else default_cache_path
+        self.ttl = ttl
+        dirname = os.path.dirname(self.path)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute('CREATE TABLE IF NOT EXISTS gene_pmids '
+                             '(gene TEXT, query_type TEXT, pmids TEXT, '
+                             'timestamp REAL, '
+                             'PRIMARY KEY (gene, query_type))')
+        finally:
+            conn.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=60)
+
+    def get_many(self, genes, query_type='gene'):
+        """Return the cached, non-stale PMIDs for a list of genes.
+
+        Genes that aren't in the cache or whose entry is stale are left out
+        of the returned dict.
+        """
+        genes = list(genes)
+        min_time = time.time() - self.ttl if self.ttl is not None else 0
+        pmids_by_gene = {}
+        conn = self._connect()
+        try:
+            for ix in range(0, len(genes), self.chunk_size):
+                chunk = genes[ix:ix + self.chunk_size]
+                rows = conn.execute(
+                    'SELECT gene, pmids FROM gene_pmids '
+                    'WHERE query_type = ? AND timestamp >= ? '
+                    'AND gene IN (%s)' % ','.join('?' * len(chunk)),
+                    [query_type, min_time] + chunk)
+                for gene, pmids in rows:
+                    pmids_by_gene[gene] = json.loads(pmids)
+        finally:
+            conn.close()
+        return pmids_by_gene
+
+    def put_many(self, pmids_by_gene, query_type='gene'):
+        """Store a dict of lists of PMIDs keyed by gene in the cache."""
+        now = time.time()
+        rows = [(gene, query_type, json.dumps(list(pmids)), now)
+                for gene, pmids in pmids_by_gene.items()]
+        conn = self._connect()
+        try:
+            with conn:
+                conn.executemany('INSERT OR REPLACE INTO gene_pmids '
+                                 'VALUES (?, ?, ?, ?)', rows)
+        finally:
+            conn.close()
+
+    def get_pmids(self, genes, query_type='gene', fetch=None):
+        """Return PMIDs for a list of genes, looking up only uncached ones.
+
+        Parameters
+        ----------
+        genes : list[str]
+            The genes (or search terms) to get PMIDs for.
+        query_type : Optional[str]
+            The type of query, one of the keys of query_functions unless
+            `fetch` is given. Default: gene
+        fetch : Optional[function]
+            A function returning the list of PMIDs for a single gene, used
+            for genes missing from the cache.
+
+        Returns
+        -------
+        dict
+            The lists of PMIDs keyed by gene. Genes for which the lookup
+            raised a ValueError (e.g., invalid gene names) are left out.
+        """
+        if fetch is None:
+            fetch = query_functions[query_type]
+        pmids_by_gene = self.get_many(genes, query_type)
+        missing = [g for g in genes if g not in pmids_by_gene]
+        print('Found %d of %d genes in PMID cache' %
+              (len(genes) - len(missing), len(genes)))
+        new_pmids = {}
+        try:
+            for gene in missing:
+                try:
+                    new_pmids[gene] = fetch(gene)
+                except ValueError as e:
+                    print('Could not get PMIDs for %s: %s' % (gene, e))
+        # Cache what we've got so far even if the lookups are interrupted
+        finally:
+            self.put_many(new_pmids, query_type)
+        pmids_by_gene.update(new_pmids)
+        return pmids_by_gene
+
+
+def get_pmids_for_genes(genes, query_type='gene'):
+    """Return PMIDs for a list of genes using the default cache."""
+    return GenePmidCache().get_pmids(genes, query_type)
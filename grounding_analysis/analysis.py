@@ -1,10 +1,16 @@
 import os
 import sys
 import csv
+import gzip
+import json
+import heapq
 import tqdm
 import random
+import tempfile
+import itertools
 from collections import Counter
-from indra.statements import Complex
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from indra.statements import Complex, stmts_from_json, stmts_to_json
 from indra.sources import indra_db_rest
 from indra.databases import hgnc_client, get_identifiers_url
 
@@ -15,8 +21,63 @@ def get_statements(db_ns, db_id, ev_limit=100):
     return ip.statements
 
 
-def get_raw_strings(stmts, db_ns, db_id):
-    raw_strings = []
+def get_cached_statements(db_ns, db_id, ev_limit=100,
+                          cache_dir='stmt_cache'):
+    """Return statements for an agent, from the on-disk cache if possible.
+
+    Responses are cached as gzipped JSON files keyed by the agent and the
+    evidence limit so that other gene lists with overlapping genes reuse
+    them.
+    """
+    fname = os.path.join(cache_dir, '%s_%s_%d.json.gz' %
+                         (db_ns, db_id.replace(':', '_'), ev_limit))
+    if os.path.exists(fname):
+        with gzip.open(fname, 'rt') as fh:
+            return stmts_from_json(json.load(fh))
+    stmts = get_statements(db_ns, db_id, ev_limit=ev_limit)
+    os.makedirs(cache_dir, exist_ok=True)
+    # Write to a uniquely named temporary file first so that an interrupted
+    # write isn't cached and threads writing the same file don't clash
+    fd, tmp_fname = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as raw_fh, \
+            gzip.open(raw_fh, 'wt') as fh:
+        json.dump(stmts_to_json(stmts), fh)
+    os.replace(tmp_fname, fname)
+    return stmts
+
+
+def fetch_statements(db_ns, db_ids, ev_limit=100, num_workers=8,
+                     cache_dir='stmt_cache', max_pending=None):
+    """Generate (db_id, statements) pairs, fetched with a pool of threads.
+
+    Pairs are generated in the order in which the fetches complete. Agents
+    that are cached on disk don't hit the network. At most max_pending
+    fetches (by default twice the number of workers) are submitted or
+    waiting to be consumed at a time, so only the statements of those
+    agents are held in memory.
+    """
+    if max_pending is None:
+        max_pending = 2 * num_workers
+    db_ids = iter(db_ids)
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        futures = {}
+
+        def submit_next():
+            for db_id in itertools.islice(db_ids,
+                                          max_pending - len(futures)):
+                futures[executor.submit(get_cached_statements, db_ns,
+                                        db_id, ev_limit, cache_dir)] = db_id
+
+        submit_next()
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield futures.pop(future), future.result()
+            submit_next()
+
+
+def iter_raw_strings(stmts, db_ns, db_id):
+    """Generate the raw texts of an agent in a list of statements."""
     for stmt in stmts:
         # Raw annotations for Complexes are not reliable
         # due to possible reordering
@@ -28,24 +89,77 @@ def get_raw_strings(stmts, db_ns, db_id):
                     agents = ev.annotations['agents']
                     text = agents['raw_text'][idx]
                     if text:
-                        raw_strings.append(text)
-    return raw_strings
+                        yield text
 
 
-def get_top_counts(raw_strings, threshold=0.8):
-    cnt = Counter(raw_strings)
-    ranked_list = cnt.most_common()
-    total = sum(c for e, c in ranked_list)
+def get_raw_strings(stmts, db_ns, db_id):
+    return list(iter_raw_strings(stmts, db_ns, db_id))
+
+
+def get_top_elements(counts, threshold=0.8):
+    """Return the most frequent elements that cover a fraction of counts.
+
+    Parameters
+    ----------
+    counts : list[tuple]
+        A list of (element, count) pairs, in the order in which the elements
+        were first seen (this order breaks ties between equal counts).
+    threshold : Optional[float]
+        The fraction of the total count the returned elements have to cover.
+
+    Returns
+    -------
+    list[tuple]
+        The top (element, count) pairs, most frequent first.
+    """
+    total = sum(c for _, c in counts)
+    # Only the top of the heap is sorted, as far as needed
+    heap = [(-count, ix, element) for ix, (element, count)
+            in enumerate(counts)]
+    heapq.heapify(heap)
     top_list = []
     cum_sum = 0
-    for element, count in ranked_list:
-        cum_sum += (count / total)
-        top_list.append((element, count))
+    while heap:
+        neg_count, _, element = heapq.heappop(heap)
+        cum_sum += (-neg_count / total)
+        top_list.append((element, -neg_count))
         if cum_sum >= threshold:
             break
     return top_list
 
 
+def get_top_counts(raw_strings, threshold=0.8):
+    return get_top_elements(list(Counter(raw_strings).items()), threshold)
+
+
+class RawTextCounter(object):
+    """Count raw agent texts per gene as statements arrive.
+
+    Texts are interned in a table shared by all genes and each gene only
+    keeps a dict of text indices to counts, so neither the statements nor
+    the lists of raw texts have to be kept in memory.
+    """
+    def __init__(self, db_ns='HGNC'):
+        self.db_ns = db_ns
+        self.texts = []
+        self.text_idx = {}
+        self.counts = {}
+
+    def add_statements(self, db_id, stmts):
+        counts = self.counts.setdefault(db_id, {})
+        for text in iter_raw_strings(stmts, self.db_ns, db_id):
+            idx = self.text_idx.get(text)
+            if idx is None:
+                idx = self.text_idx[text] = len(self.texts)
+                self.texts.append(text)
+            counts[idx] = counts.get(idx, 0) + 1
+
+    def get_top_counts(self, db_id, threshold=0.8):
+        top_list = get_top_elements(list(self.counts.get(db_id, {}).items()),
+                                    threshold)
+        return [(self.texts[idx], count) for idx, count in top_list]
+
+
 def get_all_client_hgnc_ids():
     # All HGNC IDs in the client
     return sorted(list(hgnc_client.hgnc_names.keys()))
@@ -133,37 +247,34 @@ def get_dark_kinase_hgnc_ids():
 
 
 def generate_report(genes, top_lists, fname):
-    html = '<table border=1>\n%s\n</table>'
-    rows = []
-    for gene, top_list in sorted(zip(genes, top_lists),
-                                 key=lambda x: sum([y[1] for y in x[1]]),
-                                 reverse=True):
-        row = '<tr><td>%s</td><td>%s</td></tr>'
-        gene_entry = '<a href="%s">%s</a>' % \
-            (get_identifiers_url('HGNC', gene),
-             hgnc_client.get_hgnc_name(gene))
-        top_list_entries = []
-        for element, count in top_list:
-            url = ('https://db.indra.bio/statements/from_agents?'
-                   'agent0=%s@TEXT&format=html' % element)
-            top_list_entries.append('<a href="%s">%s</a> (%d)' %
-                                    (url, element, count))
-        top_list_entry = ', '.join(top_list_entries)
-        row = row % (gene_entry, top_list_entry)
-        rows.append(row)
-    html = html % ('\n'.join(rows))
+    # Rows are written one at a time instead of building the whole page
     with open(fname, 'w') as fh:
-        fh.write(html)
+        fh.write('<table border=1>\n')
+        for gene, top_list in sorted(zip(genes, top_lists),
+                                     key=lambda x: sum([y[1] for y in x[1]]),
+                                     reverse=True):
+            row = '<tr><td>%s</td><td>%s</td></tr>\n'
+            gene_entry = '<a href="%s">%s</a>' % \
+                (get_identifiers_url('HGNC', gene),
+                 hgnc_client.get_hgnc_name(gene))
+            top_list_entries = []
+            for element, count in top_list:
+                url = ('https://db.indra.bio/statements/from_agents?'
+                       'agent0=%s@TEXT&format=html' % element)
+                top_list_entries.append('<a href="%s">%s</a> (%d)' %
+                                        (url, element, count))
+            top_list_entry = ', '.join(top_list_entries)
+            fh.write(row % (gene_entry, top_list_entry))
+        fh.write('</table>')
 
 
 if __name__ == '__main__':
     genes = get_all_kinase_hgnc_ids()
     #genes = [random.choice(genes) for _ in range(100)]
     #genes = ['9871']
-    top_lists = []
-    for gene in tqdm.tqdm(genes):
-        stmts = get_statements('HGNC', gene)
-        raw_strings = get_raw_strings(stmts, 'HGNC', gene)
-        top_list = get_top_counts(raw_strings)
-        top_lists.append(top_list)
+    counter = RawTextCounter('HGNC')
+    for gene, stmts in tqdm.tqdm(fetch_statements('HGNC', genes),
+                                 total=len(genes)):
+        counter.add_statements(gene, stmts)
+    top_lists = [counter.get_top_counts(gene) for gene in genes]
     generate_report(genes, top_lists, 'report_ion_channel.html')
@@ -1,15 +1,221 @@
 """
 Script to get curated PMIDs in Entrez Gene for all approved gene symbols in
-HGNC. There are roughly 40k approved symbols so the search takes several hours.
+HGNC. There are roughly 40k approved symbols; the queries are sent from a
+pool of worker threads, limited to a given number of requests per second
+(NCBI allows 3 per second without an API key and 10 with one).
+
+Every result is appended to a journal file as soon as it arrives, so an
+interrupted run can be resumed by replaying the journal. Genes found in the
+shared gene PMID cache (see gene_pmid_cache.py) are not queried, and new
+results are added to it. The full dict of PMIDs is pickled once at the end.
 """
 from __future__ import absolute_import, print_function, unicode_literals
 from builtins import dict, str
+import os
+import sys
+import json
+import time
+import pickle
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir))
+from gene_pmid_cache import GenePmidCache
+
+
+class RateLimiter(object):
+    """Space out calls from multiple threads to a given rate per second."""
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self.next_time = time.time()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.time()
+            wait_time = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+
+def read_journal(journal_fname):
+    """Return PMIDs by gene and the genes that failed from a journal file."""
+    pmids_for_gene = {}
+    failed = set()
+    if not os.path.exists(journal_fname):
+        return pmids_for_gene, failed
+    with open(journal_fname, 'rt') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            # The last line may be incomplete if the run was interrupted
+            except ValueError:
+                continue
+            if 'error' in entry:
+                failed.add(entry['gene'])
+            else:
+                pmids_for_gene[entry['gene']] = entry['pmids']
+    return pmids_for_gene, failed
+
+
+def truncate_partial_line(journal_fname):
+    """Remove an incomplete last line left in a journal by an interrupted
+    run so that appended entries start on a line of their own."""
+    if not os.path.exists(journal_fname):
+        return
+    with open(journal_fname, 'rb+') as f:
+        f.seek(0, os.SEEK_END)
+        end = f.tell()
+        pos = end
+        # Search backwards from the end for the last newline
+        while pos > 0:
+            size = min(4096, pos)
+            f.seek(pos - size)
+            newline = f.read(size).rfind(b'\n')
+            if newline >= 0:
+                pos = pos - size + newline + 1
+                break
+            pos -= size
+        if pos < end:
+            print('Removing incomplete last line of %s' % journal_fname)
+            f.truncate(pos)
+
+
+def get_pmids_with_retry(gene, get_ids, limiter, max_tries=5, backoff=2.0):
+    """Return the PMIDs for a gene, retrying with exponential backoff.
+
+    A ValueError (raised for invalid gene names) is not retried.
+    """
+    for attempt in range(max_tries):
+        limiter.wait()
+        try:
+            return get_ids(gene)
+        except ValueError:
+            raise
+        except Exception as ex:
+            if attempt == max_tries - 1:
+                raise
+            delay = backoff ** attempt
+            print('Error getting PMIDs for %s (%s), retrying in %.1f sec' %
+                  (gene, ex, delay))
+            time.sleep(delay)
+
+
+def harvest_pmids(genes, journal_fname, get_ids=None, rate=3, num_workers=8,
+                  max_tries=5):
+    """Get the PMIDs for a list of genes, journaling results as they arrive.
+
+    Parameters
+    ----------
+    genes : list[str]
+        The gene symbols to get PMIDs for.
+    journal_fname : str
+        The path to the append-only journal. Genes already in the journal
+        (including ones that failed as invalid) are not queried again.
+    get_ids : Optional[function]
+        The function returning the list of PMIDs for a gene symbol. By
+        default, indra.literature.pubmed_client.get_ids_for_gene. A stub
+        standing in for E-utilities can be passed here for benchmarking.
+    rate : Optional[float]
+        The maximum number of requests per second. Default: 3
+    num_workers : Optional[int]
+        The number of worker threads. Default: 8
+    max_tries : Optional[int]
+        The number of times a failing request is tried. Default: 5
+
+    Returns
+    -------
+    dict
+        The lists of PMIDs keyed by gene symbol.
+    """
+    if get_ids is None:
+        from indra.literature import pubmed_client
+        get_ids = pubmed_client.get_ids_for_gene
+    pmids_for_gene, failed = read_journal(journal_fname)
+    truncate_partial_line(journal_fname)
+    todo = [g for g in genes if g not in pmids_for_gene and g not in failed]
+    print('%d genes in journal, %d to query' %
+          (len(pmids_for_gene) + len(failed), len(todo)))
+    limiter = RateLimiter(rate)
+    start = time.time()
+    with open(journal_fname, 'at') as journal, \
+            ThreadPoolExecutor(max_workers=num_workers) as executor:
+        futures = {executor.submit(get_pmids_with_retry, gene, get_ids,
+                                   limiter, max_tries): gene
+                   for gene in todo}
+        for ix, future in enumerate(as_completed(futures)):
+            gene = futures[future]
+            try:
+                pmids = future.result()
+            except ValueError as ex:
+                print('Invalid gene %s: %s' % (gene, ex))
+                journal.write(json.dumps({'gene': gene,
+                                          'error': str(ex)}) + '\n')
+                journal.flush()
+                continue
+            # Other errors are not journaled so they're retried on resume
+            except Exception as ex:
+                print('Failed to get PMIDs for %s: %s' % (gene, ex))
+                continue
+            pmids_for_gene[gene] = pmids
+            journal.write(json.dumps({'gene': gene, 'pmids': pmids}) + '\n')
+            journal.flush()
+            if (ix + 1) % 100 == 0:
+                print('%d of %d genes, %.2f genes/sec' %
+                      (ix + 1, len(todo), (ix + 1) / (time.time() - start)))
+    elapsed = time.time() - start
+    print('Queried %d genes in %.1f sec (%.2f genes/sec)' %
+          (len(todo), elapsed, len(todo) / elapsed if elapsed else 0))
+    return pmids_for_gene
+
+
+def check_rate_limiter(rate=10, num_genes=40, num_workers=8):
+    """Check the request rate and journal of a harvest with a stub fetch.
+
+    The stub records the time of each request instead of querying
+    E-utilities. The harvest resumes from a journal whose last line was cut
+    off, as after an interrupted run.
+    """
+    call_times = []
+    lock = threading.Lock()
+
+    def get_ids(gene):
+        with lock:
+            call_times.append(time.time())
+        return [gene.lower()]
+
+    genes = ['GENE%d' % ix for ix in range(num_genes)]
+    fh, journal_fname = tempfile.mkstemp(suffix='.jsonl')
+    with os.fdopen(fh, 'wt') as f:
+        f.write(json.dumps({'gene': genes[0], 'pmids': ['gene0']}) + '\n')
+        f.write('{"gene": "GENE1", "pmi')
+    try:
+        pmids_for_gene = harvest_pmids(genes, journal_fname, get_ids, rate,
+                                       num_workers)
+        # No more than rate requests were sent in any one second
+        call_times.sort()
+        min_window = min(call_times[ix + rate] - call_times[ix]
+                         for ix in range(len(call_times) - rate))
+        assert min_window >= 0.99, ('Rate exceeded', min_window)
+        assert len(call_times) == num_genes - 1, len(call_times)
+        # All the genes can be read back from the resumed journal
+        assert read_journal(journal_fname)[0] == pmids_for_gene
+        assert len(pmids_for_gene) == num_genes, len(pmids_for_gene)
+    finally:
+        os.remove(journal_fname)
+    print('%d requests in %.2f sec at a rate of %d per second' %
+          (len(call_times), call_times[-1] - call_times[0], rate))
+
 
 if __name__ == '__main__':
-    import os
-    import pickle
+    # Run a harvest with a stub fetch instead of the real one
+    if len(sys.argv) > 1 and sys.argv[1] == 'check':
+        check_rate_limiter()
+        sys.exit()
+
     from indra.util import read_unicode_csv
-    from indra.literature import pubmed_client
 
     # Get all HGNC IDs
     hgnc_file = '../../indra/resources/hgnc_entries.tsv'
@@ -18,34 +224,18 @@ if __name__ == '__main__':
     next(lines)
     hgnc_names = [line[1] for line in lines
                           if line[3] == 'Approved']
-    # Load the dict of PMIDs, if there is one
+    cache = GenePmidCache()
+    pmids_for_gene = cache.get_many(hgnc_names)
+    print('Found %d genes in PMID cache' % len(pmids_for_gene))
+    new_pmids = harvest_pmids([g for g in hgnc_names
+                               if g not in pmids_for_gene],
+                              'pmids_for_gene.jsonl')
+    cache.put_many(new_pmids)
+    pmids_for_gene.update(new_pmids)
+    unique_pmids = set([pmid for pmid_list in pmids_for_gene.values()
+                             for pmid in pmid_list])
+    print('Total PMIDs: %d' % len(unique_pmids))
     dict_filename = 'pmids_for_gene.pkl'
-    if os.path.exists(dict_filename):
-        with open(dict_filename, 'rb') as f:
-            pmids_for_gene = pickle.load(f)
-    else:
-        pmids_for_gene = {}
-    # Get PMIDs for each HGNC ID
-    num_added = 0
-    for hgnc_name in hgnc_names:
-        # If HGN
-        #print('Getting PMIDs for %s' % hgnc_name)
-        if hgnc_name in pmids_for_gene:
-            print('%s: already got PMIDs, skipping' % hgnc_name)
-            continue
-        try:
-            pmids = pubmed_client.get_ids_for_gene(hgnc_name)
-        except ValueError as ex:
-            print("Exception in gettting PMIDs for %s: %s" % (hgnc_name, ex))
-            print("Continuing...")
-            continue
-        print('%s: %d PMIDs' % (hgnc_name, len(pmids)))
-        pmids_for_gene[hgnc_name] = pmids
-        num_added += 1
-        if num_added % 50 == 0:
-            print("Saving info for %d genes" % len(pmids_for_gene))
-            with open(dict_filename, 'wb') as f:
-                pickle.dump(pmids_for_gene, f)
-            unique_pmids = set([pmid for pmid_list in pmids_for_gene.values()
-                                     for pmid in pmid_list])
-            print('Total PMIDs: %d' % len(unique_pmids))
+    print("Saving info for %d genes" % len(pmids_for_gene))
+    with open(dict_filename, 'wb') as f:
+        pickle.dump(pmids_for_gene, f)
@@ -2,12 +2,15 @@
 
 
 if __name__ == '__main__':
+    import os
     import sys
     import boto3
     import botocore
     import time
     import pickle
-    from indra.literature import pubmed_client
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                 os.pardir))
+    from gene_pmid_cache import get_pmids_for_genes
     from indra.tools.reading import submit_reading_pipeline as sub_aws
     from indra.tools import assemble_corpus as ac
     from indra.util import write_unicode_csv
@@ -18,15 +21,10 @@ if __name__ == '__main__':
         genes = [line.strip() for line in f.readlines()]
 
     # Assemble a list of PMIDs curated in Entrez gene
-    pmids_for_genes = {}
-    for gene_ix, gene in enumerate(genes):
-        try:
-            pmids = pubmed_client.get_ids_for_gene(gene)
-        except ValueError:
-            print("%s: Invalid gene name, skipping" % gene)
-            continue
+    # Invalid gene names are skipped
+    pmids_for_genes = get_pmids_for_genes(genes)
+    for gene, pmids in pmids_for_genes.items():
         print("%s: %d articles" % (gene, len(pmids)))
-        pmids_for_genes[gene] = pmids
     pmids = set([pmid for pmid_list in pmids_for_genes.values()
                       for pmid in pmid_list])
 
@@ -0,0 +1,178 @@
+"""
+Tests of the PMID harvest against a local stub of the E-utilities endpoint,
+covering retries of failed requests and resuming from an interrupted
+journal. Run with pytest from this folder.
+"""
+from __future__ import absolute_import, print_function, unicode_literals
+import os
+import sys
+import json
+import threading
+from collections import Counter
+from urllib.error import HTTPError
+from urllib.request import urlopen
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import pytest
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import get_pmids
+
+
+class StubEutils(object):
+    """An HTTP server returning the PMIDs of a gene at /<gene>.
+
+    Each gene fails with a 503 the given number of times before succeeding.
+    Genes in invalid get a 400, which the client turns into a ValueError.
+    """
+    def __init__(self, failures=None, invalid=()):
+        self.failures = Counter(failures or {})
+        self.invalid = set(invalid)
+        self.requests = Counter()
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                gene = self.path.lstrip('/')
+                with stub.lock:
+                    stub.requests[gene] += 1
+                    fail = stub.failures[gene] > 0
+                    if fail:
+                        stub.failures[gene] -= 1
+                if gene in stub.invalid:
+                    self.send_error(400)
+                elif fail:
+                    self.send_error(503)
+                else:
+                    body = json.dumps([gene.lower(), '1']).encode('utf-8')
+                    self.send_response(200)
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = HTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:%d/' % self.server.server_port
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def get_ids(self, gene):
+        try:
+            return json.loads(urlopen(self.url + gene).read().decode('utf-8'))
+        except HTTPError as ex:
+            if ex.code == 400:
+                raise ValueError('Invalid gene %s' % gene)
+            raise
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def no_sleep(monkeypatch):
+    """Record the backoff delays (and rate limiter waits) instead of
+    sleeping."""
+    delays = []
+    monkeypatch.setattr(get_pmids.time, 'sleep', delays.append)
+    return delays
+
+
+class NoLimit(object):
+    def wait(self):
+        pass
+
+
+def make_stub(request, **kwargs):
+    stub = StubEutils(**kwargs)
+    request.addfinalizer(stub.close)
+    return stub
+
+
+def write_journal(fname, lines):
+    with open(fname, 'wt') as f:
+        f.write(''.join(lines))
+
+
+def test_retry_until_success(request, no_sleep):
+    stub = make_stub(request, failures={'BRAF': 2})
+    limiter = NoLimit()
+    pmids = get_pmids.get_pmids_with_retry('BRAF', stub.get_ids, limiter)
+    assert pmids == ['braf', '1']
+    assert stub.requests['BRAF'] == 3
+    # The backoff doubles after each failure
+    assert no_sleep == [1.0, 2.0]
+
+
+def test_retry_gives_up(request, no_sleep):
+    stub = make_stub(request, failures={'BRAF': 10})
+    limiter = NoLimit()
+    with pytest.raises(HTTPError):
+        get_pmids.get_pmids_with_retry('BRAF', stub.get_ids, limiter,
+                                       max_tries=3)
+    assert stub.requests['BRAF'] == 3
+
+
+def test_invalid_gene_not_retried(request, no_sleep):
+    stub = make_stub(request, invalid=['XYZ'])
+    limiter = NoLimit()
+    with pytest.raises(ValueError):
+        get_pmids.get_pmids_with_retry('XYZ', stub.get_ids, limiter)
+    assert stub.requests['XYZ'] == 1
+
+
+def test_harvest_journals_results(request, tmpdir, no_sleep):
+    stub = make_stub(request, failures={'KRAS': 1, 'HRAS': 10},
+                     invalid=['XYZ'])
+    journal = str(tmpdir.join('journal.jsonl'))
+    genes = ['BRAF', 'KRAS', 'HRAS', 'XYZ']
+    pmids_for_gene = get_pmids.harvest_pmids(genes, journal, stub.get_ids,
+                                             rate=1000, num_workers=4,
+                                             max_tries=3)
+    assert pmids_for_gene == {'BRAF': ['braf', '1'], 'KRAS': ['kras', '1']}
+    # Invalid genes are journaled, genes that kept failing are not
+    assert get_pmids.read_journal(journal) == (pmids_for_gene, {'XYZ'})
+    # On resume, only the gene that kept failing is queried again
+    stub.requests.clear()
+    get_pmids.harvest_pmids(genes, journal, stub.get_ids, rate=1000,
+                            num_workers=4, max_tries=3)
+    assert stub.requests == Counter({'HRAS': 3})
+
+
+@pytest.mark.parametrize('lines,expected', [
+    (['{"gene": "A", "pmids": []}\n', '{"gene": "B", "pm'],
+     '{"gene": "A", "pmids": []}\n'),
+    (['{"gene": "A", "pmids": []}\n'], '{"gene": "A", "pmids": []}\n'),
+    (['{"gene": "B", "pm'], ''),
+    # A partial line longer than the block read at a time
+    (['{"gene": "A", "pmids": []}\n', 'x' * 10000],
+     '{"gene": "A", "pmids": []}\n'),
+    ([], ''),
+    ])
+def test_truncate_partial_line(tmpdir, lines, expected):
+    journal = str(tmpdir.join('journal.jsonl'))
+    write_journal(journal, lines)
+    get_pmids.truncate_partial_line(journal)
+    with open(journal, 'rt') as f:
+        assert f.read() == expected
+
+
+def test_resume_after_truncated_journal(request, tmpdir, no_sleep):
+    stub = make_stub(request)
+    journal = str(tmpdir.join('journal.jsonl'))
+    write_journal(journal, [json.dumps({'gene': 'BRAF',
+                                        'pmids': ['braf', '1']}) + '\n',
+                            '{"gene": "KRAS", "pmids": ["kr'])
+    genes = ['BRAF', 'KRAS', 'HRAS']
+    pmids_for_gene = get_pmids.harvest_pmids(genes, journal, stub.get_ids,
+                                             rate=1000, num_workers=2)
+    # The gene on the cut off line is queried again, the journaled one isn't
+    assert stub.requests == Counter({'KRAS': 1, 'HRAS': 1})
+    assert pmids_for_gene == {gene: [gene.lower(), '1'] for gene in genes}
+    # Every line of the resumed journal is complete
+    with open(journal, 'rt') as f:
+        entries = [json.loads(line) for line in f]
+    assert len(entries) == 3
+    assert get_pmids.read_journal(journal)[0] == pmids_for_gene
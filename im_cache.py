@@ -0,0 +1,98 @@
+"""
+A persistent on-disk cache of pruned influence maps shared by the scripts
+in this repository that check PySB models with INDRA's PysbModelChecker
+(e.g., fallahi_eval, phase3_eval and worldmodel).
+
+Generating and pruning the influence map of a model is typically the
+slowest step of model checking. Pruned influence maps are stored as pickle
+files named by a hash of the model's monomers, rules and observables, the
+statements being checked and the agents being observed, so that a model
+checker made for the same model and statements in a later run reuses the
+influence map instead of generating it again.
+
+The location of the cache defaults to ~/.indra_apps/im_cache and can be
+changed with the IM_CACHE environment variable. Scripts in subfolders
+import this module after adding the repository root to sys.path.
+"""
+import os
+import pickle
+import hashlib
+import tempfile
+from indra.explanation.model_checker import PysbModelChecker
+
+
+default_cache_dir = os.environ.get(
+    'IM_CACHE',
+    os.path.join(os.path.expanduser('~'), '.indra_apps', 'im_cache'))
+
+
+def get_model_hash(model, stmts, agents_to_observe=None):
+    """Return a hash of a model and the statements checked against it.
+
+    The hash doesn't depend on the order of the model's components, the
+    statements or the agents.
+    """
+    hasher = hashlib.sha256()
+    for components in (model.monomers, model.rules, model.observables):
+        for component in sorted(repr(c) for c in components):
+            hasher.update(component.encode('utf-8'))
+        hasher.update(b'\n')
+    for key in sorted(stmt.matches_key() for stmt in stmts):
+        hasher.update(key.encode('utf-8'))
+    hasher.update(b'\n')
+    for key in sorted(agent.matches_key()
+                      for agent in (agents_to_observe or [])):
+        hasher.update(key.encode('utf-8'))
+    return hasher.hexdigest()
+
+
+def get_model_checker(model, stmts, agents_to_observe=None,
+                      cache_dir=default_cache_dir, **kwargs):
+    """Return a PysbModelChecker with a pruned influence map.
+
+    The pruned influence map is loaded from the cache if the same model and
+    statements were seen before, and generated and cached otherwise.
+
+    Parameters
+    ----------
+    model : pysb.Model
+        The model to check.
+    stmts : list[indra.statements.Statement]
+        The statements to check against the model.
+    agents_to_observe : Optional[list[indra.statements.Agent]]
+        Agents for which observables are added to the model.
+    cache_dir : Optional[str]
+        The folder of the cache. Default: default_cache_dir
+    **kwargs
+        Other arguments passed to PysbModelChecker.
+
+    Returns
+    -------
+    indra.explanation.model_checker.PysbModelChecker
+        The model checker, with its influence map pruned.
+    """
+    # The hash is taken before the model checker adds its observables to
+    # the model
+    model_hash = get_model_hash(model, stmts, agents_to_observe)
+    fname = os.path.join(cache_dir, '%s.pkl' % model_hash)
+    mc = PysbModelChecker(model, stmts, agents_to_observe, **kwargs)
+    if os.path.exists(fname):
+        print('Loading influence map from %s' % fname)
+        with open(fname, 'rb') as fh:
+            im = pickle.load(fh)
+        # Let the model checker derive its other state (e.g., the
+        # observables downstream of each rule) from the cached map as if it
+        # had generated it itself
+        mc.generate_im = lambda model: im
+        mc.get_im(force_update=True)
+        return mc
+    mc.prune_influence_map()
+    os.makedirs(cache_dir, exist_ok=True)
+    # Write to a uniquely named temporary file first so that an interrupted
+    # write isn't cached and concurrent runs don't clash
+    fd, tmp_fname = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as fh:
+        pickle.dump(mc.get_im(), fh)
+    os.replace(tmp_fname, fname)
+    print('Cached influence map in %s' % fname)
+    return mc
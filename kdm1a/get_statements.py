@@ -1,10 +1,15 @@
+import os
+import sys
 import glob
 import tqdm
 import pickle
 import logging
 from indra.util import batch_iter
 from indra.sources import indra_db_rest
-from genewalk.get_indra_stmts import load_genes, load_indra_df, remap_go_ids
+from genewalk.get_indra_stmts import load_genes, remap_go_ids
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir, 'stmt_count'))
+from sif_dump import load_sif_df
 
 
 logger = logging.getLogger('get_statements')
@@ -48,7 +53,9 @@ if __name__ == '__main__':
         all_genes |= set(load_genes(fname))
     logger.info('Loaded a total of %d unique genes' % len(all_genes))
     all_genes = sorted(list(all_genes))
-    df = load_indra_df('/Users/ben/data/indra_db_sif_2021_01_26.pkl')
+    # Only the row groups with HGNC-HGNC rows involving the genes are read
+    df = load_sif_df('/Users/ben/data/indra_db_sif_2021_01_26.pkl',
+                     namespaces=['HGNC'], ids=all_genes)
     df = filter_to_genes(df, all_genes)
     beliefs = {row.stmt_hash: row.belief for _, row in df.iterrows()}
     stmts = download_statements(df, beliefs)
@@ -1,6 +1,10 @@
 from indra.util import _require_python3
+import os
+import sys
 from random import shuffle
-from indra.literature import pubmed_client
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir))
+from gene_pmid_cache import get_pmids_for_genes
 
 from indra.tools.reading.submit_reading_pipeline import \
     submit_reading, submit_combine, wait_for_complete
@@ -21,8 +25,7 @@ def process_pmids_file():
 
 def get_gene_pmids(genes):
     pmids = []
-    for gene in genes:
-        pmids_gene = pubmed_client.get_ids_for_gene(gene)
+    for gene, pmids_gene in get_pmids_for_genes(genes).items():
         print('%s: %d' % (gene, len(pmids_gene)))
         pmids += pmids_gene
     return list(set(pmids))
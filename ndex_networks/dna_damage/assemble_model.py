@@ -12,10 +12,12 @@ from indra.sources import ndex_cx
 from indra.databases import hgnc_client, ndex_client
 import indra.tools.assemble_corpus as ac
 from indra.assemblers.cx import CxAssembler
-from indra.literature.pubmed_client import get_ids_for_gene
 from indra.util import _require_python3
 from indra.tools.gene_network import GeneNetwork
 from indra.statements import IncreaseAmount
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir, os.pardir))
+from gene_pmid_cache import get_pmids_for_genes
 
 def build_prior(genes, out_file):
     gn = GeneNetwork(genes, 'dna_damage_prior')
@@ -27,8 +29,7 @@ def build_prior(genes, out_file):
 
 def get_pmids(gene_names):
     pmids = []
-    for gene_name in gene_names:
-        pm = get_ids_for_gene(gene_name)
+    for gene_name, pm in get_pmids_for_genes(gene_names).items():
         pmids += pm
         print('%s: %d PMIDs' % (gene_name, len(pm)))
     return pmids
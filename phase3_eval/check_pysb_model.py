@@ -1,3 +1,5 @@
+import os
+import sys
 import json
 import pickle
 import itertools
@@ -5,12 +7,17 @@ from indra.util import write_unicode_csv
 from indra.assemblers.pysb import PysbAssembler
 from indra.assemblers.english import EnglishAssembler
 from indra.assemblers.cyjs import CyJSAssembler
-from indra.explanation.model_checker import PysbModelChecker
 from indra.explanation.reporting import stmts_from_pysb_path, stmt_from_rule
 import indra.tools.assemble_corpus as ac
 import process_data
 import make_stmts_for_checking as make_stmts
 from assemble_pysb import set_context, add_observables
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir))
+from im_cache import get_model_checker
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir, 'fallahi_eval'))
+from group_paths import RuleIndex
 
 def get_path_stmts(results, model, stmts):
     all_path_stmts = []
@@ -107,8 +114,10 @@ def make_english_output(results, model, stmts):
         references += '[%d] https://www.ncbi.nlm.nih.gov/pubmed/%s\n' % (v, k)
     print(references)
 
-def export_json(results, model, stmts):
+def export_json(results, model, stmts, index=None):
     """Export a set of paths in JSON format for visualization."""
+    if index is None:
+        index = RuleIndex(model, stmts)
     json_dict = {}
     for drug, ab, relation, value, path_found, paths, flag in results:
         if json_dict.get(drug) is None:
@@ -118,7 +127,7 @@ def export_json(results, model, stmts):
         for idx, path in enumerate(paths):
             path_stmts = []
             for rule_name, sign in path[:-1]:
-                stmt = stmt_from_rule(rule_name, model, stmts)
+                stmt = index.get_stmt(rule_name)
                 path_stmts.append(stmt.uuid)
             json_dict[drug][ab][idx] = path_stmts
     return json_dict
@@ -186,8 +195,8 @@ if __name__ == '__main__':
     #model = assemble_pysb(combined_stmts, data_genes, '')
     rerun = True
     if rerun:
-        mc = PysbModelChecker(model, all_data_stmts, agent_obs)
-        mc.prune_influence_map()
+        # The pruned influence map is cached by model and statements
+        mc = get_model_checker(model, all_data_stmts, agent_obs)
 
         # Iterate over each drug/ab statement subset
         results = []
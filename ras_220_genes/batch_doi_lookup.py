@@ -1,38 +1,145 @@
+"""
+Look up DOIs for the PMIDs in missing_dois.txt by searching CrossRef with
+the article titles from PubMed.
+
+Titles are fetched from PubMed in batches and the CrossRef queries are sent
+from a bounded pool of worker threads, with retries and exponential backoff.
+Each DOI found is appended to doi_cache.txt as soon as it arrives; the
+cache file is compacted (deduplicated and sorted) on exit.
+
+Run with --dry-run to benchmark the pipeline against local stubs standing in
+for PubMed and CrossRef instead of the real services.
+"""
+import os
 import csv
-from indra.literature import pubmed_client, crossref_client
+import sys
+import time
+import random
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 
-doi_cache = {}
-with open('doi_cache.txt') as f:
-    csvreader = csv.reader(f, delimiter='\t')
-    for row in csvreader:
-        doi_cache[row[0]] = row[1]
+def load_doi_cache(fname):
+    """Load the PMID to DOI cache, later entries overriding earlier ones."""
+    doi_cache = {}
+    if not os.path.exists(fname):
+        return doi_cache
+    with open(fname) as f:
+        csvreader = csv.reader(f, delimiter='\t')
+        for row in csvreader:
+            # Skip incomplete rows from an interrupted run
+            if len(row) == 2:
+                doi_cache[row[0]] = row[1]
+    return doi_cache
 
-with open('missing_dois.txt') as f:
-    missing_dois = [line.strip('\n') for line in f.readlines()]
 
-def save(doi_cache, counter):
-    with open('doi_cache_%.5d.txt' % counter, 'w') as f:
-        print "Writing to doi cache"
+def compact_doi_cache(fname, doi_cache):
+    """Rewrite the cache file with a single, sorted row per PMID."""
+    tmp_fname = fname + '.tmp'
+    with open(tmp_fname, 'w') as f:
         csvwriter = csv.writer(f, delimiter='\t')
-        for k, v in doi_cache.iteritems():
-            csvwriter.writerow((k, v))
-
-for counter, ref in enumerate(missing_dois):
-    if doi_cache.get(ref):
-        continue
-    title = pubmed_client.get_title(ref)
-    if not title:
-        print "No title, skipping", ref
-        continue
-    doi = crossref_client.doi_query(title)
-    if doi:
-        doi_cache[ref] = doi
-        print "%d: %s --> %s" % (counter, ref, doi)
-    else:
-        print "No DOI for %s: %s" % (ref, title)
-        continue
+        for pmid in sorted(doi_cache):
+            csvwriter.writerow((pmid, doi_cache[pmid]))
+    os.replace(tmp_fname, fname)
+
+
+def with_retry(func, *args, max_tries=5, backoff=2.0):
+    """Call a function, retrying with exponential backoff on errors."""
+    for attempt in range(max_tries):
+        try:
+            return func(*args)
+        except Exception as e:
+            if attempt == max_tries - 1:
+                raise
+            delay = backoff ** attempt
+            print("Error in %s (%s), retrying in %.1f sec" %
+                  (func.__name__, e, delay))
+            time.sleep(delay)
+
+
+def get_titles(pmids, get_metadata, batch_size=200):
+    """Return titles for a list of PMIDs, fetched in batches."""
+    titles = {}
+    for ix in range(0, len(pmids), batch_size):
+        batch = pmids[ix:ix + batch_size]
+        metadata = with_retry(get_metadata, batch)
+        for pmid, meta in metadata.items():
+            if meta.get('title'):
+                titles[pmid] = meta['title']
+    return titles
+
 
-    if counter % 100 == 0:
-        save(doi_cache, counter)
+def lookup_dois(pmids, doi_cache, cache_fname, get_metadata, doi_query,
+                num_workers=8):
+    """Look up DOIs for PMIDs not yet in the cache, appending new ones.
+
+    Returns the number of PMIDs for which a DOI was found.
+    """
+    pmids = [pmid for pmid in pmids if not doi_cache.get(pmid)]
+    titles = get_titles(pmids, get_metadata)
+    for pmid in pmids:
+        if pmid not in titles:
+            print("No title, skipping", pmid)
+    num_found = 0
+    with open(cache_fname, 'a') as f, \
+            ThreadPoolExecutor(max_workers=num_workers) as executor:
+        csvwriter = csv.writer(f, delimiter='\t')
+        futures = {executor.submit(with_retry, doi_query, title): pmid
+                   for pmid, title in titles.items()}
+        for counter, future in enumerate(as_completed(futures)):
+            pmid = futures[future]
+            try:
+                doi = future.result()
+            except Exception as e:
+                print("Failed to look up DOI for %s: %s" % (pmid, e))
+                continue
+            if doi:
+                doi_cache[pmid] = doi
+                csvwriter.writerow((pmid, doi))
+                f.flush()
+                num_found += 1
+                print("%d: %s --> %s" % (counter, pmid, doi))
+            else:
+                print("No DOI for %s: %s" % (pmid, titles[pmid]))
+    return num_found
+
+
+def get_stubs(latency=0.05):
+    """Return stand-ins for the PubMed and CrossRef lookups."""
+    def get_metadata(pmids):
+        time.sleep(latency)
+        return {pmid: {'title': 'Title of %s' % pmid} for pmid in pmids}
+
+    def doi_query(title):
+        time.sleep(latency)
+        return '10.0000/%s' % title.split()[-1] \
+            if random.random() < 0.9 else None
+    return get_metadata, doi_query
+
+
+if __name__ == '__main__':
+    dry_run = '--dry-run' in sys.argv
+    with open('missing_dois.txt') as f:
+        missing_dois = [line.strip('\n') for line in f.readlines()]
+
+    if dry_run:
+        cache_fname = 'doi_cache_dry_run.txt'
+        get_metadata, doi_query = get_stubs()
+    else:
+        from indra.literature import pubmed_client, crossref_client
+        cache_fname = 'doi_cache.txt'
+        get_metadata = pubmed_client.get_metadata_for_ids
+        doi_query = crossref_client.doi_query
 
-save(doi_cache, counter)
+    doi_cache = load_doi_cache(cache_fname)
+    start = time.time()
+    try:
+        num_found = lookup_dois(missing_dois, doi_cache, cache_fname,
+                                get_metadata, doi_query)
+    finally:
+        print("Compacting doi cache")
+        compact_doi_cache(cache_fname, doi_cache)
+    elapsed = time.time() - start
+    print("Found %d DOIs in %.1f sec (%.2f PMIDs/sec)" %
+          (num_found, elapsed, len(missing_dois) / elapsed))
+    if dry_run:
+        os.remove(cache_fname)
@@ -1,189 +1,183 @@
-import csv
+"""
+Check the DOIs found by searching CrossRef (doi_cache.txt) for the PMIDs for
+which PubMed has no DOI, by comparing the ISSNs and start pages in the
+PubMed and CrossRef metadata.
+
+All sources are loaded into data frames and reconciled with a single chain
+of merges on PMID and DOI; ISSN lists are exploded so that ISSN matches are
+found with a join rather than a set intersection per PMID.
+"""
 import pickle
-from collections import Counter
+import pandas as pd
 import plot_formatting as pf
 from matplotlib import pyplot as plt
-from texttable import  Texttable
-
-pf.set_fig_params()
-
-pmid_map = {}
-with open('pmid_pmcid_doi_map.txt') as f:
-    csvreader = csv.reader(f, delimiter='\t')
-    for row in csvreader:
-        doi = None if row[2] == '' else row[2]
-        pmid_map[row[0]] = (row[1], doi)
-
-
-print "Loading PMIDs from gene query"
-with open('pmids_from_gene.pkl') as f:
-    pmids = pickle.load(f)
-
-doi_lookup = {}
-print "Loading PMID->DOI cache"
-with open('doi_cache.txt') as f:
-    csvreader = csv.reader(f, delimiter='\t')
-    for row in csvreader:
-        if not row[1]:
-            continue
-        doi_lookup[row[0]] = row[1]
-
-print "Loading Pubmed metadata"
-with open('pmids_from_gene_metadata.pkl') as f:
-    pubmed_metadata = pickle.load(f)
-
-total_pmids = [pmid for gene, pmid_list in pmids.iteritems()
-                    for pmid in pmid_list]
-unique_pmids = set(total_pmids)
-
-pmids_no_doi = [pmid for pmid in unique_pmids \
-                        if not (pmid_map.get(pmid) is not None and \
-                                pmid_map.get(pmid)[1] is not None)]
-
-print "Loading xref metadata"
-with open('xref_metadata.pkl') as f:
-    xref_metadata = pickle.load(f)
-
-# Iterate over the PMIDs for which we didn't get DOIs from PubMed.
-# Look each one up in the xref_metadata.
-total = 0
-
-not_in_doi_cache = []
-no_xref_meta = []
-no_pubmed_meta = []
-matched = []
-no_issn = []
-no_page = []
-page_mismatch = []
-issn_mismatch = []
-
-for pmid in pmids_no_doi:
-    total += 1
-    xref_doi = doi_lookup.get(pmid)
-    if xref_doi is None:
-        print pmid, "not found in doi_cache.txt"
-        not_in_doi_cache.append(pmid)
-        continue
-
-    xref_meta = xref_metadata.get(xref_doi)
-    if xref_meta is None:
-        print pmid, xref_doi, "not found in xref_metadata.pkl"
-        no_xref_meta.append(xref_doi)
-        continue
-
-    pubmed_meta = pubmed_metadata.get(pmid)
-    if pubmed_meta is None:
-        print pmid, "not found in pubmed_metadata"
-        no_pubmed_meta.append(pmid)
-        continue
-
-    # ISSNs
-    xr_issn_list = xref_meta.get('ISSN')
-    pm_issn_list = pubmed_meta.get('issn_list')
-    if not (xr_issn_list and pm_issn_list):
-        print pmid, xref_doi, pm_issn_list, xr_issn_list, "Missing ISSNs"
-        no_issn.append((pmid, xref_doi))
-        continue
-    matching_issns = set(pm_issn_list).intersection(set(xr_issn_list))
-
-    # Page
-    xref_page = xref_meta.get('page')
-    pm_page = pubmed_meta.get('page')
-    if not (xref_page and pm_page):
-        print pmid, xref_doi, pm_page, xref_page, "Missing pages"
-        no_page.append((pmid, xref_doi))
-        continue
-    pm_start = pm_page.split('-')[0].upper()
-    xr_start = xref_page.split('-')[0].upper()
-    if xr_start.endswith('E'):
-        xr_start = 'E' + xr_start[:-1]
-
-    # Check for match!
-    if matching_issns and pm_start == xr_start:
-        matched.append((pmid, xref_doi))
-    elif not matching_issns:
-        print "---ISSN Mismatch-----------"
-        print pmid, xref_doi
-        print "Pubmed ISSN:       ", pm_issn_list
-        print "CrossR ISSN:       ", xr_issn_list
-        print "Titles:"
-        print "Pubmed", pubmed_meta.get('title')
-        print "Xref", xref_meta.get('title')
-        print pm_start, xr_start
-        issn_mismatch.append((pmid, xref_doi))
-    elif pm_start != xr_start:
-        print "---Page Mismatch-----------"
-        print pmid, xref_doi
-        print "Pubmed ISSN:       ", pm_issn_list
-        print "CrossR ISSN:       ", xr_issn_list
-        print "Pages:", pm_start, xr_start
-        print "Titles:"
-        print "Pubmed", pubmed_meta.get('title')
-        print "Xref", xref_meta.get('title')
-        page_mismatch.append((pmid, xref_doi))
-    else:
-        assert False, "Should never happen"
-
-print
-print "Not in DOI cache:", len(not_in_doi_cache)
-print "No XREF metadata:", len(no_xref_meta)
-print "No Pubmed metadata:", len(no_pubmed_meta)
-print "No ISSN:", len(no_issn)
-print "No page:", len(no_page)
-print "ISSN mismatch:", len(issn_mismatch)
-print "Page mismatch:", len(page_mismatch)
-print "Matched:", len(matched)
-
-print "Collecting publishers"
-publishers = []
-for (pmid, doi) in matched:
-    xref_meta = xref_metadata.get(doi)
-    publishers.append((pmid, doi, xref_meta.get('publisher')))
-
-has_license = []
-for (pmid, doi) in matched:
-    xref_meta = xref_metadata.get(doi)
-    if xref_meta.get('license'):
-        has_license.append((pmid, doi, xref_meta))
-
-has_link = []
-for (pmid, doi) in matched:
-    xref_meta = xref_metadata.get(doi)
-    if xref_meta.get('link'):
-        has_link.append((pmid, doi, xref_meta))
-
-jbc = []
-for (pmid, doi) in matched:
-    xref_meta = xref_metadata.get(doi)
-    if xref_meta['publisher'] == 'American Society for Biochemistry & Molecular Biology (ASBMB)':
-        jbc.append((pmid, doi, xref_meta))
-
-
-pubs = [t[2] for t in publishers]
-pubs_count = Counter(pubs)
-pubs_count = sorted(pubs_count.items(), key=lambda x: x[1], reverse=True)
-plt.ion()
-fig = plt.figure(figsize=(2, 2), dpi=300)
-ax = fig.gca()
-ax.plot([t[1] for t in pubs_count])
-ax.set_ylabel('No. of papers')
-ax.set_xlabel('Publisher rank')
-ax.set_xticks(range(0, 181, 30))
-pf.format_axis(ax)
-plt.subplots_adjust(left=0.22, bottom=0.16)
-plt.show()
-plt.savefig('publisher_distribution_linear.pdf')
-ax.set_yscale('log')
-plt.show()
-plt.savefig('publisher_distribution_log.pdf')
-
-# Make table of top 20
-top_20_table = Texttable()
-rows = [['Rank', 'Publisher']]
-for i in range(20):
-    rank = i + 1
-    entry = '%s (%s)' % (str(pubs_count[i][0]), pubs_count[i][1])
-    rows.append([rank, entry])
-top_20_table.add_rows(rows)
-print top_20_table.draw() + '\n'
-
+from texttable import Texttable
+
+
+jbc_publisher = \
+    'American Society for Biochemistry & Molecular Biology (ASBMB)'
+
+
+def load_pickle(fname):
+    # The pickles were written by Python 2
+    with open(fname, 'rb') as f:
+        return pickle.load(f, encoding='latin1')
+
+
+def get_start_page(pages):
+    """Return the normalized start pages of a Series of page ranges."""
+    return pages.str.split('-').str[0].str.upper()
+
+
+def is_nonempty(values):
+    """Return a boolean Series telling which values are non-empty."""
+    return values.map(lambda x: bool(x) if isinstance(x, (list, str))
+                      else False).astype(bool)
+
+
+def get_issn_df(df, issn_col):
+    """Return a data frame of (pmid, issn) pairs from a column of lists."""
+    issns = df[['pmid', issn_col]].explode(issn_col).dropna()
+    return issns.rename(columns={issn_col: 'issn'}).drop_duplicates()
+
+
+def reconcile_dois(pmids, pmid_map, doi_cache, pubmed_metadata,
+                   xref_metadata):
+    """Return a data frame with the check category of each PMID without DOI.
+
+    The category of each PMID is one of not_in_doi_cache, no_xref_meta,
+    no_pubmed_meta, no_issn, no_page, issn_mismatch, page_mismatch and
+    matched, checked in this order.
+    """
+    # PMIDs for which we didn't get DOIs from PubMed
+    df = pd.DataFrame({'pmid': sorted(pmids)})
+    df = df.merge(pmid_map, on='pmid', how='left')
+    df = df[df['doi'].isna()].drop(columns=['pmcid', 'doi'])
+    # Look each one up in the DOI cache and the metadata
+    df = df.merge(doi_cache, on='pmid', how='left')
+    df = df.merge(pubmed_metadata, on='pmid', how='left')
+    df = df.merge(xref_metadata, on='xref_doi', how='left')
+    for col in ('in_pubmed', 'in_xref', 'has_license', 'has_link'):
+        df[col] = df[col].fillna(False).astype(bool)
+
+    issn_matches = get_issn_df(df, 'pm_issn_list').merge(
+        get_issn_df(df, 'xr_issn_list'), on=['pmid', 'issn'])
+    has_issn_match = df['pmid'].isin(issn_matches['pmid'])
+
+    pm_start = get_start_page(df['pm_page'])
+    xr_start = get_start_page(df['xr_page'])
+    ends_with_e = xr_start.str.endswith('E', na=False)
+    xr_start = xr_start.where(~ends_with_e, 'E' + xr_start.str[:-1])
+
+    has_issns = is_nonempty(df['pm_issn_list']) & \
+        is_nonempty(df['xr_issn_list'])
+    has_pages = is_nonempty(df['pm_page']) & is_nonempty(df['xr_page'])
+    conditions = [
+        ('not_in_doi_cache', df['xref_doi'].isna()),
+        ('no_xref_meta', ~df['in_xref']),
+        ('no_pubmed_meta', ~df['in_pubmed']),
+        ('no_issn', ~has_issns),
+        ('no_page', ~has_pages),
+        ('issn_mismatch', ~has_issn_match),
+        ('page_mismatch', pm_start != xr_start),
+    ]
+    category = pd.Series('matched', index=df.index)
+    # Go in reverse so that earlier conditions take precedence
+    for name, cond in reversed(conditions):
+        category[cond.fillna(False).astype(bool).to_numpy()] = name
+    df['category'] = category
+    df['pm_start'] = pm_start
+    df['xr_start'] = xr_start
+    return df
+
+
+def load_sources():
+    pmid_map = pd.read_csv('pmid_pmcid_doi_map.txt', sep='\t', header=None,
+                           names=['pmid', 'pmcid', 'doi'], dtype=str)
+
+    print("Loading PMIDs from gene query")
+    pmids_from_gene = load_pickle('pmids_from_gene.pkl')
+    pmids = {pmid for pmid_list in pmids_from_gene.values()
+             for pmid in pmid_list}
+
+    print("Loading PMID->DOI cache")
+    doi_cache = pd.read_csv('doi_cache.txt', sep='\t', header=None,
+                            names=['pmid', 'xref_doi'], dtype=str)
+    doi_cache = doi_cache.dropna().drop_duplicates('pmid', keep='last')
+
+    print("Loading Pubmed metadata")
+    pubmed_metadata = pd.DataFrame([
+        {'pmid': pmid, 'pm_issn_list': meta.get('issn_list'),
+         'pm_page': meta.get('page'), 'pm_title': meta.get('title')}
+        for pmid, meta in load_pickle('pmids_from_gene_metadata.pkl').items()
+    ])
+    pubmed_metadata['in_pubmed'] = True
+
+    print("Loading xref metadata")
+    xref_metadata = pd.DataFrame([
+        {'xref_doi': doi, 'xr_issn_list': meta.get('ISSN'),
+         'xr_page': meta.get('page'), 'xr_title': meta.get('title'),
+         'publisher': meta.get('publisher'),
+         'has_license': bool(meta.get('license')),
+         'has_link': bool(meta.get('link'))}
+        for doi, meta in load_pickle('xref_metadata.pkl').items()
+    ])
+    xref_metadata['in_xref'] = True
+    return pmids, pmid_map, doi_cache, pubmed_metadata, xref_metadata
+
+
+if __name__ == '__main__':
+    pf.set_fig_params()
+    df = reconcile_dois(*load_sources())
+
+    for category in ('issn_mismatch', 'page_mismatch'):
+        print("---%s-----------" % category)
+        print(df[df['category'] == category][
+            ['pmid', 'xref_doi', 'pm_issn_list', 'xr_issn_list', 'pm_start',
+             'xr_start', 'pm_title', 'xr_title']].to_string())
+
+    counts = df['category'].value_counts()
+    print()
+    for category, label in (('not_in_doi_cache', 'Not in DOI cache'),
+                            ('no_xref_meta', 'No XREF metadata'),
+                            ('no_pubmed_meta', 'No Pubmed metadata'),
+                            ('no_issn', 'No ISSN'),
+                            ('no_page', 'No page'),
+                            ('issn_mismatch', 'ISSN mismatch'),
+                            ('page_mismatch', 'Page mismatch'),
+                            ('matched', 'Matched')):
+        print("%s: %d" % (label, counts.get(category, 0)))
+
+    matched = df[df['category'] == 'matched']
+    has_license = matched[matched['has_license']]
+    has_link = matched[matched['has_link']]
+    jbc = matched[matched['publisher'] == jbc_publisher]
+    print("With license: %d, with link: %d, JBC: %d" %
+          (len(has_license), len(has_link), len(jbc)))
+
+    print("Collecting publishers")
+    pubs_count = matched['publisher'].value_counts(dropna=False)
+    plt.ion()
+    fig = plt.figure(figsize=(2, 2), dpi=300)
+    ax = fig.gca()
+    ax.plot(pubs_count.values)
+    ax.set_ylabel('No. of papers')
+    ax.set_xlabel('Publisher rank')
+    ax.set_xticks(range(0, 181, 30))
+    pf.format_axis(ax)
+    plt.subplots_adjust(left=0.22, bottom=0.16)
+    plt.show()
+    plt.savefig('publisher_distribution_linear.pdf')
+    ax.set_yscale('log')
+    plt.show()
+    plt.savefig('publisher_distribution_log.pdf')
+
+    # Make table of top 20
+    top_20_table = Texttable()
+    rows = [['Rank', 'Publisher']]
+    for i, (publisher, count) in enumerate(pubs_count.iloc[:20].items()):
+        rank = i + 1
+        entry = '%s (%s)' % (str(publisher), count)
+        rows.append([rank, entry])
+    top_20_table.add_rows(rows)
+    print(top_20_table.draw() + '\n')
@@ -1,4 +1,5 @@
 import os
+import sys
 import csv
 import pickle
 import numpy as np
@@ -6,7 +7,10 @@ from texttable import Texttable
 from collections import OrderedDict
 from matplotlib import pyplot as plt
 import indra
-from indra.literature import pubmed_client
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir))
+from gene_pmid_cache import GenePmidCache
+from pmid_index import PmidIndex, load_pmid_array
 
 
 def get_ids():
@@ -14,9 +18,10 @@ def get_ids():
     # Check if we've got the files already
     if os.path.isfile('reading/pmids.pkl') and \
        os.path.isfile('reading/pmids_from_gene.pkl'):
-        with open('reading/pmids.pkl') as pmids_file:
+        with open('reading/pmids.pkl', 'rb') as pmids_file:
             pmids = pickle.load(pmids_file)
-        with open('reading/pmids_from_gene.pkl') as pmids_from_gene_file:
+        with open('reading/pmids_from_gene.pkl', 'rb') as \
+                pmids_from_gene_file:
             pmids_from_gene = pickle.load(pmids_from_gene_file)
         return (pmids, pmids_from_gene)
 
@@ -33,19 +38,18 @@ def get_ids():
     pmids = OrderedDict()
     pmids_from_gene = OrderedDict()
 
+    # Hack to deal with excessive number of names
+    query_genes = {'MET': 'CMET', 'JUN': 'CJUN'}
+    cache = GenePmidCache()
+    ids_by_gene = cache.get_pmids(gene_list, 'gene')
+    ids_by_term = cache.get_pmids([query_genes.get(gene, gene)
+                                   for gene in gene_list], 'search')
     for gene in gene_list:
         print("Querying for %s" % gene)
-        ids_gene = set(pubmed_client.get_ids_for_gene(gene))
+        ids_gene = set(ids_by_gene.get(gene, []))
         print("Found %d in gene query" % len(ids_gene))
-        # Hack to deal with excessive number of names
-        if gene == 'MET':
-            query_gene = 'CMET'
-        elif gene == 'JUN':
-            query_gene = 'CJUN'
-        else:
-            query_gene = gene
-        ids_pubmed = set(pubmed_client.get_ids(query_gene,
-                                               **{'retmax': 100000}))
+        query_gene = query_genes.get(gene, gene)
+        ids_pubmed = set(ids_by_term.get(query_gene, []))
         print("Found %d in string query" % len(ids_pubmed))
         pmids[gene] = ids_pubmed
         pmids_from_gene[gene] = ids_gene
@@ -60,11 +64,11 @@ def get_ids():
 def plot_counts(refs, ax, **kwargs):
     """Plot the distribution of reference counts."""
     pmid_counts = []
-    for gene, pubs in refs.iteritems():
+    for gene, pubs in refs.items():
         pmid_counts.append(len(pubs))
     pmid_counts = sorted(zip(refs.keys(), pmid_counts), key=lambda x: x[1])
 
-    ax.plot(zip(*pmid_counts)[1], **kwargs)
+    ax.plot([x[1] for x in pmid_counts], **kwargs)
     ax.set_yscale('log')
     ax.set_ylabel('Publications')
     ax.set_xlabel('Gene index')
@@ -74,7 +78,7 @@ def plot_parallel_counts(refs1, refs2, ax, labels, **kwargs):
     """Plot the distribution of reference counts, sorting both by the number
     of references for refs1."""
     pmid_counts = []
-    for gene, pubs in refs1.iteritems():
+    for gene, pubs in refs1.items():
         pmid_counts.append((gene, len(pubs), len(refs2[gene])))
     # Sort by the number of refs for the first arg list
     pmid_counts = sorted(pmid_counts, key=lambda x: x[1])
@@ -97,19 +101,14 @@ with open('pmid_pmcid_doi_map.txt') as f:
 """
 
 
-def get_fulltexts(pmids_dict):
-    fulltext_counts = OrderedDict()
-    # Iterate over all 
-    for gene, refs in pmids_dict.iteritems():
-        refs_with_fulltext = pmid_fulltexts.intersection(set(refs))
-        fulltext_counts[gene] = refs_with_fulltext
-    return fulltext_counts
+def get_fulltexts(pmids_dict, pmid_fulltexts):
+    """Return the PMIDs of each gene that are in a sorted PMID array."""
+    index = PmidIndex.from_dict(pmids_dict).intersect(pmid_fulltexts)
+    return OrderedDict(index.to_dict())
 
 
 def num_unique_refs(pmids_dict):
-    unique_refs = set([ref for gene, refs in pmids_dict.items()
-                           for ref in refs])
-    return len(unique_refs)
+    return len(PmidIndex.from_dict(pmids_dict).unique())
 
 
 if __name__ == '__main__':
@@ -175,10 +174,11 @@ if __name__ == '__main__':
     plt.savefig('citations_by_gene.pdf')
 
     # Figure out how many of the publications have full text in PMC
+    pmid_fulltexts = load_pmid_array('pmids_oa_xml.txt')
     dict_labels = ['By gene name', 'By gene ID']
     file_labels = ['pmids_by_name_ft', 'pmids_by_gene_ft']
     for dict_ix, pmids_dict in enumerate((pmids_by_name, pmids_by_gene)):
-        pmids_dict_ft = get_fulltexts(pmids_dict)
+        pmids_dict_ft = get_fulltexts(pmids_dict, pmid_fulltexts)
         fig = plt.figure(figsize=(2, 2), dpi=300)
         ax = fig.gca()
         plot_parallel_counts(pmids_dict, pmids_dict_ft, ax,
@@ -1,34 +1,27 @@
 """Plot a Venn diagram showing the IDs associated with articles in PMC."""
 
+import numpy as np
+import pandas as pd
 import matplotlib_venn as mv
-import csv
 from matplotlib import pyplot as plt
 import plot_formatting as pf
+from pmid_index import to_pmid_array, venn_counts
 
 pf.set_fig_params()
 
-all_pmcids = set([])
-has_doi = set([])
-has_pmid = set([])
-
-with open('PMC-ids.csv') as f:
-    csvreader = csv.reader(f, delimiter=',')
-    for row in csvreader:
-        pmcid = row[8].strip()
-        pmid = row[9].strip()
-        doi = row[7].strip()
-        all_pmcids.add(pmcid)
-        if doi:
-            has_doi.add(pmcid)
-        if pmid:
-            has_pmid.add(pmcid)
-print len(all_pmcids)
+ids = pd.read_csv('PMC-ids.csv', usecols=['DOI', 'PMCID', 'PMID'],
+                  dtype=str)
+all_pmcids = to_pmid_array(ids['PMCID'].dropna().str.strip())
+has_doi = to_pmid_array(ids['PMCID'][ids['DOI'].str.strip() > ''])
+has_pmid = to_pmid_array(ids['PMCID'][ids['PMID'].str.strip() > ''])
+print(len(all_pmcids))
 
 plt.figure(figsize=(4, 4), dpi=150)
-res = mv.venn2([has_doi, has_pmid],
-                  ("DOI", "PMID"))
+res = mv.venn2(subsets=venn_counts(has_doi, has_pmid),
+               set_labels=("DOI", "PMID"))
 plt.title('IDs for articles in PMC')
-num_neither = len(all_pmcids.difference(has_doi).difference(has_pmid))
+num_neither = len(np.setdiff1d(all_pmcids, np.union1d(has_doi, has_pmid),
+                               assume_unique=True))
 
 def commafy(text):
     text_with_commas = ''
@@ -4,6 +4,7 @@ import pickle
 import matplotlib_venn as mv
 from matplotlib import pyplot as plt
 import plot_formatting as pf
+from pmid_index import to_pmid_array, load_pmid_array, venn_counts
 
 pf.set_fig_params()
 
@@ -14,18 +15,14 @@ with open('pmid_pmcid_doi_map.txt') as f:
         doi = None if row[2] == '' else row[2]
         pmid_map[row[0]] = (row[1], doi)
 
-with open('pmids_oa_txt.txt') as f:
-    pmid_oa_txt = set([line.strip('\n') for line in f.readlines()])
-
-with open('pmids_oa_xml.txt') as f:
-    pmid_oa_xml = set([line.strip('\n') for line in f.readlines()])
-
-with open('pmids_auth_xml.txt') as f:
-    pmid_auth_xml = set([line.strip('\n') for line in f.readlines()])
+pmid_oa_txt = load_pmid_array('pmids_oa_txt.txt')
+pmid_oa_xml = load_pmid_array('pmids_oa_xml.txt')
+pmid_auth_xml = load_pmid_array('pmids_auth_xml.txt')
 
 plt.figure(figsize=(5, 5), dpi=150)
-res = mv.venn3([set(pmid_map.keys()), pmid_oa_xml, pmid_auth_xml],
-            ('In PMC with PMID', 'OA subset', 'Author MS'))
+res = mv.venn3(subsets=venn_counts(to_pmid_array(pmid_map.keys()),
+                                   pmid_oa_xml, pmid_auth_xml),
+               set_labels=('In PMC with PMID', 'OA subset', 'Author MS'))
 
 for label in res.subset_labels:
     if label is not None:
@@ -0,0 +1,156 @@
+"""
+Compact PMID sets for full-text coverage analysis.
+
+PMID lists are kept as sorted, unique uint32 NumPy arrays instead of Python
+sets of strings, and are cached as .npy files next to the text files they
+are read from. A PmidIndex stores the PMIDs of many genes as one flat array
+with offsets (similar to a CSR matrix) so that the coverage of all genes in
+several corpora can be counted with a few vectorized calls.
+"""
+import os
+import numpy as np
+import pandas
+
+
+def to_pmid_array(pmids):
+    """Return a sorted array of unique PMIDs from an iterable of PMIDs.
+
+    PMCIDs (e.g., PMC12345) are also accepted and stored without prefix.
+    Missing values (None, NaN or NA, e.g., from a pandas column) and empty
+    strings are skipped.
+    """
+    pmids = [int(p[3:]) if isinstance(p, str) and p.startswith('PMC')
+             else int(p) for p in pmids if pandas.notnull(p) and p != '']
+    return np.unique(np.array(pmids, dtype=np.uint32))
+
+
+def load_pmid_array(fname):
+    """Load a text file with one PMID per line as a sorted uint32 array.
+
+    The array is saved as a .npy file on first use and memory-mapped from
+    there afterwards, as long as it is newer than the text file.
+    """
+    npy_fname = os.path.splitext(fname)[0] + '.npy'
+    if os.path.exists(npy_fname) and \
+            os.path.getmtime(npy_fname) >= os.path.getmtime(fname):
+        return np.load(npy_fname, mmap_mode='r')
+    with open(fname, 'r') as fh:
+        pmids = to_pmid_array(line.strip() for line in fh)
+    np.save(npy_fname, pmids)
+    return pmids
+
+
+def contains(corpus, pmids):
+    """Return a boolean array telling which PMIDs are in a sorted corpus."""
+    if len(corpus) == 0:
+        return np.zeros(len(pmids), dtype=bool)
+    idx = np.searchsorted(corpus, pmids)
+    idx[idx == len(corpus)] = 0
+    return corpus[idx] == pmids
+
+
+def venn_counts(*pmid_arrays):
+    """Return the sizes of all regions of a Venn diagram of PMID arrays.
+
+    The counts are in the order expected by the `subsets` argument of
+    matplotlib_venn.venn2 and venn3, i.e., indexed by the bit mask of the
+    arrays a PMID is in, starting with 1 (only in the first array).
+    """
+    union = pmid_arrays[0]
+    for pmids in pmid_arrays[1:]:
+        union = np.union1d(union, pmids)
+    codes = np.zeros(len(union), dtype=np.int64)
+    for ix, pmids in enumerate(pmid_arrays):
+        codes += contains(np.asarray(pmids), union).astype(np.int64) << ix
+    return tuple(np.bincount(codes, minlength=2 ** len(pmid_arrays))[1:])
+
+
+class PmidIndex(object):
+    """The PMIDs of a list of genes stored as a flat array with offsets.
+
+    Parameters
+    ----------
+    genes : list[str]
+        The gene names.
+    pmids : numpy.ndarray
+        The PMIDs of all genes concatenated, sorted within each gene.
+    offsets : numpy.ndarray
+        The start of each gene's PMIDs in `pmids`, with the total length
+        as the last element.
+    """
+    def __init__(self, genes, pmids, offsets):
+        self.genes = list(genes)
+        self.pmids = pmids
+        self.offsets = offsets
+        self._gene_ix = {gene: ix for ix, gene in enumerate(self.genes)}
+
+    @classmethod
+    def from_dict(cls, pmids_dict):
+        """Build an index from a dict of PMID lists keyed by gene."""
+        arrays = [to_pmid_array(refs) for refs in pmids_dict.values()]
+        offsets = np.zeros(len(arrays) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(a) for a in arrays])
+        pmids = np.concatenate(arrays) if arrays else \
+            np.zeros(0, dtype=np.uint32)
+        return cls(pmids_dict.keys(), pmids, offsets)
+
+    @classmethod
+    def load(cls, prefix):
+        """Load an index saved with `save`."""
+        with open(prefix + '_genes.txt', 'r') as fh:
+            genes = [line.strip('\n') for line in fh]
+        return cls(genes, np.load(prefix + '_pmids.npy', mmap_mode='r'),
+                   np.load(prefix + '_offsets.npy'))
+
+    def save(self, prefix):
+        """Save the index as .npy files (and a gene list) with a prefix."""
+        np.save(prefix + '_pmids.npy', self.pmids)
+        np.save(prefix + '_offsets.npy', self.offsets)
+        with open(prefix + '_genes.txt', 'w') as fh:
+            for gene in self.genes:
+                fh.write('%s\n' % gene)
+
+    def get(self, gene):
+        """Return the PMIDs of a gene."""
+        ix = self._gene_ix[gene]
+        return self.pmids[self.offsets[ix]:self.offsets[ix + 1]]
+
+    def counts(self):
+        """Return the number of PMIDs of each gene."""
+        return np.diff(self.offsets)
+
+    def unique(self):
+        """Return the union of the PMIDs of all genes."""
+        return np.unique(self.pmids)
+
+    def coverage(self, *corpora):
+        """Return the number of each gene's PMIDs contained in each corpus.
+
+        Parameters
+        ----------
+        *corpora : numpy.ndarray
+            Sorted arrays of PMIDs, e.g., the PMIDs with full text.
+
+        Returns
+        -------
+        numpy.ndarray
+            An array with one row per gene and one column per corpus.
+        """
+        counts = np.zeros((len(self.genes), len(corpora)), dtype=np.int64)
+        for ix, corpus in enumerate(corpora):
+            cum_found = np.concatenate(
+                [[0], np.cumsum(contains(corpus, self.pmids))])
+            counts[:, ix] = cum_found[self.offsets[1:]] - \
+                cum_found[self.offsets[:-1]]
+        return counts
+
+    def intersect(self, corpus):
+        """Return a new index with only the PMIDs contained in a corpus."""
+        found = contains(corpus, self.pmids)
+        cum_found = np.concatenate([[0], np.cumsum(found)])
+        return PmidIndex(self.genes, self.pmids[found],
+                         cum_found[self.offsets])
+
+    def to_dict(self):
+        """Return the PMID arrays keyed by gene."""
+        return {gene: self.get(gene) for gene in self.genes}
@@ -0,0 +1,143 @@
+"""
+Load the INDRA DB SIF dump (e.g., stmt_df.pkl or indra_db_sif_*.pkl, as
+generated by `indra_db.util.dump_sif`) from a columnar Parquet copy.
+
+The pickled data frame is converted once into a Parquet file next to it in
+which the namespace and ID columns are stored as categoricals and rows are
+sorted by agent A namespace and ID. Subsequent loads memory-map the Parquet
+file and push namespace/ID predicates down to the reader so that row groups
+which can't match are never read. This requires pyarrow, which is listed
+in requirements.txt in this folder.
+"""
+import os
+import time
+import pickle
+import logging
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+logger = logging.getLogger('sif_dump')
+
+
+categorical_columns = ['agA_ns', 'agA_id', 'agB_ns', 'agB_id']
+
+
+def get_parquet_path(fname):
+    """Return the path of the Parquet copy of a pickled SIF dump."""
+    return os.path.splitext(fname)[0] + '.parquet'
+
+
+def convert_sif_dump(pkl_fname, parquet_fname=None, row_group_size=1000000):
+    """Convert a pickled SIF dump data frame into a Parquet file.
+
+    Parameters
+    ----------
+    pkl_fname : str
+        The path to the pickled pandas DataFrame.
+    parquet_fname : Optional[str]
+        The path to the Parquet file to write. By default, the pickle's path
+        with a .parquet extension.
+    row_group_size : Optional[int]
+        The number of rows per row group. Smaller row groups allow more
+        fine-grained skipping when filtering but add some overhead.
+
+    Returns
+    -------
+    str
+        The path to the Parquet file that was written.
+    """
+    if parquet_fname is None:
+        parquet_fname = get_parquet_path(pkl_fname)
+    logger.info('Converting %s into %s' % (pkl_fname, parquet_fname))
+    ts = time.time()
+    with open(pkl_fname, 'rb') as fh:
+        df = pickle.load(fh)
+    for col in categorical_columns:
+        df[col] = df[col].astype('category')
+    # Sorting makes the row group statistics selective for agent A filters
+    df = df.sort_values(['agA_ns', 'agA_id']).reset_index(drop=True)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    pq.write_table(table, parquet_fname, row_group_size=row_group_size)
+    logger.info('Converted %d rows in %.1f seconds' %
+                (len(df), time.time() - ts))
+    return parquet_fname
+
+
+def get_filters(namespaces=None, ids=None, both_ns=True):
+    """Return pyarrow filters in disjunctive normal form for a SIF dump.
+
+    Parameters
+    ----------
+    namespaces : Optional[list[str]]
+        A list of namespaces (e.g., HGNC, FPLX) that agents have to be
+        grounded to.
+    ids : Optional[list[str]]
+        A list of IDs at least one of the agents has to have.
+    both_ns : Optional[bool]
+        If True, both agents need to be grounded to one of the namespaces,
+        otherwise, it is sufficient if either of them is. Default: True
+
+    Returns
+    -------
+    list[list[tuple]] or None
+        The filters or None if there is nothing to filter on.
+    """
+    if not namespaces and not ids:
+        return None
+    namespaces = list(namespaces) if namespaces else None
+    ids = list(ids) if ids else None
+    # Each element of the outer list is an OR-ed conjunction of predicates
+    if namespaces and both_ns:
+        ns_terms = [[('agA_ns', 'in', namespaces),
+                     ('agB_ns', 'in', namespaces)]]
+    elif namespaces:
+        ns_terms = [[('agA_ns', 'in', namespaces)],
+                    [('agB_ns', 'in', namespaces)]]
+    else:
+        ns_terms = [[]]
+    if not ids:
+        return ns_terms
+    return [terms + [(id_col, 'in', ids)] for terms in ns_terms
+            for id_col in ('agA_id', 'agB_id')]
+
+
+def load_sif_df(fname, namespaces=None, ids=None, both_ns=True,
+                columns=None):
+    """Return a SIF dump data frame filtered to the given namespaces and IDs.
+
+    If `fname` is a pickle file, it is converted to Parquet on first use
+    (and again whenever the pickle is newer than its Parquet copy).
+
+    Parameters
+    ----------
+    fname : str
+        The path to the pickled SIF dump or its Parquet copy.
+    namespaces : Optional[list[str]]
+        A list of namespaces agents have to be grounded to.
+    ids : Optional[list[str]]
+        A list of IDs at least one of the agents has to have.
+    both_ns : Optional[bool]
+        If True, both agents need to be grounded to one of the namespaces,
+        otherwise either of them. Default: True
+    columns : Optional[list[str]]
+        The columns to load. By default, all columns are loaded.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The filtered data frame with categorical namespace and ID columns.
+    """
+    if not fname.endswith('.parquet'):
+        parquet_fname = get_parquet_path(fname)
+        if not os.path.exists(parquet_fname) or \
+                os.path.getmtime(parquet_fname) < os.path.getmtime(fname):
+            convert_sif_dump(fname, parquet_fname)
+        fname = parquet_fname
+    ts = time.time()
+    table = pq.read_table(fname, columns=columns, memory_map=True,
+                          filters=get_filters(namespaces, ids, both_ns))
+    df = table.to_pandas()
+    logger.info('Loaded %d rows from %s in %.1f seconds' %
+                (len(df), fname, time.time() - ts))
+    return df
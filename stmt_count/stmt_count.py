@@ -5,7 +5,8 @@ It depends on two pre-computed files--entrez_all_pmids.json, which can be
 generated by running get_pmids.py in the `hgnc_all` subdirectory of the INDRA
 Apps repository. It also depends on a dump of the INDRA Database as a Pandas
 dataframe, which can be generated by running the `dump_sif.py` script in
-`indra_db.util`.
+`indra_db.util`. The dump is read through `sif_dump.load_sif_df`, which
+converts it once into a Parquet file next to it.
 """
 
 import os
@@ -14,10 +15,14 @@ import json
 import random
 import pickle
 import numpy as np
+import pandas as pd
 from matplotlib import pyplot as plt
+from sqlalchemy import func
+from sqlalchemy.exc import SQLAlchemyError
 from indra.util import read_unicode_csv
 from indra.databases import hgnc_client
 from indra_db.util import get_primary_db
+from sif_dump import load_sif_df
 
 def get_hgnc_entries():
     """Get approved HGNC entries as a list of (name, id) pairs."""
@@ -31,8 +36,80 @@ def get_hgnc_entries():
     return hgnc_entries
 
 
-def get_stmt_count_from_db():
-    """Not recommended, very slow."""
+def get_stmt_count_from_db_bulk(db=None, hgnc_entries=None,
+                                batch_size=10000):
+    """Get statement counts for all HGNC genes with a single GROUP BY query.
+
+    Every raw agent grounded to HGNC is joined to its raw statement and the
+    rows are counted per HGNC ID on the database side, so the whole count
+    takes one round trip instead of one query per gene. Any object exposing
+    `session`, `RawAgents` and `RawStatements` (e.g., a local SQLite
+    stand-in with the same schema) can be passed as `db`.
+
+    Parameters
+    ----------
+    db : Optional[indra_db.DatabaseManager]
+        The database to query. By default the primary database is used.
+    hgnc_entries : Optional[list[tuple]]
+        A list of (name, id) pairs of the genes to count. By default all
+        approved HGNC entries are used.
+    batch_size : Optional[int]
+        The number of result rows to stream from the server at a time.
+
+    Returns
+    -------
+    dict
+        A dict of statement counts keyed by HGNC gene name. Genes without
+        any statements have a count of 0.
+    """
+    if hgnc_entries is None:
+        hgnc_entries = get_hgnc_entries()
+    if db is None:
+        db = get_primary_db()
+    names_by_id = {hgnc_id: hgnc_name for hgnc_name, hgnc_id in hgnc_entries}
+    stmt_counts = {hgnc_name: 0 for hgnc_name, _ in hgnc_entries}
+
+    q = db.session.query(db.RawAgents.db_id,
+                         func.count(db.RawStatements.id)) \
+        .filter(db.RawAgents.stmt_id == db.RawStatements.id,
+                db.RawAgents.db_name.like('HGNC')) \
+        .group_by(db.RawAgents.db_id)
+    start = time.time()
+    for hgnc_id, stmt_count in q.yield_per(batch_size):
+        hgnc_name = names_by_id.get(str(hgnc_id))
+        # Skip IDs that are not (or no longer) approved HGNC entries
+        if hgnc_name is None:
+            continue
+        stmt_counts[hgnc_name] = stmt_count
+    print("Got statement counts for %d genes in %.2f sec" %
+          (len(stmt_counts), time.time() - start))
+    return stmt_counts
+
+
+def get_stmt_count_for_gene(db, hgnc_id):
+    """Get the number of raw statements with an agent grounded to a gene."""
+    q = db.filter_query(db.RawStatements,
+                        db.RawAgents.stmt_id == db.RawStatements.id,
+                        db.RawAgents.db_name.like('HGNC'),
+                        db.RawAgents.db_id.like(str(hgnc_id)))
+    return q.count()
+
+
+def get_stmt_count_from_db(bulk=True):
+    """Get statement counts for all HGNC genes from the database.
+
+    By default, the counts are obtained by a single aggregate query (see
+    `get_stmt_count_from_db_bulk`). If that query fails with a database
+    error (e.g., a statement timeout), or if `bulk` is False, one query is
+    run per gene (see `get_stmt_count_for_gene`) with checkpointing so that
+    an interrupted run can be resumed; this is very slow.
+    """
+    if bulk:
+        try:
+            return get_stmt_count_from_db_bulk()
+        except SQLAlchemyError as e:
+            print("Bulk count failed (%s), falling back to per-gene "
+                  "queries" % e)
     hgnc_entries = get_hgnc_entries()
     random.seed(1)
     random.shuffle(hgnc_entries)
@@ -59,13 +136,8 @@ def get_stmt_count_from_db():
             print("Saving checkpoint")
             with open(CHECKPOINT_FILE, 'wb') as f:
                 pickle.dump((ix, stmt_counts), f)
-        # Run the query
-        q = db.filter_query(db.RawStatements,
-                db.RawAgents.stmt_id == db.RawStatements.id,
-                 db.RawAgents.db_name.like('HGNC'),
-                 db.RawAgents.db_id.like(str(hgnc_id)))
         # Get the statement count
-        stmt_count = q.count()
+        stmt_count = get_stmt_count_for_gene(db, hgnc_id)
         # Print some stats
         elapsed = time.time() - start
         time_per_gene = elapsed / (ix - start_ix + 1)
@@ -79,30 +151,81 @@ def get_stmt_count_from_db():
         stmt_counts[hgnc_name] = stmt_count
     # Save final results
     with open(CHECKPOINT_FILE, 'wb') as f:
-        pickle.dump(len(hgnc_entries), stmt_counts)
+        pickle.dump((len(hgnc_entries), stmt_counts), f)
 
     return stmt_counts
 
 
-def get_stmt_count_from_stmt_df(df_filename):
-    with open(df_filename, 'rb') as f:
-        df = pickle.load(f)
-    df_A = df[df['agA_ns'] == 'HGNC'].groupby('agA_id').agg(
-            {'evidence_count': 'sum'})
-    df_B = df[df['agB_ns'] == 'HGNC'].groupby('agB_id').agg(
-                                        {'evidence_count': 'sum'})
-    df_AB = df[(df['agA_ns'] == 'HGNC') &
-               (df['agB_ns'] == 'HGNC') &
-               (df['agA_id'] == df['agB_id'])].groupby('agA_id').agg(
-                                        {'evidence_count': 'sum'})
-    # Combine the counts
-    df_join = df_A.join(df_B, lsuffix='A', rsuffix='B').join(df_AB)
-    df_join = df_join.fillna(value=0)
-    stmt_counts = (df_join['evidence_countA'] +
-                   df_join['evidence_countB'] -
-                   df_join['evidence_count'])
+def get_evidence_counts(df, namespaces):
+    """Return the total evidence count of each agent in a SIF data frame.
 
-    return stmt_counts
+    The counts are aggregated in a single pass: the (namespace, ID) pairs of
+    both agent columns are factorized into integer codes and the evidence
+    counts are summed per code with a weighted bincount. Rows in which both
+    agents are the same entity are only counted once for that entity.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        A SIF dump data frame with agA_ns, agA_id, agB_ns, agB_id and
+        evidence_count columns.
+    namespaces : list[str]
+        The namespaces (e.g., HGNC, FPLX, CHEBI) to count agents for.
+
+    Returns
+    -------
+    pandas.Series
+        The evidence counts indexed by (namespace, ID).
+    """
+    nrows = len(df)
+    ns = np.concatenate([df['agA_ns'].to_numpy(dtype=object),
+                         df['agB_ns'].to_numpy(dtype=object)])
+    ids = np.concatenate([df['agA_id'].to_numpy(dtype=object),
+                          df['agB_id'].to_numpy(dtype=object)])
+    # Missing namespaces and IDs get the code -1, and the agents with either
+    # missing are dropped rather than combined into a code of another pair
+    ns_codes, ns_uniques = pd.factorize(ns, use_na_sentinel=True)
+    id_codes, id_uniques = pd.factorize(ids, use_na_sentinel=True)
+    valid = (ns_codes >= 0) & (id_codes >= 0)
+    # Combine the two codes into a single code per (namespace, ID) pair
+    codes = np.full(len(ns), -1, dtype=np.int64)
+    codes[valid], pair_uniques = pd.factorize(
+        ns_codes[valid].astype(np.int64) * len(id_uniques) + id_codes[valid])
+    codes_A, codes_B = codes[:nrows], codes[nrows:]
+
+    in_ns = valid & np.isin(ns_codes, [ix for ix, n in enumerate(ns_uniques)
+                                       if n in namespaces])
+    ev_counts = df['evidence_count'].to_numpy(dtype=np.float64)
+    weights_A = np.where(in_ns[:nrows], ev_counts, 0)
+    weights_B = np.where(in_ns[nrows:] & (codes_A != codes_B), ev_counts, 0)
+    weights = np.concatenate([weights_A, weights_B])
+    counts = np.bincount(codes[valid], weights=weights[valid],
+                         minlength=len(pair_uniques))
+
+    pair_ns = ns_uniques[pair_uniques // len(id_uniques)]
+    pair_ids = id_uniques[pair_uniques % len(id_uniques)]
+    keep = np.isin(pair_ns, list(namespaces))
+    index = pd.MultiIndex.from_arrays([pair_ns[keep], pair_ids[keep]],
+                                      names=['namespace', 'id'])
+    return pd.Series(counts[keep], index=index).sort_index()
+
+
+def get_stmt_count_from_stmt_df(df_filename, namespaces=None):
+    """Return the total evidence count of agents in the INDRA DB dump.
+
+    If no namespaces are given, the counts of HGNC genes are returned,
+    indexed by HGNC ID. Otherwise, the counts of all agents in any of the
+    given namespaces are returned, indexed by (namespace, ID).
+    """
+    # Only rows with at least one agent in the namespaces are read
+    df = load_sif_df(df_filename,
+                     namespaces=namespaces if namespaces else ['HGNC'],
+                     both_ns=False,
+                     columns=['agA_ns', 'agA_id', 'agB_ns', 'agB_id',
+                              'evidence_count'])
+    if namespaces:
+        return get_evidence_counts(df, namespaces)
+    return get_evidence_counts(df, ['HGNC']).loc['HGNC']
 
 
 if __name__ == '__main__':
@@ -0,0 +1,78 @@
+"""
+Tests of the statement counts from the INDRA Database against a local
+SQLite database with the columns of the raw statement and agent tables
+that are queried. Run with pytest from this folder.
+"""
+import os
+import sys
+import random
+import pytest
+sqlalchemy = pytest.importorskip('sqlalchemy')
+for module in ['matplotlib', 'pyarrow', 'indra', 'indra_db']:
+    pytest.importorskip(module)
+from sqlalchemy import create_engine, Column, Integer, String, ForeignKey
+from sqlalchemy.orm import declarative_base, sessionmaker
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import stmt_count
+
+
+Base = declarative_base()
+
+
+class RawStatements(Base):
+    __tablename__ = 'raw_statements'
+    id = Column(Integer, primary_key=True)
+
+
+class RawAgents(Base):
+    __tablename__ = 'raw_agents'
+    id = Column(Integer, primary_key=True)
+    stmt_id = Column(Integer, ForeignKey('raw_statements.id'))
+    db_name = Column(String)
+    db_id = Column(String)
+
+
+class SqliteDb(object):
+    """The part of indra_db.DatabaseManager used to count statements."""
+    RawStatements = RawStatements
+    RawAgents = RawAgents
+
+    def __init__(self, fname):
+        engine = create_engine('sqlite:///%s' % fname)
+        Base.metadata.create_all(engine)
+        self.session = sessionmaker(bind=engine)()
+
+    def filter_query(self, tbl, *args):
+        return self.session.query(tbl).filter(*args)
+
+
+@pytest.fixture
+def db(tmpdir):
+    """A database of random statements, some with agents grounded to the
+    same gene twice, to other namespaces or to unapproved HGNC IDs."""
+    db = SqliteDb(str(tmpdir.join('db.sqlite')))
+    rng = random.Random(1)
+    agent_id = 0
+    for stmt_id in range(1, 501):
+        db.session.add(RawStatements(id=stmt_id))
+        for _ in range(rng.randint(1, 3)):
+            agent_id += 1
+            db_name = rng.choice(['HGNC', 'HGNC', 'FPLX', 'UP'])
+            db.session.add(RawAgents(id=agent_id, stmt_id=stmt_id,
+                                     db_name=db_name,
+                                     db_id=str(rng.randint(1, 40))))
+    db.session.commit()
+    return db
+
+
+def test_bulk_matches_per_gene(db):
+    # Genes 31 to 40 are not approved and ID 99 has no statements
+    hgnc_entries = [('GENE%d' % ix, str(ix)) for ix in range(1, 31)] + \
+        [('GENE99', '99')]
+    bulk_counts = stmt_count.get_stmt_count_from_db_bulk(
+        db=db, hgnc_entries=hgnc_entries, batch_size=7)
+    gene_counts = {hgnc_name: stmt_count.get_stmt_count_for_gene(db, hgnc_id)
+                   for hgnc_name, hgnc_id in hgnc_entries}
+    assert bulk_counts == gene_counts
+    assert bulk_counts['GENE99'] == 0
+    assert sum(bulk_counts.values()) > 100
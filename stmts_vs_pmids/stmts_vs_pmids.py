@@ -1,91 +1,358 @@
+import copy
+import json
+import time
+import resource
+import multiprocessing
 import numpy as np
 from matplotlib import pyplot as plt
 from indra_db.query_db_stmts import *
 from indra.util import plot_formatting as pf
-from indra.tools import assemble_corpus as ac
 from indra.belief import BeliefEngine
 from indra.preassembler import Preassembler
 from indra.ontology.bio import bio_ontology
 
-# Get all the statements
-stmts = get_statements()
-#stmts = by_gene_role_type(stmt_type='Phosphorylation')
-#with open('entrez_stmts.pkl', 'wb') as f:
-#    pickle.dump(stmts, f)
 
-#with open('entrez_stmts.pkl', 'rb') as f:
-#    pickle.load(f)
+class IncrementalPreassembler(object):
+    """Keep the duplicate and refinement state of a growing statement set.
 
-# Get PMID dict
-stmts_by_pmid = {}
+    Statements added in a batch are deduplicated against the existing unique
+    statements by hash, and their evidence against the evidence of the
+    unique statement by the key Preassembler.combine_duplicate_stmts uses.
+    Refinements are only searched among the new unique statements and
+    between the new and the existing ones, so the state is never rebuilt
+    from scratch.
 
-for stmt in stmts:
-    if len(stmt.evidence) > 1:
-        print("WARNING: Statement has more than one piece of evidence.")
-    pmid = stmt.evidence[0].pmid
-    if pmid in stmts_by_pmid:
-        stmts_by_pmid[pmid].append(stmt)
+    Preassembler's public combine_related only preassembles a whole
+    statement list at once, so refinements are found with its private
+    _generate_id_maps, as combine_related does. This relies on the
+    behavior of _generate_id_maps in INDRA 1.22: it returns (refining,
+    refined) pairs of indices into the list of unique statements, and with
+    split_idx it only compares the statements up to and including split_idx
+    with those after it. It is only called in _find_refinements.
+    """
+    def __init__(self, ontology):
+        self.pa = Preassembler(ontology)
+        if not hasattr(self.pa, '_generate_id_maps'):
+            raise RuntimeError('IncrementalPreassembler requires '
+                               'Preassembler._generate_id_maps, see the '
+                               'class docstring for the INDRA version it '
+                               'was written against.')
+        self.num_raw = 0
+        self.unique_stmts = []
+        self.idx_by_hash = {}
+        # The keys of the evidence of each unique statement
+        self.ev_keys = []
+        # Pairs of (more specific, more general) unique statement indices
+        self.refinements = set()
+
+    def add_statements(self, stmts):
+        self.num_raw += len(stmts)
+        start_idx = len(self.unique_stmts)
+        for stmt in stmts:
+            stmt_hash = stmt.get_hash(shallow=True)
+            idx = self.idx_by_hash.get(stmt_hash)
+            if idx is None:
+                idx = self.idx_by_hash[stmt_hash] = len(self.unique_stmts)
+                uniq_stmt = copy.copy(stmt)
+                uniq_stmt.evidence = []
+                uniq_stmt.supports = []
+                uniq_stmt.supported_by = []
+                self.unique_stmts.append(uniq_stmt)
+                self.ev_keys.append(set())
+            self._add_evidence(idx, stmt)
+        new_stmts = self.unique_stmts[start_idx:]
+        if not new_stmts:
+            return
+        # Refinements among the new statements
+        self.refinements |= {(i + start_idx, j + start_idx) for i, j in
+                             self._find_refinements(new_stmts)}
+        # Refinements between the new and the existing statements
+        if start_idx:
+            self.refinements |= self._find_refinements(
+                self.unique_stmts, split_idx=start_idx - 1)
+
+    def _add_evidence(self, idx, stmt):
+        """Add the evidence of a statement to a unique statement, skipping
+        evidence it already has, as Preassembler.combine_duplicate_stmts
+        does."""
+        agents = stmt.agent_list(deep_sorted=True)
+        raw_text = [None if ag is None else ag.db_refs.get('TEXT')
+                    for ag in agents]
+        raw_grounding = [None if ag is None else ag.db_refs for ag in agents]
+        agents_key = str(raw_text) + str(raw_grounding)
+        ev_keys = self.ev_keys[idx]
+        for ev in stmt.evidence:
+            ev_key = ev.matches_key() + agents_key
+            if ev_key not in ev_keys:
+                ev_keys.add(ev_key)
+                self.unique_stmts[idx].evidence.append(ev)
+
+    def _find_refinements(self, stmts, split_idx=None):
+        """Return (more specific, more general) index pairs of refinements
+        among unique statements."""
+        # With split_idx=0, INDRA compares all the statements, which finds
+        # the pairs among the new statements again but no spurious ones
+        return set(self.pa._generate_id_maps(stmts, split_idx=split_idx))
+
+    def get_toplevel(self):
+        """Return the unique statements not refined by any other one."""
+        refined = {j for _, j in self.refinements}
+        return [stmt for idx, stmt in enumerate(self.unique_stmts)
+                if idx not in refined]
+
+
+def get_stmts_by_pmid(stmts):
+    stmts_by_pmid = {}
+    for stmt in stmts:
+        if len(stmt.evidence) > 1:
+            print("WARNING: Statement has more than one piece of evidence.")
+        pmid = stmt.evidence[0].pmid
+        if pmid in stmts_by_pmid:
+            stmts_by_pmid[pmid].append(stmt)
+        else:
+            stmts_by_pmid[pmid] = [stmt]
+    return stmts_by_pmid
+
+
+# The statement corpus as a flat list with the statements of the i-th PMID
+# at corpus_stmts[corpus_offsets[i]:corpus_offsets[i+1]]. It is set before
+# the worker processes are forked so that they share it copy-on-write.
+corpus_stmts = []
+corpus_offsets = np.zeros(1, dtype=np.int64)
+
+
+def set_corpus(stmts_by_pmid):
+    global corpus_stmts, corpus_offsets
+    corpus_stmts = [s for pmid_stmts in stmts_by_pmid.values()
+                    for s in pmid_stmts]
+    corpus_offsets = np.zeros(len(stmts_by_pmid) + 1, dtype=np.int64)
+    corpus_offsets[1:] = np.cumsum([len(pmid_stmts) for pmid_stmts
+                                    in stmts_by_pmid.values()])
+
+
+def get_sample_stmts(pmid_idxs):
+    """Return the statements of PMIDs given by their index in the corpus."""
+    return [s for ix in pmid_idxs
+            for s in corpus_stmts[corpus_offsets[ix]:corpus_offsets[ix + 1]]]
+
+
+def count_belief_filtered(stmts_top, belief_cutoff=0.90):
+    """Return the number of top-level statements above a belief cutoff.
+
+    Top-level statements are not refined by any other statement, so they get
+    no evidence from more specific ones and their belief is the prior belief
+    of their own evidence. It is computed here in the same way for fresh and
+    nested trials.
+    """
+    be = BeliefEngine()
+    be.set_prior_probs(stmts_top)
+    return len([stmt for stmt in stmts_top if stmt.belief >= belief_cutoff])
+
+
+def run_trial(pmid_sample_size, rng, poolsize=None):
+    """Return raw/unique/top-level/filtered counts for a fresh sample."""
+    sample_idxs = rng.choice(len(corpus_offsets) - 1, pmid_sample_size,
+                             replace=False)
+    trial_stmts = get_sample_stmts(sample_idxs)
+    #
+    pa = Preassembler(bio_ontology, trial_stmts)
+    trial_stmts_top = pa.combine_related(poolsize=poolsize,
+                                         return_toplevel=True)
+    trial_stmts_uniq = pa.unique_stmts
+    #trial_stmts_uniq = ac.run_preassembly_duplicate(pa, be)
+    return (len(trial_stmts), len(trial_stmts_uniq), len(trial_stmts_top),
+            count_belief_filtered(trial_stmts_top))
+
+
+def run_nested_trial(sample_sizes, rng):
+    """Return counts at each of a list of increasing, nested sample sizes.
+
+    A single random ordering of the PMIDs is drawn and the statements of
+    each further slice of PMIDs are added to the same incremental
+    preassembly state, recording the raw/unique/top-level/belief-filtered
+    counts at each sample size.
+    """
+    num_pmids = len(corpus_offsets) - 1
+    if max(sample_sizes) > num_pmids:
+        raise ValueError('Sample size %d is larger than the %d PMIDs in the '
+                         'corpus.' % (max(sample_sizes), num_pmids))
+    sample_idxs = rng.permutation(num_pmids)
+    ipa = IncrementalPreassembler(bio_ontology)
+    counts = []
+    prev_size = 0
+    for pmid_sample_size in sample_sizes:
+        print("Sample size: %d" % pmid_sample_size)
+        ipa.add_statements(get_sample_stmts(
+            sample_idxs[prev_size:pmid_sample_size]))
+        prev_size = pmid_sample_size
+        stmts_top = ipa.get_toplevel()
+        counts.append((ipa.num_raw, len(ipa.unique_stmts), len(stmts_top),
+                       count_belief_filtered(stmts_top)))
+    return counts
+
+
+# The default number of trials run in parallel, bounded since the largest
+# trials hold a large part of the corpus in memory
+default_num_procs = min(4, multiprocessing.cpu_count())
+
+
+def get_proc_status_mb(field):
+    """Return a memory field of /proc/self/status in MB, or None if it
+    isn't available."""
+    try:
+        with open('/proc/self/status', 'r') as fh:
+            for line in fh:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) / 1024.
+    except IOError:
+        pass
+    return None
+
+
+def start_peak_rss():
+    """Reset the peak RSS of this process and return its current RSS in MB.
+
+    On Linux, the peak RSS (VmHWM) is reset to the current RSS so that the
+    peak of the next task can be measured even though a forked process
+    inherits the peak of its parent. Returns None if this isn't supported.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as fh:
+            fh.write('5')
+    except IOError:
+        return None
+    return get_proc_status_mb('VmRSS')
+
+
+def run_job(job):
+    """Run a single trial and time it.
+
+    Returns the job, the trial's counts, its wall time in seconds and a
+    dict of its memory use in MB. peak_rss_mb is the peak RSS during the
+    trial and rss_delta_mb the peak minus the RSS at the start of the
+    trial, with rss_method set to VmHWM. Where the peak RSS can't be reset,
+    peak_rss_mb is the peak RSS of the whole process (including that
+    inherited from the parent), rss_delta_mb is None and rss_method is
+    ru_maxrss.
+    """
+    sample_sizes, seed, poolsize, incremental = job
+    rng = np.random.RandomState(seed)
+    start_rss = start_peak_rss()
+    start = time.time()
+    if incremental:
+        counts = run_nested_trial(sample_sizes, rng)
     else:
-        stmts_by_pmid[pmid] = [stmt]
-
-# Get all the statements
-pmids = list(stmts_by_pmid.keys())
-#num_trials = 3
-
-sample_sizes_trials = [(10, 10), (30, 10), (100, 5), (300, 3),
-                (1000, 3), (3000, 1), (10000, 1),
-                (30000, 1), (100000, 1), (275000, 1)]
-sample_sizes = [t[0] for t in sample_sizes_trials]
-
-results = []
-results_uniq = []
-results_top = []
-results_filt = []
-
-for pmid_sample_size, num_trials in sample_sizes_trials:
-    print("\n\nSample size: %d\n\n" % pmid_sample_size)
-    trial_results = []
-    trial_results_uniq = []
-    trial_results_top = []
-    trial_results_filt = []
-    for i in range(num_trials):
-        sample_pmids = np.random.choice(pmids, pmid_sample_size, replace=False)
-        trial_stmts = [s for pmid in sample_pmids for s in stmts_by_pmid[pmid]]
-        trial_results.append(len(trial_stmts))
-        #
-        be = BeliefEngine()
-        pa = Preassembler(bio_ontology, trial_stmts)
-        trial_stmts_top = pa.combine_related(poolsize=16, return_toplevel=True)
-        trial_stmts_uniq = pa.unique_stmts
-        trial_stmts_filt = ac.filter_belief(trial_stmts_top, 0.90)
-        #trial_stmts_uniq = ac.run_preassembly_duplicate(pa, be)
-        trial_results_uniq.append(len(trial_stmts_uniq))
-        trial_results_top.append(len(trial_stmts_top))
-        trial_results_filt.append(len(trial_stmts_filt))
-
-    results.append((np.mean(trial_results), np.std(trial_results)))
-    results_uniq.append((np.mean(trial_results_uniq), np.std(trial_results_uniq)))
-    results_top.append((np.mean(trial_results_top), np.std(trial_results_top)))
-    results_filt.append((np.mean(trial_results_filt), np.std(trial_results_filt)))
-
-results = np.array(results)
-results_uniq = np.array(results_uniq)
-results_top = np.array(results_top)
-results_filt = np.array(results_filt)
-
-plt.ion()
-
-plt.figure(figsize=(3, 3), dpi=150)
-plt.plot(sample_sizes, results[:,0], label='Raw', marker='.')
-plt.plot(sample_sizes, results_uniq[:,0], label='Unique', marker='.')
-plt.plot(sample_sizes, results_top[:, 0], label='Top-level', marker='.')
-plt.plot(sample_sizes, results_filt[:,0], label='P 0.9', marker='.')
-
-#pf.set_fig_params()
-ax = plt.gca()
-ax.set_xscale('log')
-ax.set_yscale('log')
-pf.format_axis(ax, tick_padding=3, label_padding=3)
-ax.set_xlabel('Number of Articles')
-ax.set_ylabel('Number of Statements')
-plt.legend(loc='lower right', frameon=False)
+        counts = [run_trial(sample_sizes[0], rng, poolsize)]
+    elapsed = time.time() - start
+    if start_rss is not None:
+        peak_rss = get_proc_status_mb('VmHWM')
+        memory = {'peak_rss_mb': peak_rss,
+                  'rss_delta_mb': peak_rss - start_rss,
+                  'rss_method': 'VmHWM'}
+    else:
+        # ru_maxrss is in kilobytes on Linux
+        memory = {'peak_rss_mb': resource.getrusage(
+                      resource.RUSAGE_SELF).ru_maxrss / 1024.,
+                  'rss_delta_mb': None,
+                  'rss_method': 'ru_maxrss'}
+    return job, counts, elapsed, memory
+
+
+def get_counts(stmts_by_pmid, sample_sizes_trials, incremental=True,
+               num_procs=default_num_procs, stats_file='trial_stats.jsonl'):
+    """Return the raw/unique/top-level/filtered counts of all trials.
+
+    Returns a list with one list of count tuples per sample size. In
+    incremental mode, trial i draws nested samples up to the largest sample
+    size with more than i trials, so the curve takes about one pass over
+    the data. Trials are run in parallel in `num_procs` forked worker
+    processes, one process per trial; the wall time and the memory use of
+    each trial (see `run_job`) are appended to `stats_file`. If `num_procs` is 1, the trials
+    run in this process.
+    """
+    set_corpus(stmts_by_pmid)
+    seeds = iter(np.random.randint(2**31, size=sum(
+        num_trials for _, num_trials in sample_sizes_trials)))
+    if incremental:
+        max_trials = max(num_trials for _, num_trials in sample_sizes_trials)
+        jobs = [([size for size, num_trials in sample_sizes_trials
+                  if num_trials > i], next(seeds), None, True)
+                for i in range(max_trials)]
+    else:
+        # Preassembly can only use its own process pool if we aren't
+        # already running in a pool worker
+        poolsize = 16 if num_procs == 1 else None
+        jobs = [([size], next(seeds), poolsize, False)
+                for size, num_trials in sample_sizes_trials
+                for i in range(num_trials)]
+
+    if num_procs == 1:
+        results = map(run_job, jobs)
+    else:
+        pool = multiprocessing.get_context('fork').Pool(num_procs,
+                                                        maxtasksperchild=1)
+        results = pool.imap_unordered(run_job, jobs)
+
+    counts = [[] for _ in sample_sizes_trials]
+    sizes = [size for size, _ in sample_sizes_trials]
+    with open(stats_file, 'a') as fh:
+        for (job_sizes, seed, _, _), job_counts, elapsed, memory in \
+                results:
+            print("Trial up to %d PMIDs took %.1f sec, peak RSS %.1f MB "
+                  "(%s)" % (job_sizes[-1], elapsed, memory['peak_rss_mb'],
+                            memory['rss_method']))
+            stats = {'incremental': incremental,
+                     'sample_sizes': job_sizes,
+                     'seed': int(seed),
+                     'time': elapsed}
+            stats.update(memory)
+            fh.write(json.dumps(stats) + '\n')
+            for size, size_counts in zip(job_sizes, job_counts):
+                counts[sizes.index(size)].append(size_counts)
+    if num_procs != 1:
+        pool.close()
+        pool.join()
+    return counts
+
+
+if __name__ == '__main__':
+    # Get all the statements
+    stmts = get_statements()
+    #stmts = by_gene_role_type(stmt_type='Phosphorylation')
+    #with open('entrez_stmts.pkl', 'wb') as f:
+    #    pickle.dump(stmts, f)
+
+    #with open('entrez_stmts.pkl', 'rb') as f:
+    #    pickle.load(f)
+
+    # Get PMID dict
+    stmts_by_pmid = get_stmts_by_pmid(stmts)
+
+    sample_sizes_trials = [(10, 10), (30, 10), (100, 5), (300, 3),
+                    (1000, 3), (3000, 1), (10000, 1),
+                    (30000, 1), (100000, 1), (275000, 1)]
+    sample_sizes = [t[0] for t in sample_sizes_trials]
+
+    counts = get_counts(stmts_by_pmid, sample_sizes_trials)
+    # Mean and standard deviation of each count by sample size
+    counts = np.array([(np.mean(c, axis=0), np.std(c, axis=0))
+                       for c in counts])
+    results, results_uniq, results_top, results_filt = \
+        [counts[:, :, i] for i in range(4)]
+
+    plt.ion()
+
+    plt.figure(figsize=(3, 3), dpi=150)
+    plt.plot(sample_sizes, results[:,0], label='Raw', marker='.')
+    plt.plot(sample_sizes, results_uniq[:,0], label='Unique', marker='.')
+    plt.plot(sample_sizes, results_top[:, 0], label='Top-level', marker='.')
+    plt.plot(sample_sizes, results_filt[:,0], label='P 0.9', marker='.')
+
+    #pf.set_fig_params()
+    ax = plt.gca()
+    ax.set_xscale('log')
+    ax.set_yscale('log')
+    pf.format_axis(ax, tick_padding=3, label_padding=3)
+    ax.set_xlabel('Number of Articles')
+    ax.set_ylabel('Number of Statements')
+    plt.legend(loc='lower right', frameon=False)
@@ -17,9 +17,11 @@ from indra.preassembler import Preassembler, render_stmt_graph, ontology_mapper
 from indra.statements import Influence, Concept
 from indra.assemblers.cag import CAGAssembler
 from indra.assemblers.pysb import PysbAssembler
-from indra.explanation.model_checker import PysbModelChecker
 from indra.preassembler.hierarchy_manager import HierarchyManager
 from indra.assemblers.pysb.bmi_wrapper import BMIModel
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir))
+from im_cache import get_model_checker as get_cached_model_checker
 
 
 # This is a mapping to MITRE's 10 document IDs from our file names
@@ -432,9 +434,8 @@ def make_pysb_model(statements):
 
 def get_model_checker(model):
     stmt = Influence(Concept('Crop_production'), Concept('Food_security'))
-    mc = PysbModelChecker(model, [stmt])
-    mc.prune_influence_map()
-    return mc
+    # The pruned influence map is cached by model and statements
+    return get_cached_model_checker(model, [stmt])
 
 
 def remap_pmids(stmts):